@@ -0,0 +1,285 @@
+#-------------------------------------------------------------------------------
+# Name: RunBenchmarks.py
+# Purpose: This script times the array engines of the three tools of PG-Tools on synthetic
+#          inventories (SyntheticData.py) of increasing size, without ArcGIS Pro:
+#            DivideforWatersheds.py:         fill_basin (fill, flow direction, basins) and merge
+#            AddBasicGlacierAttributes.py:   pgi_id, age_join and age_stats
+#            AddDerivedGlacierAttributes.py: zonal_stats, ela_kernels and area_3d
+#          The numba kernels are compiled on a small warm-up inventory first, so that the
+#          timings do not include the compilation. The best and all times of each stage and tier
+#          are written as JSON, which can be compared with the JSON of an earlier version with
+#          --baseline to see the regressions. Before the timings, the AABR ELAs of the batched,
+#          sweep and Monte Carlo kernels are checked against the original AABR loop on flat and
+#          random glaciers, and the raster store is checked to read the NoData of float and
+#          integer rasters back as NoData.
+#
+#          Usage: python RunBenchmarks.py --tiers 100,1000,10000,100000 --output bench.json
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import sys
+import json
+import shutil
+import time
+import argparse
+import tempfile
+import platform
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python"))
+import AgeStats
+import BasinMerge
+import ELAKernels
+import GlacierZones
+import HydroCore
+import HydroTiles
+import NumbaCompat
+import PGIDEngine
+import RasterStore
+import Vectorize
+import SyntheticData
+
+Stages = ["fill_basin", "merge", "pgi_id", "age_join", "age_stats", "zonal_stats", "ela_kernels", "area_3d"]
+
+def PGIIDs(wkbs, lon, lat, prefix):
+    ##Label points of the outlines and the PGI_IDs with the suffix of the duplicates, the same as
+    ##AddBasicGlacierAttributes.py. The projection to WGS 1984 needs arcpy, so the PGI_IDs are
+    ##formatted from the synthetic centroids
+    PGIDEngine.InsidePoints(wkbs)
+    return PGIDEngine.UniqueIDs(PGIDEngine.FormatPGIIDs(lon, lat, prefix))
+
+def RunStages(data, tileSize, stages):
+    ##Run the stages once on an inventory. Returns the seconds of each stage
+    times = {}
+    nGlaciers = len(data["polygons"])
+    cellSize = data["cellSize"]
+    results = {}
+
+    def Timed(name, function):
+        start = time.perf_counter()
+        results[name] = function()
+        times[name] = time.perf_counter() - start
+
+    ##DivideforWatersheds.py
+    if "fill_basin" in stages or "merge" in stages:
+        if tileSize > 0:
+            tileFolder = tempfile.mkdtemp(prefix="pgtools_tiles_")
+            Timed("fill_basin", lambda: HydroTiles.TiledFillFlowBasin(data["dem"], tileSize, tileFolder))
+            shutil.rmtree(tileFolder, ignore_errors=True)
+        else:
+            Timed("fill_basin", lambda: HydroCore.FillFlowBasin(data["dem"]))
+        filled, fdir, basins = results["fill_basin"]
+        basins = np.array(basins)
+        basins[data["labels"] == 0] = 0
+        if "merge" in stages:
+            ##Default minimum relief (300 m) and minimum area (5 cells) of DivideforWatersheds.py
+            Timed("merge", lambda: BasinMerge.MergeBasins(basins, filled, 0, cellSize * cellSize, 300.0, 5 * cellSize * cellSize))
+        del filled, fdir, basins
+
+    ##AddBasicGlacierAttributes.py
+    if "pgi_id" in stages:
+        wkbs = [Vectorize.PolygonWKB(rings) for polyID, rings in data["polygons"]]
+        Timed("pgi_id", lambda: PGIIDs(wkbs, data["lon"], data["lat"], "PGI_LGM_"))
+    if "age_join" in stages or "age_stats" in stages:
+        Timed("age_join", lambda: AgeStats.WithinDistanceJoin(data["ageXY"], data["polygons"], 150.0))
+        joinIDs = results["age_join"]
+        joined = joinIDs >= 0
+        if "age_stats" in stages and joined.any():
+            Timed("age_stats", lambda: AgeStats.GroupedAgeStats(joinIDs[joined], data["ages"][joined], data["sites"][joined]))
+
+    ##AddDerivedGlacierAttributes.py
+    labels = data["labels"]
+    surface = data["surface"]
+    if "zonal_stats" in stages:
+        def ZonalPass():
+            slope, aspect = GlacierZones.SlopeAspect(np.pad(surface, 1, constant_values=np.nan), cellSize, cellSize)
+            cells, offsets = GlacierZones.ZoneCells(labels, nGlaciers)
+            return GlacierZones.ZonalStats([surface, slope, aspect, data["thickness"]], [False, False, True, False], cells, offsets)
+        Timed("zonal_stats", ZonalPass)
+    if "ela_kernels" in stages:
+        def ELAPass():
+            EleFlat, offsets = GlacierZones.LabelOffsets(labels, surface, nGlaciers)
+            EleFlat = EleFlat.astype(int)
+            GlacierZones.HypsometricStats(EleFlat, offsets)
+            ELAKernels.ELA_AAR_MGE_Batch(EleFlat, offsets, 50, 0.6)
+            ELAKernels.ELA_AA_AABR_Batch(EleFlat, offsets, 50, 1.6)
+        Timed("ela_kernels", ELAPass)
+    if "area_3d" in stages:
+        Timed("area_3d", lambda: GlacierZones.SurfaceAreaRatio(labels, surface, nGlaciers, cellSize, cellSize))
+    return times
+
+def ReferenceAABR(EleArr, interval, AABRratio):
+    ##AABR ELA of the original loop of ELA_AA_AABR, which steps the reference altitude by one bin
+    minimum = np.min(EleArr)
+    maximum = np.max(EleArr)
+    maxalt = int(maximum + interval)
+    minalt = int(minimum - interval)
+    num_bins = int(np.ceil((maxalt - minalt) / interval))
+    list_altitudes = np.linspace(minalt + interval/2, minalt + interval * num_bins - interval/2, num_bins)
+    Elelist = np.linspace(minalt, minalt + interval * (num_bins-1), num_bins)
+    H, X1 = np.histogram(EleArr, bins=Elelist)
+    resta = np.diff(np.cumsum(H) * (X1[1] - X1[0]) * 100)
+    refinf = minalt
+    while True:
+        weighted = resta * (list_altitudes[1:-1] - refinf)
+        if np.sum(np.where(weighted < 0, weighted * AABRratio, weighted)) <= 0:
+            break
+        refinf += interval
+    return refinf - (interval/2)
+
+def CheckAABR(seed):
+    ##Compare the AABR ELAs of the kernels with the original loop on a single-cell and a flat glacier (all
+    ##cells in the first bin), a glacier below zero and random glaciers. Returns the failed cases
+    rng = np.random.default_rng(seed)
+    glaciers = [np.array([2000]), np.array([2000, 2000, 2000]), np.array([-5, -5, 3])]
+    for i in range(200):
+        glaciers.append(rng.integers(-200, 4000) + rng.integers(0, rng.integers(1, 800), rng.integers(1, 300)))
+    EleFlat = np.concatenate(glaciers).astype(np.int64)
+    offsets = np.zeros(len(glaciers) + 1, dtype=np.int64)
+    np.cumsum([len(g) for g in glaciers], out=offsets[1:])
+    failed = []
+    for interval in (20, 50):
+        for ratio in (1.0, 1.56, 2.3):
+            reference = np.array([ReferenceAABR(g, interval, ratio) for g in glaciers])
+            kernels = {"ELA_AA_AABR": np.array([ELAKernels.ELA_AA_AABR(g, interval, ratio)[1] for g in glaciers]),
+                       "ELA_AA_AABR_Batch": ELAKernels.ELA_AA_AABR_Batch(EleFlat, offsets, interval, ratio)[1],
+                       "ELA_Sweep_Batch": ELAKernels.ELA_Sweep_Batch(EleFlat, offsets, interval, np.array([0.6]), np.array([ratio]))[1][:, 0],
+                       "ELA_MonteCarlo_Batch": ELAKernels.ELA_MonteCarlo_Batch(EleFlat, offsets, interval, np.full(2, 0.6),
+                                                                               np.full(2, ratio), 0.0, seed)[:, 3, 0]}
+            for name, values in kernels.items():
+                if not np.array_equal(values, reference):
+                    failed.append((name, interval, ratio))
+    return failed
+
+def CheckRasterStore(seed):
+    ##Write a float (NoData -9999) and an integer (NoData -1) raster to a store with one chunk without data, and
+    ##read them back. Returns the failed cases
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.uniform(100, 3000, (70, 90)), 1)
+    values[:32, :32] = -9999 ##One chunk without data
+    values[rng.random(values.shape) < 0.1] = -9999
+    failed = []
+    folder = tempfile.mkdtemp(prefix="pgtools_store_")
+    for name, arr, dtype, noData, rasterNoData in (("float", values.astype(np.float32), np.float32, None, -9999),
+                                                     ("integer", np.where(values == -9999, -1, values).astype(np.int32), np.int16, -32768, -1)):
+        grid = {"XMin": 0.0, "YMax": 70 * 30.0, "cellW": 30.0, "cellH": 30.0, "nrows": 70, "ncols": 90,
+                "dtype": np.dtype(dtype).name, "noData": noData}
+        RasterStore.WriteStore(os.path.join(folder, name), grid,
+                               lambda r0, r1, c0, c1: RasterStore.StoreChunk(arr[r0:r1, c0:c1], rasterNoData, dtype, noData), 32)
+        store = RasterStore.RasterStore(os.path.join(folder, name))
+        window = store.Window(-60.0, -60.0, 94, 74).astype(np.float64)
+        if noData is not None:
+            window[window == noData] = np.nan
+        expected = np.full((74, 94), np.nan)
+        expected[2:72, 2:92] = np.where(values == -9999, np.nan, values.astype(dtype))
+        if not np.array_equal(window, expected, equal_nan=True):
+            failed.append((name, "window"))
+        if "0_0" in store.ranges or min(r[0] for r in store.ranges.values()) < 0:
+            failed.append((name, "index"))
+        store.close()
+    shutil.rmtree(folder, ignore_errors=True)
+    return failed
+
+def GitCommit():
+    ##Commit of the working copy, to tell the versions apart in the JSON (None if not a git repository)
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def CompareBaseline(report, baselineFile, threshold):
+    ##Print the ratio of the best times to the baseline and return the regressed (tier, stage) pairs
+    with open(baselineFile) as f:
+        baseline = json.load(f)
+    baseTiers = dict((tier["glaciers"], tier) for tier in baseline["tiers"])
+    regressions = []
+    for tier in report["tiers"]:
+        if tier["glaciers"] not in baseTiers:
+            continue
+        baseStages = baseTiers[tier["glaciers"]]["stages"]
+        for stage, result in tier["stages"].items():
+            if stage not in baseStages or baseStages[stage]["best"] <= 0:
+                continue
+            ratio = result["best"] / baseStages[stage]["best"]
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                regressions.append((tier["glaciers"], stage))
+            print("%8d  %-12s %10.4f s  baseline %10.4f s  x%.2f%s" % (tier["glaciers"], stage, result["best"],
+                                                                      baseStages[stage]["best"], ratio, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PG-Tools array engines on synthetic glaciers")
+    parser.add_argument("--tiers", default="100,1000,10000,100000", help="Comma-separated numbers of glaciers")
+    parser.add_argument("--stages", default=",".join(Stages), help="Comma-separated stages to run")
+    parser.add_argument("--block-size", type=int, default=16, help="Cells per side of the valley of each glacier")
+    parser.add_argument("--tile-size", type=int, default=0, help="Tile size of the fill and basins (0 = untiled)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each tier (the best time is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench.json", help="Output JSON file")
+    parser.add_argument("--baseline", default="", help="JSON of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    tiers = [int(t) for t in args.tiers.split(",") if t.strip() != ""]
+    stages = [s.strip() for s in args.stages.split(",") if s.strip() != ""]
+    for stage in stages:
+        if stage not in Stages:
+            parser.error("Unknown stage: " + stage)
+
+    report = {"commit": GitCommit(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "numpy": np.__version__, "numba": NumbaCompat.numba.__version__ if NumbaCompat.HasNumba else None,
+              "platform": platform.platform(), "cpus": os.cpu_count(), "block_size": args.block_size,
+              "tile_size": args.tile_size, "repeat": args.repeat, "seed": args.seed, "tiers": []}
+
+    ##Compile the numba kernels on a small inventory
+    start = time.perf_counter()
+    RunStages(SyntheticData.SyntheticInventory(4, args.block_size, args.seed), args.tile_size and 8, stages)
+    report["warmup_seconds"] = time.perf_counter() - start
+    print("Warm-up (compilation): %.2f s" % report["warmup_seconds"])
+    if "ela_kernels" in stages:
+        failed = CheckAABR(args.seed)
+        for name, interval, ratio in failed:
+            print("AABR check failed: %s (interval %d, ratio %.2f)" % (name, interval, ratio))
+        if len(failed) > 0:
+            sys.exit(1)
+        print("AABR check: the kernels match the original loop")
+    failed = CheckRasterStore(args.seed)
+    for name, part in failed:
+        print("Raster store check failed: %s raster, %s" % (name, part))
+    if len(failed) > 0:
+        sys.exit(1)
+    print("Raster store check: NoData is read back as NoData")
+
+    for nGlaciers in tiers:
+        start = time.perf_counter()
+        data = SyntheticData.SyntheticInventory(nGlaciers, args.block_size, args.seed)
+        tier = {"glaciers": nGlaciers, "cells": int(data["dem"].size), "age_points": len(data["ages"]),
+                "generate_seconds": time.perf_counter() - start, "stages": {}}
+        runs = dict((stage, []) for stage in stages)
+        for r in range(args.repeat):
+            for stage, seconds in RunStages(data, args.tile_size, stages).items():
+                runs[stage].append(seconds)
+        for stage in stages:
+            if len(runs[stage]) > 0:
+                tier["stages"][stage] = {"best": min(runs[stage]), "median": float(np.median(runs[stage])), "runs": runs[stage]}
+                print("%8d  %-12s %10.4f s" % (nGlaciers, stage, min(runs[stage])))
+        report["tiers"].append(tier)
+        del data
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Results written to " + args.output)
+
+    if args.baseline != "":
+        if len(CompareBaseline(report, args.baseline, args.threshold)) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
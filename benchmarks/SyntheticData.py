@@ -0,0 +1,129 @@
+#-------------------------------------------------------------------------------
+# Name: SyntheticData.py
+# Purpose: This module generates the synthetic inventories used by RunBenchmarks.py. The glaciers
+#          are laid out on a grid of square blocks. The DEM of each block is a Gaussian ridge
+#          between two valleys, rising up-valley, with tributary ridges and noise so that the fill
+#          and the merging of the small basins have work to do. Each glacier is an ellipse over the
+#          ridge of its block (an ice mass over a divide) with a parabolic (Nye) thickness profile
+#          along the valley, thinning to the margins across the valley. The outline polygons, the
+#          age points around the outlines and the centroid longitude and latitude of each glacier
+#          match the rasters.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import math
+import numpy as np
+
+CellSize = 30.0 ##Cell size of the synthetic rasters (m)
+
+def BlockGrid(nGlaciers):
+    ##Number of block rows and columns for the glaciers (close to a square)
+    nBlockCols = int(math.ceil(math.sqrt(nGlaciers)))
+    nBlockRows = int(math.ceil(nGlaciers / float(nBlockCols)))
+    return nBlockRows, nBlockCols
+
+def SyntheticDEM(nGlaciers, blockSize, rng):
+    ##DEM of Gaussian ridges and valleys, one block of blockSize x blockSize cells per glacier
+    nBlockRows, nBlockCols = BlockGrid(nGlaciers)
+    u = np.arange(blockSize) - (blockSize - 1) / 2.0 ##Across the block
+    v = np.arange(blockSize)[::-1] ##Up the valley (row 0 = head of the valley)
+    sigma = blockSize / 6.0
+    ##A Gaussian ridge along the center of the block between two valleys on the block edges, so that
+    ##each glacier straddles a divide, with tributary ridges of random height on the flanks
+    ridge = 400.0 * np.exp(-u * u / (2.0 * sigma * sigma))
+    tributaries = np.abs(np.sin(4.0 * np.pi * u / blockSize))
+    block = 1500.0 + 25.0 * v[:, None] + ridge[None, :]
+    dem = np.tile(block, (nBlockRows, nBlockCols))
+    dem += np.kron(rng.uniform(0.0, 300.0, (nBlockRows, nBlockCols)), np.tile(tributaries, (blockSize, 1)))
+    ##Noise (pits and small basins)
+    dem += rng.normal(0.0, 10.0, dem.shape)
+    return dem
+
+def GlacierMasks(nGlaciers, blockSize):
+    ##Label grid of the glaciers (1 to nGlaciers, 0 = no glacier), and the normalized
+    ##along-valley (0 at the terminus, 1 at the head) and across-valley (0 at the center line,
+    ##1 at the margin) coordinates of each cell in the ellipse of its block
+    nBlockRows, nBlockCols = BlockGrid(nGlaciers)
+    cu = (blockSize - 1) / 2.0
+    cv = 0.45 * blockSize
+    au = 0.3 * blockSize
+    av = 0.4 * blockSize
+    r, c = np.indices((blockSize, blockSize))
+    du = (c - cu) / au
+    dv = (r - cv) / av
+    inside = du * du + dv * dv <= 1.0
+    along = np.where(inside, (1.0 - dv) / 2.0, 0.0)
+    across = np.where(inside, np.abs(du) / np.sqrt(np.maximum(1.0 - dv * dv, 1e-12)), 0.0)
+
+    blockIDs = np.arange(nBlockRows * nBlockCols).reshape(nBlockRows, nBlockCols) + 1
+    blockIDs[blockIDs > nGlaciers] = 0
+    labels = np.kron(blockIDs, inside.astype(np.int64)).astype(np.int32)
+    along = np.tile(along, (nBlockRows, nBlockCols))
+    across = np.minimum(np.tile(across, (nBlockRows, nBlockCols)), 1.0)
+    return labels, along, across
+
+def SyntheticIce(dem, labels, along, across, maxThickness=250.0):
+    ##Ice thickness with a parabolic profile (h = H sqrt(x / L) from the terminus) along the valley
+    ##and a parabolic cross section, and the ice surface. Both are NaN outside of the glaciers
+    thickness = maxThickness * np.sqrt(np.clip(along, 0.0, 1.0)) * (1.0 - across * across)
+    thickness = np.where(labels > 0, np.maximum(thickness, 1.0), np.nan)
+    surface = dem + thickness
+    return surface, thickness
+
+def OutlineRings(nGlaciers, blockSize, nVertices=64):
+    ##Closed ring of the ellipse of each glacier in map coordinates (origin at the upper left
+    ##corner of the DEM, y up), as a list of (PolyID, [ring]) like the outlines read by the tools
+    nBlockRows, nBlockCols = BlockGrid(nGlaciers)
+    nrows = nBlockRows * blockSize
+    angles = np.linspace(0.0, 2.0 * np.pi, nVertices + 1)
+    ringU = (blockSize - 1) / 2.0 + 0.3 * blockSize * np.cos(angles)
+    ringV = 0.45 * blockSize + 0.4 * blockSize * np.sin(angles)
+    polygons = []
+    for g in range(nGlaciers):
+        br, bc = divmod(g, nBlockCols)
+        x = (bc * blockSize + ringU + 0.5) * CellSize
+        y = (nrows - (br * blockSize + ringV + 0.5)) * CellSize
+        ring = np.column_stack((x, y))
+        ring[-1] = ring[0]
+        polygons.append((g + 1, [ring]))
+    return polygons
+
+def AgePoints(polygons, rng, meanPerGlacier=3.0, nSites=4):
+    ##Age points scattered around the outlines (within and beyond the 150 m join distance), with
+    ##ages and ICE-D style site IDs. Returns the (n, 2) coordinates, the ages and the sites
+    xy = []
+    for polyID, rings in polygons:
+        n = rng.poisson(meanPerGlacier)
+        if n == 0:
+            continue
+        xmin, ymin = rings[0].min(axis=0)
+        xmax, ymax = rings[0].max(axis=0)
+        xy.append(np.column_stack((rng.uniform(xmin - 300.0, xmax + 300.0, n),
+                                   rng.uniform(ymin - 300.0, ymax + 300.0, n))))
+    if len(xy) == 0:
+        return np.empty((0, 2)), np.empty(0), np.empty(0, dtype="U8")
+    xy = np.concatenate(xy)
+    ages = rng.uniform(10000.0, 25000.0, len(xy))
+    sites = np.array(["site%d" % s for s in rng.integers(0, nSites, len(xy))])
+    return xy, ages, sites
+
+def Centroids(nGlaciers, rng):
+    ##Centroid longitude and latitude of the glaciers (the Point_X and Point_Y of the PGI_ID)
+    lon = rng.uniform(-180.0, 180.0, nGlaciers)
+    lat = rng.uniform(-70.0, 80.0, nGlaciers)
+    return lon, lat
+
+def SyntheticInventory(nGlaciers, blockSize=16, seed=0):
+    ##All synthetic inputs of one scale tier as a dictionary
+    rng = np.random.default_rng(seed)
+    dem = SyntheticDEM(nGlaciers, blockSize, rng)
+    labels, along, across = GlacierMasks(nGlaciers, blockSize)
+    surface, thickness = SyntheticIce(dem, labels, along, across)
+    polygons = OutlineRings(nGlaciers, blockSize)
+    ageXY, ages, sites = AgePoints(polygons, rng)
+    lon, lat = Centroids(nGlaciers, rng)
+    return {"dem": dem, "labels": labels, "surface": surface, "thickness": thickness,
+            "polygons": polygons, "ageXY": ageXY, "ages": ages, "sites": sites,
+            "lon": lon, "lat": lat, "cellSize": CellSize}
@@ -22,6 +22,9 @@ from arcpy import env
 from arcpy.sa import *
 #import numpy
 import numpy as np
+import Profiler
+import ResultCache
+import AttributeWriter
 
 locale.setlocale(locale.LC_ALL,"")#sets local settings to decimals
 arcpy.env.overwriteOutput = True
@@ -59,208 +62,241 @@ else:
 temp_workspace = "in_memory"  
 if ArcGISPro:
     temp_workspace = "memory"
-    
-##main program
-InputPGIPolygons = arcpy.GetParameterAsText(0)
-Stage = arcpy.GetParameterAsText(1)
-InputAgeFile = arcpy.GetParameterAsText(2)
-InputDatingMethod = arcpy.GetParameterAsText(3)
-InputAgeField = arcpy.GetParameterAsText(4)
-InputICEDsite = arcpy.GetParameterAsText(5)
-#Add the output 
-OutputPGIoutlines = arcpy.GetParameterAsText(6)
-
-arcpy.Delete_management(temp_workspace)
-
 
+def PolygonRings(shape):
+    ##Closed coordinate arrays of all rings (outer rings and holes) of a polygon geometry
+    rings = []
+    for part in shape:
+        ring = []
+        for pnt in part:
+            if pnt is None: ##Start of an interior ring
+                if len(ring) > 0:
+                    rings.append(ring)
+                ring = []
+            else:
+                ring.append((pnt.X, pnt.Y))
+        if len(ring) > 0:
+            rings.append(ring)
+    closedRings = []
+    for ring in rings:
+        if ring[0] != ring[-1]:
+            ring.append(ring[0])
+        closedRings.append(np.array(ring, dtype=np.float64))
+    return closedRings
+    
+def AddBasicGlacierAttributes(InputPGIPolygons, Stage, InputAgeFile, InputDatingMethod, InputAgeField, InputICEDsite,
+                              OutputPGIoutlines, CacheFolder="", ProfileReport=""):
+    ##Add the basic attributes to the outlines. The arguments are the parameters of the tool (empty strings
+    ##for the optional parameters not used). Returns the output outlines
 
-##Copy the input to output polygon
-arcpy.CopyFeatures_management(InputPGIPolygons, OutputPGIoutlines)
+    profile = Profiler.Profiler("AddBasicGlacierAttributes", arcpy.AddMessage)
 
-exist_fields = [f.name for f in arcpy.ListFields(OutputPGIoutlines)] #List of current field names in outline layer
-IDName = "PGI_ID"
+    profile.Start("Copy the outlines and add the attribute fields...")
+    ##Copy the input to output polygon; the attributes are added in place if the output is the input
+    if OutputPGIoutlines != InputPGIPolygons:
+        arcpy.CopyFeatures_management(InputPGIPolygons, OutputPGIoutlines)
 
-if IDName not in exist_fields:
-    arcpy.AddField_management(OutputPGIoutlines, IDName, "TEXT") #field for ice value
+    exist_fields = [f.name for f in arcpy.ListFields(OutputPGIoutlines)] #List of current field names in outline layer
+    IDName = "PGI_ID"
 
-new_fields = ("Valley","Range", "Region", "Mapper", "MapDate", "Reviewer", "DataSource", "URL", "MapMethod", "Desc", "GlaStage") ##All double variables count = 4
-for field in new_fields:
-    if field in exist_fields:
-        pass
-    else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "TEXT")
+    if IDName not in exist_fields:
+        arcpy.AddField_management(OutputPGIoutlines, IDName, "TEXT") #field for ice value
 
-##Add new fields
-new_fields = ("Cenlon","Cenlat") ##All double variables count = 4
-for field in new_fields:
-    if field in exist_fields:
-        pass
-    else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "DOUBLE",10, 4)
+    new_fields = ("Valley","Range", "Region", "Mapper", "MapDate", "Reviewer", "DataSource", "URL", "MapMethod", "Desc", "GlaStage") ##All double variables count = 4
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "TEXT")
 
-new_fields = ("PolyID","Perimeter", "A2D") ##All Integer variables count = 7
-for field in new_fields:
-    if field in exist_fields:
-        pass
-    else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "LONG",10)
+    ##Add new fields
+    new_fields = ("Cenlon","Cenlat") ##All double variables count = 4
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "DOUBLE",10, 4)
 
-arcpy.CalculateField_management(OutputPGIoutlines,"PolyID",str("!"+str(arcpy.Describe(OutputPGIoutlines).OIDFieldName)+"!"),"PYTHON_9.3")
+    new_fields = ("PolyID","Perimeter", "A2D") ##All Integer variables count = 7
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "LONG",10)
 
+    arcpy.CalculateField_management(OutputPGIoutlines,"PolyID",str("!"+str(arcpy.Describe(OutputPGIoutlines).OIDFieldName)+"!"),"PYTHON_9.3")
 
-new_fields = ("MinAge", "MaxAge", "MedianAge", "MeanAge") ##All Integer variables count = 7
-for field in new_fields:
-    if field in exist_fields:
-        pass
-    else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "DOUBLE", 10, 2)
 
-new_fields = ("AgeMethod","ICEDSiteID") ##All Integer variables count = 6
-for field in new_fields:
-    if field in exist_fields:
-        pass
-    else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "TEXT")
+    new_fields = ("MinAge", "MaxAge", "MedianAge", "MeanAge") ##All Integer variables count = 7
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "DOUBLE", 10, 2)
 
-##Create PGI_ID and add centriold lat and long
-poly_points = temp_workspace + "\\poly_points"
-poly_points_GCS = temp_workspace + "\\poly_points_GCS"
+    new_fields = ("AgeMethod","ICEDSiteID") ##All Integer variables count = 6
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "TEXT")
+
+    ##Result cache: the outlines are keyed by their geometry and the glacial stage, and only the outlines
+    ##without cached results are computed (the "work" outlines). The ages are derived for all outlines, as
+    ##the age points are joined to the nearest outlines
+    ResultFields = [IDName, "Cenlon", "Cenlat", "Perimeter", "A2D", "GlaStage"]
+    AgeFields = ["MinAge", "MaxAge", "MedianAge", "MeanAge", "ICEDSiteID", "AgeMethod"]
+    ##The attributes of all outlines are accumulated in one columnar table keyed by PolyID (the computed and
+    ##the cached results and the ages) and written to the output in a single cursor pass at the end
+    TextFields = [IDName, "GlaStage", "ICEDSiteID", "AgeMethod"]
+    allIDs = arcpy.da.FeatureClassToNumPyArray(OutputPGIoutlines, "PolyID")["PolyID"]
+    results = AttributeWriter.ResultTable(allIDs, [(field, "O" if field in TextFields else "f8") for field in ResultFields + AgeFields])
+    cache = None
+    cachedResults = {}
+    outlineKeys = {}
+    work = OutputPGIoutlines
+    if CacheFolder != "":
+        profile.Start("Look up the result cache...")
+        ##The spatial reference of the outlines is part of the fingerprint: the PGI_ID, the centroid and the
+        ##lengths and areas of the same coordinates differ in another coordinate system
+        fingerprint = ResultCache.Fingerprint("AddBasicGlacierAttributes", Stage, arcpy.Describe(OutputPGIoutlines).spatialReference.exportToString())
+        with arcpy.da.SearchCursor(OutputPGIoutlines, ["PolyID", "SHAPE@WKB"]) as cursor:
+            for row in cursor:
+                outlineKeys[row[0]] = ResultCache.GeometryKey(row[1], fingerprint)
+        del row, cursor
+        cache = ResultCache.OpenCache(CacheFolder, "BasicGlacierAttributes")
+        cachedResults = ResultCache.LookupResults(cache, outlineKeys.values())
+        computeIDs = [str(polyID) for polyID in outlineKeys if outlineKeys[polyID] not in cachedResults]
+        arcpy.AddMessage("Reuse the cached attributes of " + str(len(outlineKeys) - len(computeIDs)) + " outlines and compute " + str(len(computeIDs)) + " outlines")
+        if len(computeIDs) < len(outlineKeys):
+            work = "outlines_to_compute"
+            if len(computeIDs) > 0:
+                where = arcpy.AddFieldDelimiters(OutputPGIoutlines, "PolyID") + " IN (" + ",".join(computeIDs) + ")"
+            else:
+                where = arcpy.AddFieldDelimiters(OutputPGIoutlines, "PolyID") + " < 0"
+            arcpy.MakeFeatureLayer_management(OutputPGIoutlines, work, where)
+
+    import PGIDEngine ##Only imported (with numba) when the tool runs
+    workIDs = arcpy.da.FeatureClassToNumPyArray(work, "PolyID")["PolyID"]
+    if len(workIDs) > 0:
+        profile.Start("Add PGI_ID, centroid location, perimeter, and area...")
+        ##Create PGI_ID and add centriold lat and long: the label point (inside) of each outline is derived from
+        ##the geometry and projected to WGS 1984 in bulk, without intermediate point feature classes
+        polyIDs = []
+        wkbs = []
+        perimeters = []
+        areas = []
+        with arcpy.da.SearchCursor(work, ["PolyID", "SHAPE@WKB", "SHAPE@LENGTH", "SHAPE@AREA"]) as cursor:
+            for row in cursor:
+                polyIDs.append(row[0])
+                wkbs.append(row[1])
+                perimeters.append(row[2])
+                areas.append(row[3])
+        del row, cursor
+        pnt_x, pnt_y = PGIDEngine.GeographicLabelPoints(arcpy, wkbs, arcpy.Describe(work).spatialReference)
+        del wkbs
+
+        ##Add the attributes of the PGIpolygons to the result table, keyed by PolyID
+        rows = AttributeWriter.RowIndex(results, np.array(polyIDs))
+        results[IDName][rows] = PGIDEngine.FormatPGIIDs(pnt_x, pnt_y, "PGI_" + Stage + "_")
+        results["Cenlon"][rows] = np.round(pnt_x, 4)
+        results["Cenlat"][rows] = np.round(pnt_y, 4)
+        results["Perimeter"][rows] = perimeters
+        results["A2D"][rows] = areas
+        results["GlaStage"][rows] = Stage
+
+    if cache is not None:
+        profile.Start("Apply and update the result cache...")
+        ##Reuse the cached results and store the new results in the cache
+        reused = dict((polyID, cachedResults[key]) for polyID, key in outlineKeys.items() if key in cachedResults)
+        AttributeWriter.SetRecords(results, reused, ResultFields)
+        newResults = dict((outlineKeys[polyID], result) for polyID, result in AttributeWriter.GetRecords(results, workIDs, ResultFields).items())
+        ResultCache.StoreResults(cache, newResults)
+        cache.close()
+
+    ##Add elevation fields
+    if InputAgeFile != "": ##get the average age from the age point file
+        profile.Start("Add outline ages...")
+        #This is the prcoess to get the average age from the age file
+        if InputAgeField != "":
+            import AgeStats ##Only imported (with scipy) if the ages are derived
+            if InputICEDsite != "":
+                fields = ("SHAPE@XY", InputAgeField, InputICEDsite)
+            else:
+                fields = ("SHAPE@XY", InputAgeField)
+
+            outline_ref = arcpy.Describe(OutputPGIoutlines).spatialReference
+            if outline_ref.type == "Projected":
+                ##Join the age points within 150 m of the outlines with a KD-tree of the points,
+                ##read in the coordinate system of the outlines
+                age_array = arcpy.da.FeatureClassToNumPyArray(InputAgeFile, fields, spatial_reference=outline_ref)
+                polygons = []
+                with arcpy.da.SearchCursor(OutputPGIoutlines, ["PolyID", "SHAPE@"]) as cursor:
+                    for row in cursor:
+                        polygons.append((row[0], PolygonRings(row[1])))
+                del row, cursor
+                joinIDs = AgeStats.WithinDistanceJoin(age_array["SHAPE@XY"], polygons, 150.0 / outline_ref.metersPerUnit)
+                age_array = age_array[joinIDs >= 0]
+                polyIDs = joinIDs[joinIDs >= 0]
+            else:
+                ##Geographic coordinates: use the SpatialJoin for the distance in meters
+                ages_spatialjoin = temp_workspace + "\\ages_spatialjoin"
+                arcpy.SpatialJoin_analysis(InputAgeFile, OutputPGIoutlines, ages_spatialjoin, "JOIN_ONE_TO_ONE", "KEEP_COMMON", '#', "WITHIN_A_DISTANCE", "150 Meters")
+                age_array = arcpy.da.FeatureClassToNumPyArray(ages_spatialjoin, ("PolyID",) + fields[1:])
+                polyIDs = age_array["PolyID"]
+
+            ages = age_array[InputAgeField]
+            sites = None
+            if InputICEDsite != "":
+                sites = age_array[InputICEDsite]
 
-arcpy.FeatureToPoint_management (OutputPGIoutlines, poly_points, "INSIDE")
+            ##Age statistics of each outline (of the site with the most samples) from the ages grouped by outline
+            if len(polyIDs) > 0:
+                unique_polyIDs, min_ages, max_ages, median_ages, mean_ages, icedsites = AgeStats.GroupedAgeStats(polyIDs, ages, sites)
+            else:
+                unique_polyIDs = np.array([], dtype=np.int64)
 
-spatial_ref = arcpy.Describe(poly_points).spatialReference
+            if len(unique_polyIDs) > 0:
+                rows = AttributeWriter.RowIndex(results, unique_polyIDs)
+                results["MinAge"][rows] = min_ages
+                results["MaxAge"][rows] = max_ages
+                results["MedianAge"][rows] = median_ages
+                results["MeanAge"][rows] = mean_ages
+                results["ICEDSiteID"][rows] = [str(site) for site in icedsites]
+                results["AgeMethod"][rows] = InputDatingMethod
 
-if "GCS" in spatial_ref.name:
-    arcpy.CopyFeatures_management(poly_points, poly_points_GCS)
-else:
-    out_coordinate_system = arcpy.SpatialReference("GCS_WGS_1984")
-    arcpy.Project_management(poly_points, poly_points_GCS, out_coordinate_system)
-
-arcpy.AddXY_management(poly_points_GCS)
-
-arcpy.AddMessage("Add PGI_ID, centroid location, perimeter, and area...")
-polys_spatialjoin = temp_workspace + "\\polys_spatialjoin"
-arcpy.SpatialJoin_analysis(OutputPGIoutlines, poly_points_GCS, polys_spatialjoin, "JOIN_ONE_TO_ONE", "KEEP_ALL", '#', "COMPLETELY_CONTAINS")
-polyarray = arcpy.da.FeatureClassToNumPyArray(polys_spatialjoin, ('Point_X', 'Point_Y'))  
-pnt_x = np.array([item[0] for item in polyarray])
-pnt_y = np.array([item[1] for item in polyarray])
-ids = []
-for i in range(len(pnt_x)):
-    long_str = str(pnt_x[i])
-    dot = long_str.find(".")
-    endpos = dot + 4
-    if pnt_x[i] < 0:
-        ext_str = long_str[1:endpos]
-        if len(ext_str) < 6:
-            ext_str = "0" + ext_str
-        x_str = ext_str + "W"       
-    else:
-        ext_str = long_str[0:endpos]
-        if len(ext_str) < 6:
-            ext_str = "0" + ext_str
-        x_str = ext_str + "E"       
-
-    lat_str = str(pnt_y[i])
-    dot = lat_str.find(".")
-    endpos = dot + 4
-    if pnt_y[i] < 0:
-        ext_str = lat_str[1:endpos]
-        if len(ext_str) < 6:
-            ext_str = "0" + ext_str
-        y_str = ext_str + "S"       
-    else:
-        ext_str = lat_str[0:endpos]
-        if len(ext_str) < 6:
-            ext_str = "0" + ext_str
-        y_str = ext_str + "N"       
-
-    ##Combine str
-    ids.append(x_str+y_str)
-
-##Add the attributes to the PGIpolugons
-fields = [IDName, "Cenlon","Cenlat", "Perimeter", "A2D", "SHAPE@LENGTH", "SHAPE@AREA", "GlaStage"]
-Prefix = "PGI_" + Stage + "_"
-with arcpy.da.UpdateCursor(OutputPGIoutlines,fields) as cursor:   #populate ice field with value from the nearest flowline point
-    i = 0
-    for row in cursor:
-        row[0]= Prefix + ids[i]
-        row[1] = round(pnt_x[i], 4)
-        row[2] = round(pnt_y[i], 4)
-        row[3] = row[5]
-        row[4] = row[6]
-        row[7] = Stage
-        cursor.updateRow(row)
-        i += 1
-del row, cursor
-
-##Add elevation fields
-if InputAgeFile != "": ##get the average age from the age point file
-    arcpy.AddMessage("Add outline ages...")
-    #This is the prcoess to get the average age from the age file
-    if InputAgeField != "":
-        ages_spatialjoin = temp_workspace + "\\ages_spatialjoin"
-        arcpy.SpatialJoin_analysis(InputAgeFile, OutputPGIoutlines, ages_spatialjoin, "JOIN_ONE_TO_ONE", "KEEP_COMMON", '#', "WITHIN_A_DISTANCE", "150 Meters")
-
-        #poly_IDs  = []
-        min_ages    = []
-        max_ages    = []
-        median_ages = []
-        mean_ages   = []
-        icedsites   = []
-
-        if InputICEDsite != "":
-            fields = ('PolyID', InputAgeField, InputICEDsite)
         else:
-            fields = ('PolyID', InputAgeField)
-            
-        age_array = arcpy.da.FeatureClassToNumPyArray(ages_spatialjoin, fields)
-        polyIDs = np.array([item[0] for item in age_array])
-        ages    = np.array([item[1] for item in age_array])
-        if InputICEDsite != "":
-            sites   = np.array([item[2] for item in age_array])
-
-        unique_polyIDs = np.unique(polyIDs)
-        for polyID in unique_polyIDs:
-            ##Need to select the ages from the same site id
-            if InputICEDsite != "":
-                outline_ages = ages[polyIDs == polyID]
-                site_IDs = sites[polyIDs == polyID]
-                unique_siteIDs, counts = np.unique(site_IDs, return_counts=True)
+            arcpy.AddMessage("No age field is selected")
 
-                max_count = max(counts)
-                site_ID = unique_siteIDs[counts == max_count][0]
+    ##The outlines with the same PGI_ID (label points within 0.001 degree) get a suffix, also for the cached PGI_IDs
+    results[IDName], nDuplicates = PGIDEngine.UniqueIDs(results[IDName])
+    if nDuplicates > 0:
+        arcpy.AddMessage("A suffix is added to " + str(nDuplicates) + " duplicate PGI_IDs")
 
-                icedsites.append(site_ID)
-                
-                sel_ages = outline_ages[site_IDs == site_ID]
-            else:
-                icedsites.append("NULL")
-                sel_ages = ages[polyIDs == polyID]
+    profile.Start("Write all attributes...")
+    AttributeWriter.WriteTable(arcpy, OutputPGIoutlines, "PolyID", results, ResultFields + AgeFields, profile.Progress)
 
-            min_ages.append(np.min(sel_ages))
-            max_ages.append(np.max(sel_ages))
-            median_ages.append(np.median(sel_ages))
-            mean_ages.append(np.mean(sel_ages))
+    if work != OutputPGIoutlines:
+        arcpy.Delete_management(work) ##The layer of the outlines without cached results
+    arcpy.DeleteField_management(OutputPGIoutlines,["PolyID"])
+    ##Delete the temporary datasets of this tool only, so that the other datasets in memory (such as the
+    ##outlines of a batch run) are kept
+    for name in ["ages_spatialjoin"]:
+        if arcpy.Exists(temp_workspace + "\\" + name):
+            arcpy.Delete_management(temp_workspace + "\\" + name)
+    profile.Finish(ProfileReport)
 
-        fields = ["PolyID", "MinAge", "MaxAge", "MedianAge", "MeanAge", "ICEDSiteID", "AgeMethod"]
-        with arcpy.da.UpdateCursor(OutputPGIoutlines,fields) as cursor:   #populate ice field with value from the nearest flowline point
-            for row in cursor:
-                idx_result = np.where(unique_polyIDs == row[0])
-                if len(idx_result[0])> 0:
-                    idx = idx_result[0][0]
-                    row[1] = min_ages[idx]
-                    row[2] = max_ages[idx]
-                    row[3] = median_ages[idx]
-                    row[4] = mean_ages[idx]
-                    row[5] = icedsites[idx]
-                    row[6] = InputDatingMethod
-                cursor.updateRow(row)
-        del row, cursor
-
-    else:
-        arcpy.AddMessage("No age field is selected")
-        
-arcpy.DeleteField_management(OutputPGIoutlines,["PolyID"])
-arcpy.Delete_management(temp_workspace)
+    arcpy.AddMessage("Finished!!!")
+    return OutputPGIoutlines
 
-arcpy.AddMessage("Finished!!!")
+##main program
+if __name__ == "__main__":
+    AddBasicGlacierAttributes(arcpy.GetParameterAsText(0), ##Input outlines
+                              arcpy.GetParameterAsText(1), ##Glacial stage
+                              arcpy.GetParameterAsText(2), ##Age point file
+                              arcpy.GetParameterAsText(3), ##Dating method
+                              arcpy.GetParameterAsText(4), ##Age field
+                              arcpy.GetParameterAsText(5), ##ICE-D site ID field
+                              arcpy.GetParameterAsText(6), ##Output outlines
+                              arcpy.GetParameterAsText(7), ##Optional folder of the result cache, to reuse the attributes of the unchanged outlines of a previous run
+                              arcpy.GetParameterAsText(8)) ##Optional profile report (JSON or CSV) of the time and memory of each step
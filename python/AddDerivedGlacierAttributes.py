@@ -22,20 +22,15 @@
 # Import arcpy module
 from __future__ import division
 import locale
-import arcpy, sys
+import arcpy, sys, os
 from arcpy import env
 from arcpy.sa import *
 #import numpy
 import numpy as np
-
-try:
-    import numba
-except:
-    os.system("python -m pip install numba")
-    #!pip install numba
-    import numba
-
-from numba import jit, prange
+import Profiler
+import ResultCache
+import AttributeWriter
+import RasterStore
 
 locale.setlocale(locale.LC_ALL,"")#sets local settings to decimals
 arcpy.env.overwriteOutput = True
@@ -74,404 +69,538 @@ temp_workspace = "in_memory"
 if ArcGISPro:
     temp_workspace = "memory"
 
-@jit(nopython=True, parallel=True)
-def ELA_AAR_MGE(EleArr, interval, ratio):
-    minimum = np.min(EleArr)
-    maximum = np.max(EleArr)
-    
-    maxalt = int(maximum + interval)
-    minalt = int(minimum - interval)
-
-    # Create array of bin edges
-    Elelist = np.arange(minalt, maxalt + interval, interval)
-    
-    # Calculate histogram
-    H, X1 = np.histogram(EleArr, bins=Elelist)
-    dx = X1[1] - X1[0]
-
-
-    Area3D_arr = np.cumsum(H) * dx
-    
-    superf_total = np.max(Area3D_arr)  # Get the total surface
-    Area3D_arr = superf_total - Area3D_arr
-
-    ELA = superf_total * ratio  # Get the surface above the ELA
-    kurowski = superf_total * 0.5
-
-    # Find indices where values meet conditions
-    ela_idx = -1
-    kur_idx = -1
-    min_ela_diff = np.inf
-    min_kur_diff = np.inf
-    
-    for i in range(len(Area3D_arr)):
-        val = Area3D_arr[i]
-        
-        # Check for ELA condition
-        if val <= ELA:
-            diff = ELA - val
-            if diff < min_ela_diff:
-                min_ela_diff = diff
-                ela_idx = i
-                
-        # Check for Kurowski condition
-        if val <= kurowski:
-            diff = kurowski - val
-            if diff < min_kur_diff:
-                min_kur_diff = diff
-                kur_idx = i
-
-    # Calculate results
-    ELA_AAR = Elelist[ela_idx] + (interval/2) + interval
-    ELA_MGE = Elelist[kur_idx] + (interval/2) + interval
-    
-    return ELA_AAR, ELA_MGE
-
-@jit(nopython=True, parallel=True)
-def ELA_AA_AABR(EleArr, interval, AABRratio):
-    # Calculate min/max with buffer
-    minimum = np.min(EleArr)
-    maximum = np.max(EleArr)
-    maxalt = int(maximum + interval)
-    minalt = int(minimum - interval)
-
-    # Optimized bin calculation
-    num_bins = int(np.ceil((maxalt - minalt) / interval))
-    maxValue = minalt + interval * num_bins - interval/2
-    list_altitudes = np.linspace(minalt + interval/2, maxValue, num_bins)
-    
-    # Create histogram bins
-    Elelist = np.linspace(minalt, minalt + interval * (num_bins-1), num_bins)
-    
-    # Calculate histogram and cumulative area
-    H, X1 = np.histogram(EleArr, bins=Elelist)
-    dx = X1[1] - X1[0]
-    Area3D_arr = np.cumsum(H) * dx * 100  # Convert to percentage
-
-    # AA Calculation
-    superf_total = np.max(Area3D_arr)
-    resta = np.diff(Area3D_arr)
-    finalmulti = np.sum(resta * list_altitudes[1:-1])
-    ELA_AA = int(finalmulti / superf_total) ##+ interval
-    
-    # Optimized AABR Calculation
-    refinf = minalt
-    while True:
-        # Vectorized calculation
-        diff = list_altitudes[1:-1] - refinf
-        weighted = resta * diff
-        adjusted = np.where(weighted < 0, weighted * AABRratio, weighted)
-        total = np.sum(adjusted)
-        
-        if total <= 0:
-            break
-        refinf += interval
-    
-    ELA_AABR = refinf - (interval/2) ##+ interval
-    
-    return ELA_AA, ELA_AABR
-    
-##main program
-InputPGIPolygons = arcpy.GetParameterAsText(0)
-GlaStage = arcpy.GetParameterAsText(1)
-RecMethod = arcpy.GetParameterAsText(2)
-IceSurf = arcpy.GetParameterAsText(3)
-IceTck = arcpy.GetParameterAsText(4)  ##ice surface DEM
-
-interval = int(arcpy.GetParameter(5))
-AARratio = arcpy.GetParameter(6)
-AABRratio =arcpy.GetParameter(7)
-
-#Add the output 
-OutputPGIoutlines = arcpy.GetParameterAsText(8)
-
-arcpy.Delete_management("temp_workspace")
-
-##Copy the input to output polygon
-arcpy.CopyFeatures_management(InputPGIPolygons, OutputPGIoutlines)
-
-exist_fields = [f.name for f in arcpy.ListFields(OutputPGIoutlines)] #List of current field names in outline layer
-IDName = "PGI_ID"
-
-b_PGI_ID = False
-if IDName not in exist_fields:
-    #arcpy.AddMessage("The PGI ID does not exist! Will create one with the default ID start with PGI_LGM_ ")
-    arcpy.AddField_management(OutputPGIoutlines, IDName, "TEXT") #field for ice value
-    b_PGI_ID = True
-
-if "RecMethod" in exist_fields:
-    pass
-else:
-    arcpy.AddField_management(OutputPGIoutlines, "RecMethod", 'Text')
-
-if "A3D" in exist_fields:
-    pass
-else:
-    arcpy.AddField_management(OutputPGIoutlines, "A3D", "LONG",10)
-
-if "A3D2D" in exist_fields:
-    pass
-else:
-    arcpy.AddField_management(OutputPGIoutlines, "A3D2D", "DOUBLE", 6, 3)
+def RasterizeOutlines(outlines, IDField, snapRaster):
+    ##Rasterize all outlines into one label grid aligned to the snap raster (cell center rule,
+    ##the same as ExtractByMask) and return the label array and its lower left corner
+    desc = arcpy.Describe(snapRaster)
+    oldSnapRaster = arcpy.env.snapRaster
+    oldExtent = arcpy.env.extent
+    oldSR = arcpy.env.outputCoordinateSystem
+    arcpy.env.snapRaster = snapRaster
+    arcpy.env.extent = arcpy.Describe(outlines).extent
+    arcpy.env.outputCoordinateSystem = desc.spatialReference
+
+    labelRaster = temp_workspace + "\\outline_labels"
+    arcpy.PolygonToRaster_conversion(outlines, IDField, labelRaster, "CELL_CENTER", "", desc.meanCellWidth)
+
+    arcpy.env.snapRaster = oldSnapRaster
+    arcpy.env.extent = oldExtent
+    arcpy.env.outputCoordinateSystem = oldSR
+
+    labels = Raster(labelRaster)
+    lowerLeft = arcpy.Point(labels.extent.XMin, labels.extent.YMin)
+    labelArr = arcpy.RasterToNumPyArray(labels, lowerLeft, labels.width, labels.height, 0)
+    return labelArr, lowerLeft
+
+def ReadRasterWindow(raster, lowerLeft, ncols, nrows, store=None, need=None):
+    ##Read a raster window as a float array with NaN for NoData and for the cells outside of the raster.
+    ##With the store of the raster (RasterStore.py), only the chunks of the needed cells are read
+    if store is not None:
+        arr = store.Window(lowerLeft.X, lowerLeft.Y, ncols, nrows, need).astype(np.float64)
+        if store.noData is not None:
+            arr[arr == store.noData] = np.nan
+        return arr
+    noData = raster.noDataValue
+    if noData is None and not raster.isInteger:
+        noData = np.nan
+    arr = arcpy.RasterToNumPyArray(raster, lowerLeft, ncols, nrows, noData).astype(np.float64)
+    if noData is not None:
+        arr[arr == noData] = np.nan
+    return arr
+
+def SameGrid(raster, snapRaster):
+    ##Check if the raster has the same cell size and cell alignment as the snap raster
+    if not (np.isclose(raster.meanCellWidth, snapRaster.meanCellWidth) and np.isclose(raster.meanCellHeight, snapRaster.meanCellHeight)):
+        return False
+    dx = (raster.extent.XMin - snapRaster.extent.XMin) / snapRaster.meanCellWidth
+    dy = (raster.extent.YMin - snapRaster.extent.YMin) / snapRaster.meanCellHeight
+    return abs(dx - round(dx)) < 0.001 and abs(dy - round(dy)) < 0.001
+
+def OpenRasterStore(raster, CacheFolder):
+    ##Store of the raster in the cache folder (decoded once, see RasterStore.py), or None without a cache
+    ##folder or if the raster cannot be fingerprinted
+    if CacheFolder == "":
+        return None
+    return RasterStore.OpenStore(arcpy, raster, CacheFolder)
+
+def NeededCells(labelArr, pad):
+    ##Cells of the outlines in the label grid, grown by pad cells (the neighbours of the slope and aspect)
+    inside = labelArr > 0
+    if pad == 0:
+        return inside
+    nrows, ncols = inside.shape
+    need = np.zeros((nrows + 2 * pad, ncols + 2 * pad), dtype=bool)
+    for di in range(2 * pad + 1):
+        for dj in range(2 * pad + 1):
+            need[di:di+nrows, dj:dj+ncols] |= inside
+    return need
+
+def ParseRatios(text):
+    ##Parse a list of ratios for the sensitivity sweep, either as "0.4;0.5;0.6" (or comma separated)
+    ##or as a range "start:stop:step", e.g. "0.4:0.8:0.05" (stop included)
+    text = text.strip()
+    if text == "":
+        return np.zeros(0)
+    if ":" in text:
+        start, stop, step = [float(v) for v in text.split(":")]
+        return np.round(np.arange(start, stop + step / 2, step), 6)
+    return np.array([float(v) for v in text.replace(",", ";").split(";") if v.strip() != ""])
+
+def ParseRasters(text):
+    ##Parse the rasters of a multivalue parameter ("a;b;c", the paths with spaces are quoted)
+    return [v.strip().strip("'\"") for v in text.split(";") if v.strip() != ""]
+
+def ZoneAttributes(work, labelArr, lowerLeft, cells, zoneOffsets, maxPolyID, IceSurf, IceTck, interval, AARratio, AABRratio, CacheFolder=""):
+    ##Derive the zonal statistics of ice surface, slope, aspect, and ice thickness and the Hypsomax, HI, 3D ratio and ELAs
+    ##of all outlines for one pair of ice surface and ice thickness rasters. labelArr is the label grid of the outlines on
+    ##the grid of the ice surface (RasterizeOutlines), with its cells grouped by outline (GlacierZones.ZoneCells), so that
+    ##the scenarios on the same grid share one rasterization. With a cache folder, the rasters are read from their
+    ##chunked stores (only the chunks with outlines). Returns a dictionary of arrays indexed by PolyID
+    import ELAKernels, GlacierZones ##The kernels (numba) are only imported if there are outlines to compute
+    ##Read the ice surface once, with a one-cell pad so that the slope and aspect of the cells on the edge of the grid use their neighbours
+    nrows, ncols = labelArr.shape
+    surfRaster = Raster(IceSurf)
+    cellsize = surfRaster.meanCellWidth, surfRaster.meanCellHeight
+    surfStore = OpenRasterStore(IceSurf, CacheFolder)
+    surfPad = ReadRasterWindow(surfRaster, arcpy.Point(lowerLeft.X - cellsize[0], lowerLeft.Y - cellsize[1]), ncols + 2, nrows + 2,
+                               surfStore, NeededCells(labelArr, 1))
+    surfArr = surfPad[1:-1, 1:-1].copy()
+    slopeArr, aspectArr = GlacierZones.SlopeAspect(surfPad, cellsize[0], cellsize[1])
+    del surfPad
+
+    ##Derive the statistics of all rasters in one visit of each glacier.
+    ##The ice thickness raster joins the same pass if it is on the grid of the ice surface
+    zoneRasters = [surfArr, slopeArr, aspectArr]
+    circular = [False, False, True] ##Circular statistics for aspect
+    tckRaster = Raster(IceTck)
+    tckSameGrid = SameGrid(tckRaster, surfRaster)
+    tckStore = OpenRasterStore(IceTck, CacheFolder)
+    if tckSameGrid:
+        zoneRasters.append(ReadRasterWindow(tckRaster, lowerLeft, ncols, nrows, tckStore, labelArr > 0))
+        circular.append(False)
+    zoneStats = GlacierZones.ZonalStats(zoneRasters, circular, cells, zoneOffsets)
+    del zoneRasters, slopeArr, aspectArr
+    if not tckSameGrid:
+        tckLabels, tckLowerLeft = RasterizeOutlines(work, "PolyID", IceTck)
+        tckCells, tckOffsets = GlacierZones.ZoneCells(tckLabels, maxPolyID)
+        tckArr = ReadRasterWindow(tckRaster, tckLowerLeft, tckLabels.shape[1], tckLabels.shape[0], tckStore, tckLabels > 0)
+        tckStats = GlacierZones.ZonalStats([tckArr], [False], tckCells, tckOffsets)
+        zoneStats = [np.vstack((a, b)) for a, b in zip(zoneStats, tckStats)]
+        del tckLabels, tckCells, tckArr
+    for store in (surfStore, tckStore):
+        if store is not None:
+            store.close()
+    zones = dict(zip(("count", "sum", "min", "max", "mean", "median", "std"), zoneStats))
+
+    ##Group the elevations by outline, so that each glacier is one contiguous slice of EleFlat
+    EleFlat, offsets = GlacierZones.GroupedValues(surfArr, cells, zoneOffsets)
+    EleFlat = EleFlat.astype(int) ##Get the elevations greater than zero
+    zones["EleFlat"], zones["offsets"] = EleFlat, offsets
+    zones["HI"], zones["Hypsomax"] = GlacierZones.HypsometricStats(EleFlat, offsets)
+
+    ##Derive the A3D/A2D ratio of all glaciers from the ice surface grid in the same pass
+    zones["Ratio3D2D"] = GlacierZones.SurfaceAreaRatio(labelArr, surfArr, maxPolyID, cellsize[0], cellsize[1])
+
+    ##Derive the ELAs of all glaciers at once with the batched kernels (parallel over glaciers)
+    zones["AAR"], zones["MGE"] = ELAKernels.ELA_AAR_MGE_Batch(EleFlat, offsets, interval, AARratio)
+    zones["AA"], zones["AABR"] = ELAKernels.ELA_AA_AABR_Batch(EleFlat, offsets, interval, AABRratio)
+    return zones
+
+def AttributeColumns(zones, gid, A2D):
+    ##Derived attributes of the outlines gid (PolyIDs) with the 2D areas A2D as a list of (field, values, valid).
+    ##The outlines without ice surface info get -999 for the ELAs and the hypsometry (MGE and AAR are not valid),
+    ##and the zonal statistics are only valid for the outlines with cells
+    SURF, SLOPE, ASPECT, TCK = 0, 1, 2, 3 ##Rows of the zonal statistics
+    count, zmin, zmax, zmean, zmedian, zstd = [zones[k] for k in ("count", "min", "max", "mean", "median", "std")]
+    hasELA = ~np.isnan(zones["AAR"][gid])
+    allValid = np.ones(len(gid), dtype=bool)
+    surf = count[SURF, gid] > 0
+    tck = count[TCK, gid] > 0
+    ##Adjust Area3D based on the A3D/A2D ratio and vector A2D to be consistent with the ratio
+    return [("MGE", zones["MGE"][gid], hasELA), ("AAR", zones["AAR"][gid], hasELA),
+            ("AA", np.where(hasELA, np.trunc(zones["AA"][gid]), -999), allValid),
+            ("AABR", np.where(hasELA, zones["AABR"][gid], -999), allValid),
+            ("HI", np.where(hasELA, np.round(zones["HI"][gid], 3), -999), allValid),
+            ("Hypsomax", np.where(hasELA, zones["Hypsomax"][gid], -999), allValid),
+            ("A3D2D", np.where(hasELA, np.round(zones["Ratio3D2D"][gid], 3), -999), allValid),
+            ("A3D", np.where(hasELA, A2D * zones["Ratio3D2D"][gid], -999), allValid),
+            ("Z_min", zmin[SURF, gid], surf), ("Z_max", zmax[SURF, gid], surf),
+            ("Z_range", zmax[SURF, gid] - zmin[SURF, gid], surf), ("Z_mean", zmean[SURF, gid], surf),
+            ("Z_median", zmedian[SURF, gid], surf), ("Z_mid", (zmax[SURF, gid] + zmin[SURF, gid]) / 2, surf),
+            ("MeanSlope", np.round(zmean[SLOPE, gid], 1), count[SLOPE, gid] > 0),
+            ("MeanAspect", np.round(zmean[ASPECT, gid], 1), count[ASPECT, gid] > 0),
+            ("MeanTck", np.round(zmean[TCK, gid], 1), tck), ("StdTck", np.round(zstd[TCK, gid], 1), tck),
+            ("MedianTck", np.round(zmedian[TCK, gid], 1), tck), ("MaxTck", np.round(zmax[TCK, gid], 1), tck),
+            ("Vol_km3", np.round((A2D * zmean[TCK, gid]) / 1e9, 4), tck)] ##volume km3
+
+def AddDerivedGlacierAttributes(InputPGIPolygons, GlaStage, RecMethod, IceSurf, IceTck, interval, AARratio, AABRratio,
+                                OutputPGIoutlines, AARratios="", AABRratios="", OutputSweepTable="", CacheFolder="", ProfileReport="",
+                                ScenarioSurfaces="", ScenarioThicknesses="", OutputScenarioTable="",
+                                Realizations=0, DEMError=0, AARratioStd=0, AABRratioStd=0, HypsometryFile=""):
+    ##Add the derived attributes to the outlines. The arguments are the parameters of the tool (empty strings
+    ##for the optional parameters not used; the sweep ratios and the scenario rasters as text). Returns the output outlines
+
+    ##Optional ELA sensitivity sweep over many AAR and AABR ratios
+    AARratios = ParseRatios(AARratios)
+    AABRratios = ParseRatios(AABRratios)
+    SweepELA = OutputSweepTable != "" and (len(AARratios) > 0 or len(AABRratios) > 0)
+    interval = int(interval)
+
+    ##Optional scenarios: more pairs of ice surface and ice thickness rasters (e.g. other yield stresses or shape
+    ##factors) evaluated for the same outlines. The input pair is the first scenario
+    ScenarioSurfaces = ParseRasters(ScenarioSurfaces)
+    ScenarioThicknesses = ParseRasters(ScenarioThicknesses)
+    if len(ScenarioSurfaces) != len(ScenarioThicknesses):
+        raise Exception("The scenarios need the same number of ice surface and ice thickness rasters")
+    Scenarios = [(IceSurf, IceTck)] + list(zip(ScenarioSurfaces, ScenarioThicknesses))
+    ScenarioTable = OutputScenarioTable != "" and len(Scenarios) > 1
+
+    ##Optional Monte Carlo uncertainty of the ELAs: the realizations perturb the elevations of each glacier with
+    ##a normal DEM error and draw the AAR and AABR ratios from normal distributions (standard deviations)
+    Realizations = int(Realizations or 0)
+    DEMError, AARratioStd, AABRratioStd = [float(v or 0) for v in (DEMError, AARratioStd, AABRratioStd)]
+    MonteCarlo = Realizations > 0
+    MCFields = [method + "_" + stat for method in ("MGE", "AAR", "AA", "AABR") for stat in ("Mean", "Std", "P5", "P95")]
+    profile = Profiler.Profiler("AddDerivedGlacierAttributes", arcpy.AddMessage)
+
+    profile.Start("Copy the outlines and add the attribute fields...")
+    ##Copy the input to output polygon; the attributes are added in place if the output is the input
+    if OutputPGIoutlines != InputPGIPolygons:
+        arcpy.CopyFeatures_management(InputPGIPolygons, OutputPGIoutlines)
+
+    exist_fields = [f.name for f in arcpy.ListFields(OutputPGIoutlines)] #List of current field names in outline layer
+    IDName = "PGI_ID"
+
+    b_PGI_ID = False
+    if IDName not in exist_fields:
+        #arcpy.AddMessage("The PGI ID does not exist! Will create one with the default ID start with PGI_LGM_ ")
+        arcpy.AddField_management(OutputPGIoutlines, IDName, "TEXT") #field for ice value
+        b_PGI_ID = True
+
+    if "RecMethod" in exist_fields:
+        pass
+    else:
+        arcpy.AddField_management(OutputPGIoutlines, "RecMethod", 'Text')
 
-new_fields = ("Z_min","Z_max", "Z_range", "Z_mean","Z_median","Z_mid") ##All Integer variables count = 6
-for field in new_fields:
-    if field in exist_fields:
+    if "A3D" in exist_fields:
         pass
     else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "LONG",10)
+        arcpy.AddField_management(OutputPGIoutlines, "A3D", "LONG",10)
 
-new_fields = ("MeanSlope","MeanAspect", "Hypsomax")
-for field in new_fields:
-    if field in exist_fields:
+    if "A3D2D" in exist_fields:
         pass
     else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "DOUBLE", 8, 1)
-      
+        arcpy.AddField_management(OutputPGIoutlines, "A3D2D", "DOUBLE", 6, 3)
 
-if "HI" in exist_fields:
-    pass
-else:
-    arcpy.AddField_management(OutputPGIoutlines, "HI", "DOUBLE", 6, 3)
+    new_fields = ("Z_min","Z_max", "Z_range", "Z_mean","Z_median","Z_mid") ##All Integer variables count = 6
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "LONG",10)
+
+    new_fields = ("MeanSlope","MeanAspect", "Hypsomax")
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "DOUBLE", 8, 1)
 
-new_fields = ("MGE","AAR","AA","AABR")
-for field in new_fields:
-    if field in exist_fields:
+
+    if "HI" in exist_fields:
         pass
     else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "LONG",10)        
+        arcpy.AddField_management(OutputPGIoutlines, "HI", "DOUBLE", 6, 3)
+
+    new_fields = ("MGE","AAR","AA","AABR")
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "LONG",10)        
+
+    new_fields = ("MeanTck", "StdTck", "MedianTck", "MaxTck") 
+    for field in new_fields:
+        if field in exist_fields:
+            pass
+        else:
+            arcpy.AddField_management(OutputPGIoutlines, field, "FLOAT",10, 1)
 
-new_fields = ("MeanTck", "StdTck", "MedianTck", "MaxTck") 
-for field in new_fields:
-    if field in exist_fields:
+    if "Vol_km3" in exist_fields:
         pass
     else:
-        arcpy.AddField_management(OutputPGIoutlines, field, "FLOAT",10, 1)
+        arcpy.AddField_management(OutputPGIoutlines, "Vol_km3", "FLOAT", 10, 4)
 
-if "Vol_km3" in exist_fields:
-    pass
-else:
-    arcpy.AddField_management(OutputPGIoutlines, "Vol_km3", "FLOAT", 10, 4)
+    if MonteCarlo:
+        for field in MCFields:
+            if field in exist_fields:
+                pass
+            else:
+                arcpy.AddField_management(OutputPGIoutlines, field, "DOUBLE", 8, 1)
 
-##Add elevation fields
-if "PolyID" in exist_fields:
-    pass
-else:
-    arcpy.AddField_management(OutputPGIoutlines, 'PolyID', 'Long', 6)
-
-arcpy.CalculateField_management(OutputPGIoutlines,"PolyID",str("!"+str(arcpy.Describe(OutputPGIoutlines).OIDFieldName)+"!"),"PYTHON_9.3")
-
-
-arcpy.AddMessage("Step 1: Add glacier surface elevation-related attributes...")
-zonalSAT = arcpy.env.scratchGDB + "\\zonalSAT"
-ZonalStatisticsAsTable(OutputPGIoutlines, "PolyID", Raster(IceSurf),  zonalSAT, "#", "ALL")
-fieldList = ["Min", "Max", "Mean", "Median"]
-arcpy.JoinField_management(OutputPGIoutlines, 'PolyID', zonalSAT, 'PolyID', fieldList)
-##Add the attributes to the PGIpolugons
-fields = ["Z_min","Z_max", "Z_range", "Z_mean","Z_median","Z_mid", "Min", "Max", "Mean", "Median", "RecMethod"]
-with arcpy.da.UpdateCursor(OutputPGIoutlines,fields) as cursor:   #populate ice field with value from the nearest flowline point
-    for row in cursor:
-        row[0]= row[6]
-        row[1] = row[7]
-        row[2] = row[7] - row[6]
-        row[3] = row[8]
-        row[4] = row[9]
-        row[5] = (row[7] + row[6]) / 2
-        row[10] = RecMethod
-        cursor.updateRow(row)
-del row, cursor
-
-arcpy.DeleteField_management(OutputPGIoutlines,["Min", "Max", "Mean", "Median"])
-arcpy.Delete_management(temp_workspace + "\\zonalSAT")
-
-##Check if the PGIIG needs to be added
-poly_points = temp_workspace + "\\poly_points"
-poly_points_GCS = temp_workspace + "\\poly_points_GCS"
-arcpy.FeatureToPoint_management (OutputPGIoutlines, poly_points, "INSIDE")
-spatial_ref = arcpy.Describe(poly_points).spatialReference
-    
-if "GCS" in spatial_ref.name:
-    arcpy.CopyFeatures_management(poly_points, poly_points_GCS)
-else:
-    #arcpy.AddMessage("The DEM projection is not GCS. Re-project!")
-    out_coordinate_system = arcpy.SpatialReference("GCS_WGS_1984")
-    arcpy.Project_management(poly_points, poly_points_GCS, out_coordinate_system)
-
-arcpy.AddXY_management(poly_points_GCS)
-
-arcpy.AddMessage("Add PGI_ID...")
-polys_spatialjoin = temp_workspace + "\\polys_spatialjoin"
-arcpy.SpatialJoin_analysis(OutputPGIoutlines, poly_points_GCS, polys_spatialjoin, "JOIN_ONE_TO_ONE", "KEEP_ALL", '#', "COMPLETELY_CONTAINS")
-polyarray = arcpy.da.FeatureClassToNumPyArray(polys_spatialjoin, ('Point_X', 'Point_Y'))  
-pnt_x = np.array([item[0] for item in polyarray])
-pnt_y = np.array([item[1] for item in polyarray])
-ids = []
-for i in range(len(pnt_x)):
-    long_str = str(pnt_x[i])
-    dot = long_str.find(".")
-    endpos = dot + 4
-    if pnt_x[i] < 0:
-        ext_str = long_str[1:endpos]
-        if len(ext_str) < 6:
-            ext_str = "0" + ext_str
-        x_str = ext_str + "W"       
-    else:
-        ext_str = long_str[0:endpos]
-        if len(ext_str) < 6:
-            ext_str = "0" + ext_str
-        x_str = ext_str + "E"       
-
-    lat_str = str(pnt_y[i])
-    dot = lat_str.find(".")
-    endpos = dot + 4
-    if pnt_y[i] < 0:
-        ext_str = lat_str[1:endpos]
-        if len(ext_str) < 6:
-            ext_str = "0" + ext_str
-        y_str = ext_str + "S"       
+    ##Add elevation fields
+    if "PolyID" in exist_fields:
+        pass
     else:
-        ext_str = lat_str[0:endpos]
-        if len(ext_str) < 6:
-            ext_str = "0" + ext_str
-        y_str = ext_str + "N"       
-
-    ##Combine str
-    ids.append(x_str+y_str)
-
-##Add the attributes to the PGIpolugons
-Prefix = "PGI_" + GlaStage + "_"
-fields = [IDName]
-with arcpy.da.UpdateCursor(OutputPGIoutlines,fields) as cursor:   #populate ice field with value from the nearest flowline point
-    i = 0
-    for row in cursor:
-        row[0] = Prefix + ids[i]
-        #row[1] = RecMethod
-        cursor.updateRow(row)
-        i += 1
-del row, cursor
-
-arcpy.AddMessage("Step 2: Add slope and aspect-related attrbutes...")
-
-DEM_slope = Slope(IceSurf)  
-DEM_aspect = Aspect(IceSurf)
-
-##Use zonalstatistics to get the meanslope and meanaspect
-outZSaT = ZonalStatisticsAsTable(OutputPGIoutlines, 'PolyID', DEM_slope, temp_workspace + "\\zonalSAT", "#", "MEAN")
-arcpy.JoinField_management(OutputPGIoutlines, 'PolyID', temp_workspace + "\\zonalSAT", 'PolyID', "Mean")
-##Add the attributes to the PGIpolugons
-fields = ["MeanSlope", "Mean"]
-with arcpy.da.UpdateCursor(OutputPGIoutlines,fields) as cursor:   #populate ice field with value from the nearest flowline point
-    for row in cursor:
-        row[0]= round(row[1],1)
-        cursor.updateRow(row)
-del row, cursor
-arcpy.DeleteField_management(OutputPGIoutlines,["Mean"])
-arcpy.Delete_management(temp_workspace + "\\zonalSAT")
-
-outZSaT = ZonalStatisticsAsTable(OutputPGIoutlines, 'PolyID', DEM_aspect, temp_workspace + "\\zonalASP", "#", "MEAN", "#", "#", "#", "CIRCULAR") ##use circular statistics for aspect
-arcpy.JoinField_management(OutputPGIoutlines, 'PolyID', temp_workspace + "\\zonalASP", 'PolyID', "C_MEAN")
-
-
-##Add the attributes to the PGIpolugons
-fields = ["MeanAspect", "C_MEAN"]
-with arcpy.da.UpdateCursor(OutputPGIoutlines,fields) as cursor:   #populate ice field with value from the nearest flowline point
-    for row in cursor:
-        row[0]= round(row[1], 1)
-        cursor.updateRow(row)
-del row, cursor
-arcpy.DeleteField_management(OutputPGIoutlines,["C_MEAN"])
-arcpy.Delete_management(temp_workspace + "\\zonalASP")
-
-arcpy.AddMessage("Step 3: Add Hypsomax, HI, 3D, and recontructed ELA...")
-
-FcID = arcpy.Describe(OutputPGIoutlines).OIDFieldName
-fields = (FcID, "SHAPE@","MGE","AAR","AA","AABR", "HI", "Hypsomax", "A3D2D", "A3D", "SHAPE@AREA")
-
-volumetable = arcpy.env.scratchFolder + "\\volumetable.txt"
-    
-
-with arcpy.da.UpdateCursor(OutputPGIoutlines, fields) as cursor:
-    for row in cursor:
-        gid = row[0]
-        arcpy.AddMessage("Processing Glacier #" + str(gid))
-
-        galcierDEM = ExtractByMask(IceSurf, row[1])
-
-        array = arcpy.RasterToNumPyArray(galcierDEM,"","","",0)
-        EleArr = array[array > 0].astype(int) ##Get the elevations greater than zero
-        try:
-            ela_aar, ela_mge = ELA_AAR_MGE(EleArr, interval, AARratio)
-            row[2] = ela_mge
-            row[3] = ela_aar
-            ela_aa, ela_AABR = ELA_AA_AABR(EleArr, interval, AABRratio)
-            row[4] = ela_aa
-            row[5] = ela_AABR
-
-            ##Calcualte the Hypsometric max and Hypsometric intergal
-            Z_min = np.min(EleArr)
-            Z_max = np.max(EleArr)
-            Z_mean = np.mean(EleArr)
-
-            Hi = (Z_mean - Z_min) / (Z_max - Z_min)
-            row[6] = round(Hi,3)
-            
-            vals,counts = np.unique(EleArr, return_counts=True)
-            index = np.argmax(counts)
-            hypo_max = vals[index]
-            row[7] = hypo_max
-            
-            #calculate 3D surface
-            ##Step 1: Conduct Suface Volume analysis to generate the surface volume table, volumetable
-            if arcpy.Exists(volumetable):
-                arcpy.Delete_management(volumetable)
-            
-            arcpy.SurfaceVolume_3d(galcierDEM, volumetable, "ABOVE", "0")
-            ##Step 2: Read the volume table for 3D area and 2Darea, and calculate the A3D/A2D ratio
-            arr=arcpy.da.TableToNumPyArray(volumetable, ('AREA_2D', 'AREA_3D'))
-            area_2D = float(arr[0][0])
-            area_3D = float(arr[0][1])
-            Ratio3D2D = area_3D / area_2D
-            ##Step 3: Assign the values to the attibute fields
-            row[8] = round(Ratio3D2D, 3)
-            ##Step 4: make sure to delete volumetable, so that it only has one record for the corresponding cirque outline
-            arcpy.Delete_management(volumetable)
-
-            #Adjust Area3D based on the A3D/A2D ratio and vector A2D to be consistent with the ratio
-            A2D = row[10]
-            adjusted_area_3D = A2D * Ratio3D2D
-            row[9] = adjusted_area_3D
-        except:
-            arcpy.AddMessage("No ice surface info are related to the outline")
-            row[4] = -999
-            row[5] = -999
-            row[6] = -999
-            row[7] = -999
-            row[8] = -999
-            row[9] = -999
-        
-        cursor.updateRow(row)
-
-del row, cursor
-
-arcpy.AddMessage("Step 4: Add ice thickness-related attributes...")
-outZSaT = ZonalStatisticsAsTable(OutputPGIoutlines, 'PolyID', Raster(IceTck), temp_workspace + "\\zonalSAT", "#", "ALL")
-fieldList = ["Mean", "STD", "Median", "Max"]
-arcpy.JoinField_management(OutputPGIoutlines, 'PolyID', temp_workspace + "\\zonalSAT", 'PolyID', fieldList)
-##Add the attributes to the PGIpolugons
-fields = ["MeanTck", "StdTck", "MedianTck", "MaxTck", "Vol_km3", "Mean", "STD", "Median", "Max", "SHAPE@AREA"]
-with arcpy.da.UpdateCursor(OutputPGIoutlines,fields) as cursor:   #populate ice field with value from the nearest flowline point
-    for row in cursor:
-        row[0]= round(row[5],1)  ##mean
-        row[1] = round(row[6],1) ##std
-        row[2] = round(row[7],1) ##median
-        row[3] = round(row[8],1) ##max
-        row[4] = round((row[9] * row[5]) / 1e9, 4) ##volume km3
-        cursor.updateRow(row)
-del row, cursor
-
-arcpy.DeleteField_management(OutputPGIoutlines,["Mean", "STD", "Median", "Max"])
-arcpy.DeleteField_management(OutputPGIoutlines,["PolyID"])
-
-arcpy.AddMessage("Finished!!!")
-arcpy.Delete_management("temp_workspace")
+        arcpy.AddField_management(OutputPGIoutlines, 'PolyID', 'Long', 6)
+
+    arcpy.CalculateField_management(OutputPGIoutlines,"PolyID",str("!"+str(arcpy.Describe(OutputPGIoutlines).OIDFieldName)+"!"),"PYTHON_9.3")
+
+    ##The attributes of all outlines are accumulated in one columnar table keyed by PolyID (the computed and
+    ##the cached results) and written to the output in a single cursor pass at the end
+    ResultFields = [IDName, "RecMethod", "A3D", "A3D2D", "Z_min", "Z_max", "Z_range", "Z_mean", "Z_median", "Z_mid", "MeanSlope", "MeanAspect",
+                    "Hypsomax", "HI", "MGE", "AAR", "AA", "AABR", "MeanTck", "StdTck", "MedianTck", "MaxTck", "Vol_km3"]
+    ScenarioFields = ResultFields[2:]
+    if MonteCarlo:
+        ResultFields = ResultFields + MCFields
+    allIDs = arcpy.da.FeatureClassToNumPyArray(OutputPGIoutlines, "PolyID")["PolyID"]
+    results = AttributeWriter.ResultTable(allIDs, [(field, "O" if field in (IDName, "RecMethod") else "f8") for field in ResultFields])
+
+    ##Result cache: the outlines are keyed by their geometry and the fingerprint of the rasters and parameters,
+    ##and only the outlines without cached results are computed (the "work" outlines)
+    cache = None
+    cachedResults = {}
+    outlineKeys = {}
+    sweepELAs = {} ##ELAs of the sensitivity sweep of each PolyID
+    scenarioValues = {} ##Attributes of each scenario of each PolyID
+    hypsometry = {} ##Lowest elevation and bin counts of each PolyID
+    work = OutputPGIoutlines
+    if CacheFolder != "":
+        profile.Start("Look up the result cache...")
+        rasterFingerprints = [RasterStore.RasterFingerprint(arcpy, raster) for pair in (Scenarios if ScenarioTable else Scenarios[:1]) for raster in pair]
+        if None in rasterFingerprints:
+            arcpy.AddMessage("The rasters cannot be fingerprinted (e.g. in memory), the result cache is not used")
+        else:
+            ##The spatial reference of the outlines is part of the fingerprint, as the PGI_ID and the areas depend on it.
+            ##The sweep ratios and the scenarios are only part of it if their tables are requested, so the cached
+            ##results of the outlines have the ELAs of the sweep and the scenario attributes of the tables
+            sweepRatios = [AARratios.tolist(), AABRratios.tolist()] if SweepELA else None
+            fingerprint = ResultCache.Fingerprint("AddDerivedGlacierAttributes", rasterFingerprints, GlaStage, RecMethod, interval,
+                                                  AARratio, AABRratio, sweepRatios, ScenarioTable, Realizations, DEMError, AARratioStd, AABRratioStd,
+                                                  arcpy.Describe(OutputPGIoutlines).spatialReference.exportToString())
+            with arcpy.da.SearchCursor(OutputPGIoutlines, ["PolyID", "SHAPE@WKB"]) as cursor:
+                for row in cursor:
+                    outlineKeys[row[0]] = ResultCache.GeometryKey(row[1], fingerprint)
+            del row, cursor
+            cache = ResultCache.OpenCache(CacheFolder, "DerivedGlacierAttributes")
+            cachedResults = ResultCache.LookupResults(cache, outlineKeys.values())
+            computeIDs = [str(polyID) for polyID in outlineKeys if outlineKeys[polyID] not in cachedResults]
+            arcpy.AddMessage("Reuse the cached attributes of " + str(len(outlineKeys) - len(computeIDs)) + " outlines and compute " + str(len(computeIDs)) + " outlines")
+            if len(computeIDs) < len(outlineKeys):
+                work = "outlines_to_compute"
+                if len(computeIDs) > 0:
+                    where = arcpy.AddFieldDelimiters(OutputPGIoutlines, "PolyID") + " IN (" + ",".join(computeIDs) + ")"
+                else:
+                    where = arcpy.AddFieldDelimiters(OutputPGIoutlines, "PolyID") + " < 0"
+                arcpy.MakeFeatureLayer_management(OutputPGIoutlines, work, where)
+
+    import PGIDEngine ##Only imported (with numba) when the tool runs
+    workIDs = arcpy.da.FeatureClassToNumPyArray(work, "PolyID")["PolyID"]
+    if len(workIDs) > 0:
+        profile.Start("Step 1: Derive the zonal statistics, Hypsomax, HI, 3D, and recontructed ELA...")
+        import GlacierZones
+        ##Rasterize all outlines into one label grid aligned to the ice surface and group its cells by outline once
+        labelArr, lowerLeft = RasterizeOutlines(work, "PolyID", IceSurf)
+        maxPolyID = int(workIDs.max())
+        cells, zoneOffsets = GlacierZones.ZoneCells(labelArr, maxPolyID)
+        zones = ZoneAttributes(work, labelArr, lowerLeft, cells, zoneOffsets, maxPolyID, IceSurf, IceTck, interval, AARratio, AABRratio, CacheFolder)
+
+        profile.Start("Add PGI_ID...")
+        ##The PGI_ID from the label point (inside) of each outline, derived from the geometry and projected to
+        ##WGS 1984 in bulk, without intermediate point feature classes
+        polyIDs = []
+        wkbs = []
+        with arcpy.da.SearchCursor(work, ["PolyID", "SHAPE@WKB"]) as cursor:
+            for row in cursor:
+                polyIDs.append(row[0])
+                wkbs.append(row[1])
+        del row, cursor
+        pnt_x, pnt_y = PGIDEngine.GeographicLabelPoints(arcpy, wkbs, arcpy.Describe(work).spatialReference)
+        del wkbs
+        results[IDName][AttributeWriter.RowIndex(results, np.array(polyIDs))] = PGIDEngine.FormatPGIIDs(pnt_x, pnt_y, "PGI_" + GlaStage + "_")
+
+        profile.Start("Step 2: Derive all attributes...")
+        ##All attributes of the work outlines are derived as columns (no cursor)
+        areaArr = arcpy.da.FeatureClassToNumPyArray(work, ["PolyID", "SHAPE@AREA"])
+        gid = areaArr["PolyID"]
+        A2D = areaArr["SHAPE@AREA"]
+        rows = AttributeWriter.RowIndex(results, gid)
+        profile.Count("outlines_without_ice_surface", int(np.sum(np.isnan(zones["AAR"][gid]))))
+        results["RecMethod"][rows] = RecMethod
+        for field, values, valid in AttributeColumns(zones, gid, A2D):
+            results[field][rows[valid]] = values[valid]
+
+        if HypsometryFile != "" or cache is not None:
+            ##Keep the binned hypsometry of the ELA pass (bins of interval) for the hypsometry file and the result cache
+            hypsoStart, hypsoOffsets, hypsoCounts = GlacierZones.HypsometryBins(zones["EleFlat"], zones["offsets"], interval)
+            for polyID in workIDs[np.diff(hypsoOffsets)[workIDs] > 0]: ##Only the outlines with ice surface info
+                hypsometry[polyID] = [int(hypsoStart[polyID]), hypsoCounts[hypsoOffsets[polyID]:hypsoOffsets[polyID+1]].tolist()]
+            del hypsoStart, hypsoOffsets, hypsoCounts
+
+        if MonteCarlo:
+            profile.Start("Derive the ELA uncertainty from " + str(Realizations) + " realizations...")
+            import ELAKernels
+            ##The ratios of each realization are shared by all glaciers and the DEM error is drawn for each glacier;
+            ##the fixed seed makes the statistics reproducible
+            rng = np.random.default_rng(0)
+            AARsamples = np.clip(rng.normal(AARratio, AARratioStd, Realizations), 0.01, 0.99)
+            AABRsamples = np.clip(rng.normal(AABRratio, AABRratioStd, Realizations), 0.01, None)
+            mcStats = ELAKernels.ELA_MonteCarlo_Batch(zones["EleFlat"], zones["offsets"], interval, AARsamples, AABRsamples, DEMError, 0)
+            valid = ~np.isnan(mcStats[gid, 0, 0])
+            for k in range(len(MCFields)):
+                results[MCFields[k]][rows[valid]] = np.round(mcStats[gid[valid], k // 4, k % 4], 1)
+            del mcStats
+
+        if ScenarioTable:
+            ##The other scenarios share the label grid and the grouped cells of the input ice surface if they are on its grid
+            scenarioArr = np.full((len(gid), len(Scenarios), len(ScenarioFields)), np.nan)
+            surfRaster = Raster(IceSurf)
+            for sc in range(len(Scenarios)):
+                profile.Start("Derive the attributes of scenario " + str(sc + 1) + " of " + str(len(Scenarios)) + "...")
+                if sc > 0:
+                    if SameGrid(Raster(Scenarios[sc][0]), surfRaster):
+                        scenarioZones = ZoneAttributes(work, labelArr, lowerLeft, cells, zoneOffsets, maxPolyID, Scenarios[sc][0], Scenarios[sc][1],
+                                                       interval, AARratio, AABRratio, CacheFolder)
+                    else:
+                        scenarioLabels, scenarioLowerLeft = RasterizeOutlines(work, "PolyID", Scenarios[sc][0])
+                        scenarioCells, scenarioOffsets = GlacierZones.ZoneCells(scenarioLabels, maxPolyID)
+                        scenarioZones = ZoneAttributes(work, scenarioLabels, scenarioLowerLeft, scenarioCells, scenarioOffsets, maxPolyID,
+                                                       Scenarios[sc][0], Scenarios[sc][1], interval, AARratio, AABRratio, CacheFolder)
+                        del scenarioLabels, scenarioCells
+                else:
+                    scenarioZones = zones
+                for field, values, valid in AttributeColumns(scenarioZones, gid, A2D):
+                    scenarioArr[valid, sc, ScenarioFields.index(field)] = values[valid]
+                del scenarioZones
+            for i in range(len(gid)):
+                scenarioValues[gid[i]] = [[None if np.isnan(v) else float(v) for v in values] for values in scenarioArr[i]]
+            del scenarioArr
+        del labelArr, cells
+
+        arcpy.Delete_management(temp_workspace + "\\outline_labels")
+        if profile.counters.get("outlines_without_ice_surface", 0) > 0:
+            arcpy.AddMessage("No ice surface info are related to " + str(profile.counters["outlines_without_ice_surface"]) + " outlines")
+
+        if SweepELA:
+            profile.Start("Derive the ELAs for " + str(len(AARratios)) + " AAR ratios and " + str(len(AABRratios)) + " AABR ratios...")
+            import ELAKernels
+            offsets = zones["offsets"]
+            ELA_AAR_sweep, ELA_AABR_sweep = ELAKernels.ELA_Sweep_Batch(zones["EleFlat"], offsets, interval, AARratios, AABRratios)
+            for gid in workIDs[np.diff(offsets)[workIDs] > 0]: ##Only the outlines with ice surface info
+                sweepELAs[gid] = np.concatenate((ELA_AAR_sweep[gid], ELA_AABR_sweep[gid])).tolist()
+
+    if cache is not None:
+        profile.Start("Apply and update the result cache...")
+        ##Reuse the cached results and store the new results in the cache
+        reused = dict((polyID, cachedResults[key]) for polyID, key in outlineKeys.items() if key in cachedResults)
+        AttributeWriter.SetRecords(results, reused, ResultFields)
+        for polyID in reused:
+            if "SweepELA" in reused[polyID]:
+                sweepELAs[polyID] = reused[polyID]["SweepELA"]
+            if "Scenarios" in reused[polyID]:
+                scenarioValues[polyID] = reused[polyID]["Scenarios"]
+            if "Hypsometry" in reused[polyID]:
+                hypsometry[polyID] = reused[polyID]["Hypsometry"]
+        newResults = {}
+        for polyID, result in AttributeWriter.GetRecords(results, workIDs, ResultFields).items():
+            if polyID in sweepELAs:
+                result["SweepELA"] = sweepELAs[polyID]
+            if polyID in scenarioValues:
+                result["Scenarios"] = scenarioValues[polyID]
+            if polyID in hypsometry:
+                result["Hypsometry"] = hypsometry[polyID]
+            newResults[outlineKeys[polyID]] = result
+        ResultCache.StoreResults(cache, newResults)
+        cache.close()
+
+    ##The outlines with the same PGI_ID (label points within 0.001 degree) get a suffix, also for the cached PGI_IDs
+    results[IDName], nDuplicates = PGIDEngine.UniqueIDs(results[IDName])
+    if nDuplicates > 0:
+        arcpy.AddMessage("A suffix is added to " + str(nDuplicates) + " duplicate PGI_IDs")
+
+    profile.Start("Write all attributes...")
+    AttributeWriter.WriteTable(arcpy, OutputPGIoutlines, "PolyID", results, ResultFields, profile.Progress)
+
+    if SweepELA and len(sweepELAs) > 0:
+        profile.Start("Add the ELA sensitivity table for " + str(len(AARratios)) + " AAR ratios and " + str(len(AABRratios)) + " AABR ratios...")
+        polyIDs = np.array(sorted(sweepELAs.keys()))
+        pgiIDs = results[IDName][AttributeWriter.RowIndex(results, polyIDs)].astype(str)
+
+        ##Long format table: one record for each glacier, method and ratio
+        nAAR = len(AARratios)
+        nAABR = len(AABRratios)
+        sweep = np.zeros(len(polyIDs) * (nAAR + nAABR), dtype=[(IDName, "U50"), ("Method", "U10"), ("Ratio", "f8"), ("ELA", "f8")])
+        sweep[IDName] = np.repeat(pgiIDs, nAAR + nAABR)
+        sweep["Method"] = np.tile(np.array(["AAR"] * nAAR + ["AABR"] * nAABR), len(polyIDs))
+        sweep["Ratio"] = np.tile(np.concatenate((AARratios, AABRratios)), len(polyIDs))
+        sweep["ELA"] = np.array([sweepELAs[polyID] for polyID in polyIDs]).ravel()
+        if arcpy.Exists(OutputSweepTable):
+            arcpy.Delete_management(OutputSweepTable)
+        arcpy.da.NumPyArrayToTable(sweep, OutputSweepTable)
+
+    if ScenarioTable and len(scenarioValues) > 0:
+        profile.Start("Add the scenario table for " + str(len(Scenarios)) + " scenarios...")
+        polyIDs = np.array(sorted(scenarioValues.keys()))
+        pgiIDs = results[IDName][AttributeWriter.RowIndex(results, polyIDs)].astype(str)
+
+        ##Long format table: one record for each glacier and scenario (NaN = no value)
+        nScenarios = len(Scenarios)
+        values = np.array([scenarioValues[polyID] for polyID in polyIDs], dtype=np.float64)
+        table = np.zeros(len(polyIDs) * nScenarios, dtype=[(IDName, "U50"), ("Scenario", "i4"), ("IceSurf", "U255"), ("IceTck", "U255")] +
+                                                          [(field, "f8") for field in ScenarioFields])
+        table[IDName] = np.repeat(pgiIDs, nScenarios)
+        table["Scenario"] = np.tile(np.arange(1, nScenarios + 1), len(polyIDs))
+        table["IceSurf"] = np.tile([os.path.basename(pair[0]) for pair in Scenarios], len(polyIDs))
+        table["IceTck"] = np.tile([os.path.basename(pair[1]) for pair in Scenarios], len(polyIDs))
+        for k in range(len(ScenarioFields)):
+            table[ScenarioFields[k]] = values[:, :, k].ravel()
+        if arcpy.Exists(OutputScenarioTable):
+            arcpy.Delete_management(OutputScenarioTable)
+        arcpy.da.NumPyArrayToTable(table, OutputScenarioTable)
+
+    if HypsometryFile != "" and len(hypsometry) > 0:
+        profile.Start("Write the hypsometry of " + str(len(hypsometry)) + " glaciers...")
+        import HypsometryStore
+        polyIDs = np.array(sorted(hypsometry.keys()))
+        pgiIDs = results[IDName][AttributeWriter.RowIndex(results, polyIDs)].astype(str)
+        desc = arcpy.Describe(IceSurf)
+        HypsometryStore.WriteHypsometry(HypsometryFile, pgiIDs, [hypsometry[polyID][0] for polyID in polyIDs],
+                                        [hypsometry[polyID][1] for polyID in polyIDs], interval, desc.meanCellWidth * desc.meanCellHeight)
+
+    if work != OutputPGIoutlines:
+        arcpy.Delete_management(work) ##The layer of the outlines without cached results
+    arcpy.DeleteField_management(OutputPGIoutlines,["PolyID"])
+    ##Delete the temporary datasets of this tool only, so that the other datasets in memory (such as the
+    ##outlines of a batch run) are kept
+    for name in ["outline_labels"]:
+        if arcpy.Exists(temp_workspace + "\\" + name):
+            arcpy.Delete_management(temp_workspace + "\\" + name)
+    profile.Finish(ProfileReport)
+
+    arcpy.AddMessage("Finished!!!")
+    return OutputPGIoutlines
 
+##main program
+if __name__ == "__main__":
+    AddDerivedGlacierAttributes(arcpy.GetParameterAsText(0), ##Input outlines
+                                arcpy.GetParameterAsText(1), ##Glacial stage
+                                arcpy.GetParameterAsText(2), ##Reconstruction method
+                                arcpy.GetParameterAsText(3), ##Ice surface raster
+                                arcpy.GetParameterAsText(4), ##Ice thickness raster
+                                arcpy.GetParameter(5),       ##Elevation bin
+                                arcpy.GetParameter(6),       ##AAR ratio
+                                arcpy.GetParameter(7),       ##AABR ratio
+                                arcpy.GetParameterAsText(8), ##Output outlines
+                                arcpy.GetParameterAsText(9), ##Optional ELA sensitivity sweep over many AAR and AABR ratios
+                                arcpy.GetParameterAsText(10),
+                                arcpy.GetParameterAsText(11), ##Output sweep table
+                                arcpy.GetParameterAsText(12), ##Optional folder of the result cache and the raster stores, to reuse the attributes of the unchanged outlines and the decoded rasters of a previous run
+                                arcpy.GetParameterAsText(13), ##Optional profile report (JSON or CSV) of the time and memory of each step
+                                arcpy.GetParameterAsText(14), ##Optional scenarios: more ice surface rasters
+                                arcpy.GetParameterAsText(15), ##and the ice thickness raster of each of them
+                                arcpy.GetParameterAsText(16), ##Output scenario table
+                                arcpy.GetParameter(17),       ##Optional Monte Carlo realizations of the ELA uncertainty (0 = none)
+                                arcpy.GetParameter(18),       ##DEM error (m, standard deviation)
+                                arcpy.GetParameter(19),       ##Standard deviation of the AAR ratio
+                                arcpy.GetParameter(20),       ##Standard deviation of the AABR ratio
+                                arcpy.GetParameterAsText(21)) ##Optional hypsometry file (.npz) of the glaciers
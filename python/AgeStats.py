@@ -0,0 +1,119 @@
+﻿#-------------------------------------------------------------------------------
+# Name: AgeStats.py
+# Purpose: This module derives the age attributes of the outlines in AddBasicGlacierAttributes.py
+#          from large age point collections (such as ICE-D samples) in close to linear time.
+#          The age points are joined to the outlines within a distance with a KD-tree of the
+#          points, queried once per outline and refined with the exact point-polygon distance,
+#          instead of a SpatialJoin. The min, max, median and mean ages of each outline (of the
+#          site with the most samples if the sites are given) are then derived with grouped
+#          reductions over the ages sorted by outline, instead of a mask per outline.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import numpy as np
+
+def PointsInRings(points, rings):
+    ##Even-odd test of the points against all rings of a polygon (outer rings and holes)
+    inside = np.zeros(len(points), dtype=bool)
+    x = points[:, 0][:, None]
+    y = points[:, 1][:, None]
+    for ring in rings:
+        x0 = ring[:-1, 0][None, :]
+        y0 = ring[:-1, 1][None, :]
+        x1 = ring[1:, 0][None, :]
+        y1 = ring[1:, 1][None, :]
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xCross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= (np.count_nonzero(crosses & (x < xCross), axis=1) % 2) == 1
+    return inside
+
+def DistanceToRings(points, rings):
+    ##Shortest distance from the points to the edges of the rings
+    dist = np.full(len(points), np.inf)
+    px = points[:, 0][:, None]
+    py = points[:, 1][:, None]
+    for ring in rings:
+        x0 = ring[:-1, 0][None, :]
+        y0 = ring[:-1, 1][None, :]
+        dx = ring[1:, 0][None, :] - x0
+        dy = ring[1:, 1][None, :] - y0
+        length2 = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(length2 > 0, ((px - x0) * dx + (py - y0) * dy) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        ex = px - (x0 + t * dx)
+        ey = py - (y0 + t * dy)
+        dist = np.minimum(dist, np.sqrt(ex * ex + ey * ey).min(axis=1))
+    return dist
+
+def WithinDistanceJoin(pointXY, polygons, distance):
+    ##Join each point to the first polygon (in the given order) within the distance, the same as a
+    ##one-to-one SpatialJoin with WITHIN_A_DISTANCE. polygons is a list of (PolyID, rings) with the
+    ##rings as closed (n, 2) coordinate arrays. Returns the PolyID of each point (-1 = no polygon)
+    from scipy.spatial import cKDTree ##Only imported if a join is needed
+    joined = np.full(len(pointXY), -1, dtype=np.int64)
+    if len(pointXY) == 0:
+        return joined
+    tree = cKDTree(pointXY)
+    for polyID, rings in polygons:
+        allXY = np.concatenate(rings)
+        xmin, ymin = allXY.min(axis=0)
+        xmax, ymax = allXY.max(axis=0)
+        center = [(xmin + xmax) / 2.0, (ymin + ymax) / 2.0]
+        radius = np.hypot(xmax - xmin, ymax - ymin) / 2.0 + distance
+        candidates = np.array(tree.query_ball_point(center, radius), dtype=np.int64)
+        if len(candidates) == 0:
+            continue
+        candidates = candidates[joined[candidates] < 0]
+        ##Exact test in chunks to limit the size of the point x edge arrays
+        step = max(1, 4000000 // len(allXY))
+        for s in range(0, len(candidates), step):
+            chunk = candidates[s:s + step]
+            points = pointXY[chunk]
+            within = PointsInRings(points, rings)
+            near = ~within
+            if near.any():
+                within[near] = DistanceToRings(points[near], rings) <= distance
+            joined[chunk[within]] = polyID
+    return joined
+
+def GroupedAgeStats(polyIDs, ages, sites=None):
+    ##Min, max, median and mean age of each polyID with grouped reductions. If the sites are given,
+    ##only the ages of the site with the most samples of each polyID are used (the lowest site ID
+    ##if there are ties). Returns the unique polyIDs, the four statistics and the selected sites
+    uniqueIDs, polyIdx = np.unique(polyIDs, return_inverse=True)
+    polyIdx = polyIdx.ravel()
+    ages = np.asarray(ages, dtype=np.float64)
+    nPolys = len(uniqueIDs)
+    if sites is not None:
+        uniqueSites, siteIdx = np.unique(sites, return_inverse=True)
+        siteIdx = siteIdx.ravel()
+        ##Count the samples of each (polyID, site) pair and keep the most frequent site of each polyID
+        pairs, pairCounts = np.unique(polyIdx * len(uniqueSites) + siteIdx, return_counts=True)
+        pairPoly = pairs // len(uniqueSites)
+        pairSite = pairs % len(uniqueSites)
+        order = np.lexsort((pairSite, -pairCounts, pairPoly))
+        first = np.flatnonzero(np.concatenate(([True], np.diff(pairPoly[order]) != 0)))
+        bestSite = np.empty(nPolys, dtype=np.int64)
+        bestSite[pairPoly[order[first]]] = pairSite[order[first]]
+        keep = siteIdx == bestSite[polyIdx]
+        polyIdx = polyIdx[keep]
+        ages = ages[keep]
+        siteOut = uniqueSites[bestSite]
+    else:
+        siteOut = np.full(nPolys, "NULL", dtype=object)
+
+    ##Sort the ages within each polyID; every polyID keeps at least one age
+    order = np.lexsort((ages, polyIdx))
+    sortedAges = ages[order]
+    counts = np.bincount(polyIdx, minlength=nPolys)
+    starts = np.zeros(nPolys, dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    minAges = sortedAges[starts]
+    maxAges = sortedAges[starts + counts - 1]
+    medianAges = (sortedAges[starts + (counts - 1) // 2] + sortedAges[starts + counts // 2]) / 2.0
+    meanAges = np.add.reduceat(sortedAges, starts) / counts
+    return uniqueIDs, minAges, maxAges, medianAges, meanAges, siteOut
@@ -0,0 +1,76 @@
+﻿#-------------------------------------------------------------------------------
+# Name: AttributeWriter.py
+# Purpose: This module accumulates the attributes derived by AddBasicGlacierAttributes.py and
+#          AddDerivedGlacierAttributes.py in one columnar table (a NumPy structured array with one
+#          record per outline, keyed by PolyID) and writes all fields in a single UpdateCursor pass,
+#          instead of one cursor pass per group of attributes. The float columns start as NaN and
+#          the text columns as None, meaning "not set": the current value of the field is kept.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import numpy as np
+
+def ResultTable(ids, fields):
+    ##Columnar result table of the outlines: the sorted unique IDs in the "ID" column and one column for
+    ##each (name, type) in fields, type "f8" (float, NaN = not set) or "O" (text, None = not set)
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    table = np.zeros(len(ids), dtype=[("ID", "i8")] + [(name, dtype) for name, dtype in fields])
+    table["ID"] = ids
+    for name, dtype in fields:
+        if dtype == "O":
+            table[name] = None
+        else:
+            table[name] = np.nan
+    return table
+
+def RowIndex(table, ids):
+    ##Positions of the IDs in the table (all IDs must be in the table)
+    return np.searchsorted(table["ID"], np.asarray(ids, dtype=np.int64))
+
+def SetRecords(table, records, fields):
+    ##Set the fields of the outlines from a dictionary ID: {field: value} (such as the cached results)
+    for outlineID, record in records.items():
+        i = RowIndex(table, [outlineID])[0]
+        for name in fields:
+            value = record.get(name)
+            if value is None and table.dtype[name] != np.dtype("O"):
+                value = np.nan
+            table[name][i] = value
+
+def GetRecords(table, ids, fields):
+    ##Dictionary ID: {field: value} of the outlines with the values as Python values (None = not set)
+    records = {}
+    for i in RowIndex(table, ids):
+        record = {}
+        for name in fields:
+            value = table[name][i]
+            if isinstance(value, (float, np.floating)):
+                value = None if np.isnan(value) else float(value)
+            record[name] = value
+        records[int(table["ID"][i])] = record
+    return records
+
+def WriteTable(arcpy, featureClass, idField, table, fields, progress=None):
+    ##Write the fields of the table to the feature class in a single UpdateCursor pass. The rows without
+    ##a record and the values not set are left unchanged. progress(done, total) is called for each row
+    ##(e.g. the throttled Profiler.Progress)
+    columns = [table[name] for name in fields]
+    isFloat = [column.dtype != np.dtype("O") for column in columns]
+    nRecords = len(table)
+    with arcpy.da.UpdateCursor(featureClass, [idField] + list(fields)) as cursor:
+        done = 0
+        for row in cursor:
+            i = np.searchsorted(table["ID"], row[0])
+            if i < nRecords and table["ID"][i] == row[0]:
+                for k in range(len(columns)):
+                    value = columns[k][i]
+                    if value is None or (isFloat[k] and np.isnan(value)):
+                        continue
+                    row[k+1] = float(value) if isFloat[k] else value
+                cursor.updateRow(row)
+                done += 1
+                if progress is not None:
+                    progress(done, nRecords)
+    del cursor
@@ -0,0 +1,272 @@
+﻿#-------------------------------------------------------------------------------
+# Name: BasinMerge.py
+# Purpose: This module merges the drainage basins derived by DivideforWatersheds.py on the
+#          basin label raster instead of repeating vector overlays. The basins within the
+#          glacier outlines are split into connected regions, and a region adjacency graph
+#          (RAG) is built with the min/max elevation and area of each region and the length
+#          of the boundary shared by each pair of regions. Regions with a small elevation
+#          range (relief) are then merged into their neighbours with a priority queue and a
+#          union-find structure, followed by the regions with a small area. The merged label
+#          raster is vectorized only once at the end.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import heapq
+import numpy as np
+from NumbaCompat import jit
+
+BandRows = 1024 ##Rows of the bands of the passes over the rasters that may be memory-mapped
+
+@jit(nopython=True)
+def FloodRegions(basinArr, nodata, regions):
+    ##Number the 4-connected regions of the same basin value from 1 in row-major order into
+    ##regions (a zero grid of the same shape). Returns the number of regions. The stack of the
+    ##flood fill starts small and is doubled when it is full, so it only holds the cells still to
+    ##visit of the current region instead of one entry per cell of the raster
+    nrows, ncols = basinArr.shape
+    stack = np.empty(1024, dtype=np.int64)
+    nRegions = 0
+    for i in range(nrows):
+        for j in range(ncols):
+            if regions[i, j] > 0 or basinArr[i, j] == nodata:
+                continue
+            nRegions += 1
+            value = basinArr[i, j]
+            regions[i, j] = nRegions
+            top = 0
+            stack[top] = i * ncols + j
+            top += 1
+            while top > 0:
+                top -= 1
+                r = stack[top] // ncols
+                c = stack[top] % ncols
+                for k in range(4):
+                    rr = r + (k == 1) - (k == 0)
+                    cc = c + (k == 3) - (k == 2)
+                    if rr >= 0 and rr < nrows and cc >= 0 and cc < ncols:
+                        if regions[rr, cc] == 0 and basinArr[rr, cc] == value:
+                            regions[rr, cc] = nRegions
+                            if top == len(stack):
+                                larger = np.empty(2 * len(stack), dtype=np.int64)
+                                larger[:top] = stack
+                                stack = larger
+                            stack[top] = rr * ncols + cc
+                            top += 1
+    return nRegions
+
+def LabelRegions(basinArr, nodata, regions=None):
+    ##Split the basins into 4-connected regions of the same basin value, numbered from 1
+    ##in row-major order. Cells with the nodata value get 0. regions is the int32 grid of the
+    ##result (e.g. memory-mapped for a large raster), filled with zeros; allocated if None
+    if regions is None:
+        regions = np.zeros(basinArr.shape, dtype=np.int32)
+    return regions, FloodRegions(basinArr, nodata, regions)
+
+@jit(nopython=True)
+def RegionStats(regions, demArr, nRegions):
+    ##Min and max elevation and the number of cells of each region
+    zmin = np.full(nRegions + 1, np.inf)
+    zmax = np.full(nRegions + 1, -np.inf)
+    count = np.zeros(nRegions + 1, dtype=np.int64)
+    nrows, ncols = regions.shape
+    for i in range(nrows):
+        for j in range(ncols):
+            r = regions[i, j]
+            if r > 0:
+                z = demArr[i, j]
+                if z < zmin[r]:
+                    zmin[r] = z
+                if z > zmax[r]:
+                    zmax[r] = z
+                count[r] += 1
+    return zmin, zmax, count
+
+@jit(nopython=True)
+def RegionEdges(regions, nRows):
+    ##All pairs of 4-adjacent cells of two different regions, as (smaller, larger) region ids, of the
+    ##first nRows rows (the pairs of a cell and the cell below it belong to the row of the cell)
+    nrows, ncols = regions.shape
+    n = 0
+    for i in range(nRows):
+        for j in range(ncols):
+            r = regions[i, j]
+            if r == 0:
+                continue
+            if j + 1 < ncols and regions[i, j+1] > 0 and regions[i, j+1] != r:
+                n += 1
+            if i + 1 < nrows and regions[i+1, j] > 0 and regions[i+1, j] != r:
+                n += 1
+    edgeA = np.empty(n, dtype=np.int64)
+    edgeB = np.empty(n, dtype=np.int64)
+    n = 0
+    for i in range(nRows):
+        for j in range(ncols):
+            r = regions[i, j]
+            if r == 0:
+                continue
+            if j + 1 < ncols and regions[i, j+1] > 0 and regions[i, j+1] != r:
+                edgeA[n] = min(r, regions[i, j+1])
+                edgeB[n] = max(r, regions[i, j+1])
+                n += 1
+            if i + 1 < nrows and regions[i+1, j] > 0 and regions[i+1, j] != r:
+                edgeA[n] = min(r, regions[i+1, j])
+                edgeB[n] = max(r, regions[i+1, j])
+                n += 1
+    return edgeA, edgeB
+
+def CombineCounts(keys, counts):
+    ##Sum the counts of the same key over the lists of (unique) keys and counts of the bands
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    return keys, np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+
+def EdgeLengths(regions, nRegions):
+    ##Shared boundary length (number of cell edges) of each pair of adjacent regions, with the
+    ##pair as key a * (nRegions + 1) + b (a < b). The raster is read by bands of rows, so only
+    ##the cell edges of one band are held at a time
+    keys = []
+    lengths = []
+    nrows = regions.shape[0]
+    for r0 in range(0, nrows, BandRows):
+        r1 = min(r0 + BandRows, nrows)
+        edgeA, edgeB = RegionEdges(regions[r0:r1 + 1], r1 - r0) ##With the next row for the edges below the band
+        bandKeys, bandLengths = np.unique(edgeA * (nRegions + 1) + edgeB, return_counts=True)
+        keys.append(bandKeys)
+        lengths.append(bandLengths)
+    return CombineCounts(keys, lengths)
+
+def AdjacencyGraph(keys, lengths, nRegions):
+    ##Region adjacency graph of the edge lengths: one dictionary per region with the shared
+    ##boundary length of each neighbour
+    adjacency = [dict() for i in range(nRegions + 1)]
+    for key, length in zip(keys.tolist(), lengths.tolist()):
+        a, b = divmod(key, nRegions + 1)
+        adjacency[a][b] = length
+        adjacency[b][a] = length
+    return adjacency
+
+def RegionAdjacency(regions, nRegions):
+    ##Region adjacency graph of the regions
+    keys, lengths = EdgeLengths(regions, nRegions)
+    return AdjacencyGraph(keys, lengths, nRegions)
+
+def Relabel(regions, newLabels):
+    ##Replace each region id of the raster by its new label in place, by bands of rows
+    for r0 in range(0, regions.shape[0], BandRows):
+        regions[r0:r0 + BandRows] = newLabels[regions[r0:r0 + BandRows]]
+    return regions
+
+def Find(parent, r):
+    ##Find the root of a region with path compression
+    root = r
+    while parent[root] != root:
+        root = parent[root]
+    while parent[r] != root:
+        parent[r], r = root, parent[r]
+    return root
+
+def Union(parent, adjacency, zmin, zmax, count, r, target):
+    ##Merge region r into target: combine the statistics and the neighbours of both regions
+    parent[r] = target
+    zmin[target] = min(zmin[target], zmin[r])
+    zmax[target] = max(zmax[target], zmax[r])
+    count[target] += count[r]
+    for nb, length in adjacency[r].items():
+        del adjacency[nb][r]
+        if nb == target:
+            continue
+        adjacency[target][nb] = adjacency[target].get(nb, 0) + length
+        adjacency[nb][target] = adjacency[nb].get(target, 0) + length
+    adjacency[r] = dict()
+
+def MergeTarget(adjacency, zmin, zmax, r):
+    ##The neighbour sharing the longest boundary with r (then the larger relief, then the lower id)
+    best = -1
+    bestKey = None
+    for nb, length in adjacency[r].items():
+        key = (length, zmax[nb] - zmin[nb], -nb)
+        if bestKey is None or key > bestKey:
+            best = nb
+            bestKey = key
+    return best
+
+def MergeSmallRegions(parent, adjacency, zmin, zmax, count, isSmall, sortKey, merges=None):
+    ##Pop the smallest region (by sortKey) from the priority queue and merge it into its
+    ##neighbour until no small region with a neighbour is left. Stale queue entries are
+    ##skipped by comparing the stamp of the region. Each merge is appended to the merges
+    ##list (if given) as (region, target, sort key of the region)
+    nRegions = len(parent) - 1
+    stamp = [0] * (nRegions + 1)
+    heap = [(sortKey(r), 0, r) for r in range(1, nRegions + 1) if parent[r] == r and isSmall(r)]
+    heapq.heapify(heap)
+    nMerged = 0
+    while heap:
+        key, s, r = heapq.heappop(heap)
+        if parent[r] != r or s != stamp[r] or not isSmall(r):
+            continue
+        target = MergeTarget(adjacency, zmin, zmax, r)
+        if target < 0:
+            continue ##Isolated region, nothing to merge with
+        Union(parent, adjacency, zmin, zmax, count, r, target)
+        if merges is not None:
+            merges.append((r, target, key))
+        nMerged += 1
+        stamp[target] += 1
+        if isSmall(target):
+            heapq.heappush(heap, (sortKey(target), stamp[target], target))
+    return nMerged
+
+def MajorityValues(labels, values):
+    ##The most frequent value (> 0) of the cells of each label (the lower value of a tie), as an
+    ##array indexed by the label (0 = no value), e.g. the parent outline of each merged basin. The
+    ##(label, value) pairs are counted by bands of rows, so the rasters may be memory-mapped
+    nLabels = int(labels.max()) if labels.size > 0 else 0
+    majority = np.zeros(nLabels + 1, dtype=np.int64)
+    base = max(int(values.max()), 0) + 1 if values.size > 0 else 1
+    pairs = []
+    counts = []
+    for r0 in range(0, labels.shape[0], BandRows):
+        bandLabels = labels[r0:r0 + BandRows]
+        bandValues = values[r0:r0 + BandRows]
+        valid = (bandLabels > 0) & (bandValues > 0)
+        if valid.any():
+            bandPairs, bandCounts = np.unique(bandLabels[valid].astype(np.int64) * base + bandValues[valid], return_counts=True)
+            pairs.append(bandPairs)
+            counts.append(bandCounts)
+    if len(pairs) == 0:
+        return majority
+    pairs, counts = CombineCounts(pairs, counts)
+    pairLabels, pairValues = np.divmod(pairs, base)
+    order = np.lexsort((pairValues, -counts, pairLabels)) ##By label, then the largest count first
+    first = order[np.r_[True, pairLabels[order][1:] != pairLabels[order][:-1]]]
+    majority[pairLabels[first]] = pairValues[first]
+    return majority
+
+def MergeBasins(basinArr, demArr, nodata, cellArea, minRelief, minArea, regions=None):
+    ##Merge the basins with a relief less than minRelief, and then the basins with an area less
+    ##than minArea, into their neighbours. Returns the merged label raster (0 = no data, labels
+    ##numbered from 1), the number of regions before merging and the number of merges. regions is
+    ##the int32 grid of the merged labels (e.g. memory-mapped for a large raster), filled with zeros;
+    ##allocated if None. The region and merged labels share this grid
+    regions, nRegions = LabelRegions(basinArr, nodata, regions)
+    zmin, zmax, count = RegionStats(regions, np.asarray(demArr, dtype=np.float64), nRegions)
+    adjacency = RegionAdjacency(regions, nRegions)
+    parent = list(range(nRegions + 1))
+
+    ##Step 1: merge the small-relief basins, the lowest relief first
+    nMerged = MergeSmallRegions(parent, adjacency, zmin, zmax, count,
+                                lambda r: zmax[r] - zmin[r] < minRelief,
+                                lambda r: (zmax[r] - zmin[r], count[r], r))
+    ##Step 2: merge the remaining small-area basins, the smallest first
+    nMerged += MergeSmallRegions(parent, adjacency, zmin, zmax, count,
+                                 lambda r: count[r] * cellArea < minArea,
+                                 lambda r: (count[r], zmax[r] - zmin[r], r))
+
+    ##Relabel the merged regions from 1
+    roots = np.array([Find(parent, r) for r in range(nRegions + 1)], dtype=np.int64)
+    uniqueRoots, newLabels = np.unique(roots, return_inverse=True)
+    merged = Relabel(regions, newLabels.astype(np.int32))
+    return merged, nRegions, nMerged
@@ -9,10 +9,12 @@
 # Knoxville, TN 37996
 #-------------------------------------------------------------------------------
 # Import arcpy module
-import arcpy, sys
+import arcpy, sys, os, shutil, math
+import multiprocessing
 from arcpy import env
 from arcpy.sa import *
 import numpy as np
+import Profiler
 arcpy.env.overwriteOutput = True
 arcpy.env.XYTolerance= "0.01 Meters"
 ArcGISPro = 0
@@ -43,131 +45,334 @@ temp_workspace = "in_memory"
 if ArcGISPro:
     temp_workspace = "memory"
     
-##main program
-InputDEM = arcpy.GetParameterAsText(0)
-InputOutlines = arcpy.GetParameterAsText(1)
-Min_Ele_Range = arcpy.GetParameter(2)
-OutputIndividualOutlines = arcpy.GetParameterAsText(3)
-
-##Clean up the temp_workspace
-arcpy.Delete_management(temp_workspace)
-#spatialref=arcpy.Describe(InputDEM).spatialReference
-cellsize = arcpy.GetRasterProperties_management(InputDEM,"CELLSIZEX")
-cellsize_int = int(float(cellsize.getOutput(0)))
-min_area = 5 *  cellsize_int * cellsize_int ##set the min_area as 5 cell sizes of the DEM
-
-##Step 1: clip DEM based on the buffer of oulines 
-arcpy.AddMessage("Step 1: Extract DEM for glacier outlines...")
-##Do a loop for each outline polygon
-outline_buf = temp_workspace + "\\outline_buf"
-dissove_buf = temp_workspace + "\\dissove_buf"
-buffer_dis = str(cellsize_int*10) + " Meters"  ##use the 10 times of cell size for the buffer distance
-arcpy.Buffer_analysis(InputOutlines, outline_buf, buffer_dis)
-arcpy.Dissolve_management(outline_buf, dissove_buf, "", "", "SINGLE_PART")
-##Extract DEM
-extractDEM = ExtractByMask(InputDEM, dissove_buf)
-
-###Step 2: Basin analysis
-arcpy.AddMessage("Step 2: Extract catchments for glacier outlines...")
-
-##set the parallelProcessingFactor for large DEMs
-#dem = Raster(extractDEM)
-nrow = extractDEM.height
-ncol = extractDEM.width
-
-oldPPF = arcpy.env.parallelProcessingFactor
-if (nrow > 1500 or ncol > 1500):
-    #arcpy.AddMessage("The DEM has " +str(nrow) + " rows and " + str(ncol) + " columns")
-    arcpy.env.parallelProcessingFactor = 0 ##use 0 for large rasters
-    
-#Hydro analysis
-fillDEM =Fill(extractDEM)  ##Fill the sink first
-fdir = FlowDirection(fillDEM, "FORCE") ##Flow direction force out edge
-outBasin = Basin(fdir)
-
-#Extract the outbasin within the input outlines
-extBasin = ExtractByMask(outBasin, InputOutlines)
-
-##Convert Raster to Polygon
-arcpy.RasterToPolygon_conversion(extBasin, temp_workspace + "\\divided_polys", "SIMPLIFY", "VALUE", "SINGLE_OUTER_PART")
-
-
-##Merge the polygons based on the elevation range of the polygon
-arcpy.AddMessage("Step 3: Merge small_relief polygons to nearby large polygons...")
-arcpy.AddField_management(temp_workspace + "\\divided_polys", 'MergeID', 'Long', 6) 
-arcpy.AddField_management(temp_workspace + "\\divided_polys", 'AREA', 'Long', 10)
-arcpy.CalculateField_management(temp_workspace + "\\divided_polys","MergeID",str("!"+str(arcpy.Describe(temp_workspace + "\\divided_polys").OIDFieldName)+"!"),"PYTHON_9.3")
-
-##Add the Area attribute
-with arcpy.da.UpdateCursor(temp_workspace + "\\divided_polys",("SHAPE@AREA", "AREA")) as cursor:   #populate ice field with value from the nearest flowline point
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
-del row, cursor
-
-##Extract the elevation range for the polygons based on Zonal ststistics
-#outZonalStatistics = ZonalStatistics(temp_workspace + "\\divided_polys", 'MergeID', fillDEM, "RANGE")
-outZSaT = ZonalStatisticsAsTable(temp_workspace + "\\divided_polys", 'MergeID', fillDEM, temp_workspace + "\\zonalDEM", "#", "ALL")
-fieldList = ["Range", "Mean"]
-arcpy.JoinField_management(temp_workspace + "\\divided_polys", 'MergeID', temp_workspace + "\\zonalDEM", 'MergeID', fieldList)
-#arcpy.CopyFeatures_management(temp_workspace + "\\divided_polys", "c:\\test\\divided_polys.shp")
-
-small_relief_polygons = temp_workspace + "\\small_relief_polygons"
-large_relief_polygons = temp_workspace + "\\large_relief_polygons"
-min_relief = float(Min_Ele_Range)
-query = "( Range < " + str(min_relief) + ") or (AREA < " + str(min_area) + ")" 
-#arcpy.AddMessage(query)
-arcpy.Select_analysis (temp_workspace + "\\divided_polys", small_relief_polygons, query)
-polyArray = arcpy.da.FeatureClassToNumPyArray(small_relief_polygons, "OID@")
-arcpy.AddMessage("The number of merged small relief polygons is " + str(len(polyArray)))
-if len(polyArray)> 0: ## if there are small polygons
-    bLoop = True
-    start_n = len(polyArray)
-    while bLoop:
-        arcpy.Erase_analysis(temp_workspace + "\\divided_polys", small_relief_polygons, large_relief_polygons)
-        
-        arcpy.SpatialJoin_analysis(small_relief_polygons, large_relief_polygons, temp_workspace + "\\small_polygons_spatialjoin", "JOIN_ONE_TO_ONE", "KEEP_ALL", '#', "INTERSECT", "1 Meters", "#")
-        with arcpy.da.UpdateCursor(temp_workspace + "\\small_polygons_spatialjoin",("MergeID", "MergeID_1")) as cursor:   #populate ice field with value from the nearest flowline point
+def ReadRasterArray(raster, lowerLeft, ncols, nrows, store=None):
+    ##Read a raster window as a float array with NaN for NoData. With the store of the DEM (RasterStore.py), the
+    ##raster is the rasterized buffer of the outlines: the DEM is read from the chunks within the buffer
+    if store is not None:
+        inside = arcpy.RasterToNumPyArray(raster, lowerLeft, ncols, nrows, 0) > 0
+        arr = store.Window(lowerLeft.X, lowerLeft.Y, ncols, nrows, inside).astype(np.float64)
+        if store.noData is not None:
+            arr[arr == store.noData] = np.nan
+        arr[~inside] = np.nan
+        return arr
+    arr = arcpy.RasterToNumPyArray(raster, lowerLeft, ncols, nrows).astype(np.float64)
+    if raster.noDataValue is not None:
+        arr[arr == raster.noDataValue] = np.nan
+    return arr
+
+def RowBands(raster, nrows, bandRows):
+    ##Row ranges and lower left corners of the row bands of a raster, to read it band by band
+    bands = []
+    for r0 in range(0, nrows, bandRows):
+        r1 = min(r0 + bandRows, nrows)
+        bands.append((r0, r1, arcpy.Point(raster.extent.XMin, raster.extent.YMax - r1 * raster.meanCellHeight)))
+    return bands
+
+def RasterizeOutlines(outlines, snapRaster, labelName, extent=None):
+    ##Rasterize the outlines (OID as value) on the grid of the snap raster with the cell center
+    ##rule (the same as ExtractByMask) within the extent (default: the extent of the snap raster);
+    ##NoData = outside of the outlines
+    oldSnapRaster = arcpy.env.snapRaster
+    oldExtent = arcpy.env.extent
+    oldSR = arcpy.env.outputCoordinateSystem
+    arcpy.env.snapRaster = snapRaster
+    arcpy.env.extent = snapRaster.extent if extent is None else extent
+    arcpy.env.outputCoordinateSystem = snapRaster.spatialReference
+
+    labelRaster = temp_workspace + "\\" + labelName
+    arcpy.PolygonToRaster_conversion(outlines, arcpy.Describe(outlines).OIDFieldName, labelRaster, "CELL_CENTER", "", snapRaster.meanCellWidth)
+
+    arcpy.env.snapRaster = oldSnapRaster
+    arcpy.env.extent = oldExtent
+    arcpy.env.outputCoordinateSystem = oldSR
+    return labelRaster
+
+def WriteBasinPolygons(mergedArr, parentArr, XMin, YMin, cellW, cellH, min_area, spatialRef, workArr=None):
+    ##Convert the merged basins to polygons: the boundaries are traced once and each shared boundary is simplified
+    ##once for both basins, so no slivers or gaps are created. The small parts (less than min_area) are absorbed by
+    ##their neighbours on the raster, so the polygons need no clean up. The ParentID of each polygon is the OID of
+    ##the outline with most of the cells of the basin (parentArr is the outline raster on the same grid). workArr is
+    ##a zero int32 grid for the small parts (memory-mapped for the tiled DEMs), allocated if None
+    import BasinMerge, Vectorize
+    parents = BasinMerge.MajorityValues(mergedArr, parentArr)
+    polygons = Vectorize.VectorizeLabels(mergedArr, XMin, YMin, cellW, cellH, int(math.ceil(min_area / (cellW * cellH))), regions=workArr)
+    Vectorize.WritePolygons(arcpy, temp_workspace + "\\divided_polys", spatialRef, polygons, labelValues={"ParentID": parents})
+
+def TransferAttributes(InputOutlines, OutputIndividualOutlines):
+    ##Copy the divided polygons to the output with the attributes of their parent outline (ParentID), so no
+    ##spatial join is needed. The output has the fields of the input outlines
+    divided_polys = temp_workspace + "\\divided_polys"
+    path, name = os.path.split(OutputIndividualOutlines)
+    if path == "": ##A name only: the dataset is in the current workspace
+        path = arcpy.env.workspace
+    arcpy.CreateFeatureclass_management(path, name, "POLYGON", InputOutlines, spatial_reference=arcpy.Describe(divided_polys).spatialReference)
+    outputFields = [f.name.upper() for f in arcpy.ListFields(OutputIndividualOutlines)]
+    fields = [f.name for f in arcpy.ListFields(InputOutlines) if f.type not in ("OID", "Geometry") and f.editable and f.name.upper() in outputFields]
+    attributes = {}
+    with arcpy.da.SearchCursor(InputOutlines, ["OID@"] + fields) as cursor:
+        for row in cursor:
+            attributes[row[0]] = row[1:]
+    del cursor
+    with arcpy.da.InsertCursor(OutputIndividualOutlines, ["SHAPE@"] + fields) as outCursor:
+        with arcpy.da.SearchCursor(divided_polys, ["SHAPE@", "ParentID"]) as cursor:
             for row in cursor:
-                row[0]=row[1]
-                cursor.updateRow(row)
-        del row, cursor
-        arcpy.Append_management(temp_workspace + "\\small_polygons_spatialjoin", large_relief_polygons, "NO_TEST")
-        arcpy.Dissolve_management(large_relief_polygons, temp_workspace + "\\divided_polys", "MergeID")
-        
-        arcpy.Select_analysis (temp_workspace + "\\divided_polys", temp_workspace + "\\Null_polygons", "MergeID IS NULL")
-        arcpy.MultipartToSinglepart_management(temp_workspace + "\\Null_polygons", small_relief_polygons)
-        polyArray2 = arcpy.da.FeatureClassToNumPyArray(small_relief_polygons, "OID@")
-        arcpy.AddMessage("The number of small relief polygons left is " + str(len(polyArray2)))
-        
-        if ((len(polyArray2) == 0) or (len(polyArray2) == start_n)):
-            break
-        start_n = len(polyArray2)
-                      
-    arcpy.DeleteField_management(temp_workspace + "\\divided_polys",["MergeID"])
+                if row[1] in attributes: ##ParentID = 0: the basin is not within the outlines
+                    outCursor.insertRow((row[0],) + attributes[row[1]])
+        del cursor
+    del outCursor
+    ##Delete the temporary datasets of this tool only, so that the other datasets in memory (such as the
+    ##outlines of a batch run) are kept
+    for name in ["outline_buf", "dissove_buf", "buffer_labels", "part_labels", "outline_labels", "divided_polys"]:
+        if arcpy.Exists(temp_workspace + "\\" + name):
+            arcpy.Delete_management(temp_workspace + "\\" + name)
+
+def DivideforWatersheds(InputDEM, InputOutlines, Min_Ele_Range, OutputIndividualOutlines, UseNumPyHydro=False, TileSize=0,
+                        UseParallel=False, ProfileReport="", OutputHierarchy="", InputHierarchy="", CacheFolder=""):
+    ##Divide the outlines for watersheds. The arguments are the parameters of the tool: UseNumPyHydro uses the
+    ##NumPy/numba hydrology engine instead of Spatial Analyst, TileSize processes the DEM in tiles of TileSize x
+    ##TileSize cells with the NumPy engine (0 = no tiling; the DEM and the basin, outline and merged rasters are then
+    ##memory-mapped in the scratch folder, and the RAM still grows with the number of basins and the length of their
+    ##boundaries, plus one band of rows of the rasters at a time), and UseParallel subdivides each ice mass as a separate
+    ##job on a process pool (not available in the daemonic workers of a pool). OutputHierarchy saves the merge
+    ##hierarchy of the basins (.npz), and InputHierarchy subdivides the outlines again from a saved merge hierarchy
+    ##for another Min_Ele_Range without the hydrology (steps 1 and 2). CacheFolder keeps the chunked store of the DEM
+    ##(RasterStore.py) for the NumPy engine, so the DEM is only decoded by the first run. Returns the output outlines
+    if TileSize is None:
+        TileSize = 0
+    profile = Profiler.Profiler("DivideforWatersheds", arcpy.AddMessage)
+
+    #spatialref=arcpy.Describe(InputDEM).spatialReference
+    cellsize = arcpy.GetRasterProperties_management(InputDEM,"CELLSIZEX")
+    cellsize_int = int(float(cellsize.getOutput(0)))
+    min_area = 5 *  cellsize_int * cellsize_int ##set the min_area as 5 cell sizes of the DEM
+
+    if InputHierarchy != "":
+        ##The basins and their merge order are already in the hierarchy: only the merges less than the
+        ##minimum relief are applied (see MergeHierarchy.py)
+        profile.Start("Step 3: Merge small_relief basins from the merge hierarchy...")
+        import MergeHierarchy
+        hierarchy = MergeHierarchy.MergeHierarchy(InputHierarchy)
+        mergedArr, nBasins, nMerged = hierarchy.Cut(float(Min_Ele_Range), min_area)
+        arcpy.AddMessage("The number of basins is " + str(nBasins) + ", and the number of merged small relief or small area basins is " + str(nMerged))
+        spatialRef = arcpy.SpatialReference()
+        spatialRef.loadFromString(hierarchy.spatialRef)
+        WriteBasinPolygons(mergedArr, hierarchy.Array("parents"), hierarchy.XMin, hierarchy.YMin, hierarchy.cellW, hierarchy.cellH, min_area, spatialRef)
+        hierarchy.close()
+        del mergedArr
+
+        profile.Start("Step 4: Transfer the attributes to the divided outlines...")
+        TransferAttributes(InputOutlines, OutputIndividualOutlines)
+        profile.Finish(ProfileReport)
+        arcpy.AddMessage("Finished!!!")
+        return OutputIndividualOutlines
+
+    if UseParallel and OutputHierarchy != "":
+        arcpy.AddMessage("The merge hierarchy is built for the whole DEM, so the ice masses are not processed in parallel")
+        UseParallel = False
+
+    ##Step 1: clip DEM based on the buffer of oulines 
+    profile.Start("Step 1: Extract DEM for glacier outlines...")
+    ##Do a loop for each outline polygon
+    outline_buf = temp_workspace + "\\outline_buf"
+    dissove_buf = temp_workspace + "\\dissove_buf"
+    buffer_dis = str(cellsize_int*10) + " Meters"  ##use the 10 times of cell size for the buffer distance
+    arcpy.Buffer_analysis(InputOutlines, outline_buf, buffer_dis)
+    arcpy.Dissolve_management(outline_buf, dissove_buf, "", "", "SINGLE_PART")
+    ##Extract DEM
+    store = None
+    if CacheFolder != "" and (UseNumPyHydro or UseParallel):
+        import RasterStore
+        store = RasterStore.OpenStore(arcpy, InputDEM, CacheFolder)
+    if store is not None:
+        ##The DEM is read from its store: only the buffer is rasterized on the grid of the DEM, and its
+        ##NoData cells mask the DEM as ExtractByMask does
+        extractDEM = Raster(RasterizeOutlines(dissove_buf, Raster(InputDEM), "buffer_labels", arcpy.Describe(dissove_buf).extent))
+    else:
+        extractDEM = ExtractByMask(InputDEM, dissove_buf)
+
+    ###Step 2: Basin analysis
+    profile.Start("Step 2: Extract catchments for glacier outlines...")
+
+    ##set the parallelProcessingFactor for large DEMs
+    #dem = Raster(extractDEM)
+    nrow = extractDEM.height
+    ncol = extractDEM.width
 
+    oldPPF = arcpy.env.parallelProcessingFactor
+    if (nrow > 1500 or ncol > 1500):
+        #arcpy.AddMessage("The DEM has " +str(nrow) + " rows and " + str(ncol) + " columns")
+        arcpy.env.parallelProcessingFactor = 0 ##use 0 for large rasters
     
-arcpy.MultipartToSinglepart_management(temp_workspace + "\\divided_polys", temp_workspace + "\\divided_polys_singlePart")
-##Delete small polygons caused by the conversion
-with arcpy.da.UpdateCursor(temp_workspace + "\\divided_polys_singlePart",("SHAPE@AREA")) as cursor:   #populate ice field with value from the nearest flowline point
-    for row in cursor:
-        if row[0] < min_area: ##delete the small polygon generated by the conversions
-            #arcpy.AddMessage("delete small polygon")
-            cursor.deleteRow()
-del row, cursor
-
-##Make sure to transfer the old attributes to the divided polygons
-final_outlines = temp_workspace + "\\final_outlines"
-arcpy.SpatialJoin_analysis(temp_workspace + "\\divided_polys_singlePart", InputOutlines, OutputIndividualOutlines, "JOIN_ONE_TO_ONE", "KEEP_COMMON", '#', "INTERSECT", "1 Meters", "#")
-
-max_gap_area = str(min_area) + " SquareMeters"
-try:
-    arcpy.topographic.FillGaps(OutputIndividualOutlines, max_gap_area)
-except:
-    pass
-arcpy.DeleteField_management(OutputIndividualOutlines,["Join_Count", "TARGET_FID", "ORIG_FID"])
-
-arcpy.AddMessage("Finished!!!")
-arcpy.Delete_management("temp_workspace")
-##Reset parallelProcessingFactor to the default
-arcpy.env.parallelProcessingFactor = oldPPF
+    cellW = extractDEM.meanCellWidth
+    cellH = extractDEM.meanCellHeight
+    if UseParallel:
+        ##Each dissolved buffer part (ice mass) is hydrologically independent and is a job for a process
+        ##pool: fill, basins, merging and vectorization with the NumPy engine. The parts and the outlines
+        ##are rasterized on the grid of the extracted DEM to read the window of each part
+        import SubdivideWorker ##The NumPy engine (numba) is only imported if it is used
+        jobFolder = arcpy.env.scratchFolder + "\\subdivide_jobs"
+        if os.path.exists(jobFolder):
+            shutil.rmtree(jobFolder, ignore_errors=True)
+        partRaster = RasterizeOutlines(dissove_buf, extractDEM, "part_labels")
+        outlineRaster = RasterizeOutlines(InputOutlines, extractDEM, "outline_labels")
+        spatialRef = arcpy.Describe(InputDEM).spatialReference.exportToString()
+        XMin = extractDEM.extent.XMin
+        YMax = extractDEM.extent.YMax
+        jobs = []
+        with arcpy.da.SearchCursor(dissove_buf, ["OID@", "SHAPE@"]) as cursor:
+            for row in cursor:
+                ##Window of the part on the grid of the extracted DEM
+                ext = row[1].extent
+                c0 = max(int(math.floor((ext.XMin - XMin) / cellW)), 0)
+                c1 = min(int(math.ceil((ext.XMax - XMin) / cellW)), ncol)
+                r0 = max(int(math.floor((YMax - ext.YMax) / cellH)), 0)
+                r1 = min(int(math.ceil((YMax - ext.YMin) / cellH)), nrow)
+                if c1 <= c0 or r1 <= r0:
+                    continue
+                partLowerLeft = arcpy.Point(XMin + c0 * cellW, YMax - r1 * cellH)
+                demArr = ReadRasterArray(extractDEM, partLowerLeft, c1 - c0, r1 - r0, store)
+                partArr = arcpy.RasterToNumPyArray(partRaster, partLowerLeft, c1 - c0, r1 - r0, 0)
+                demArr[partArr != row[0]] = np.nan ##Keep only the cells of this ice mass
+                outlineArr = arcpy.RasterToNumPyArray(outlineRaster, partLowerLeft, c1 - c0, r1 - r0, 0)
+                folder = jobFolder + "\\part_" + str(row[0])
+                os.makedirs(folder)
+                jobs.append({"dem": demArr, "outlines": outlineArr, "XMin": partLowerLeft.X, "YMin": partLowerLeft.Y,
+                             "cellW": cellW, "cellH": cellH, "spatialRef": spatialRef, "minRelief": float(Min_Ele_Range),
+                             "minArea": min_area, "tileSize": TileSize, "folder": folder})
+        del cursor
+
+        results = []
+        if len(jobs) > 0:
+            nProcesses = max(min(len(jobs), multiprocessing.cpu_count()), 1)
+            arcpy.AddMessage("Subdivide " + str(len(jobs)) + " ice masses with " + str(nProcesses) + " processes...")
+            if ArcGISPro:
+                multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe")) ##Start the workers with python instead of ArcGISPro.exe
+            pool = multiprocessing.Pool(nProcesses)
+            for result in pool.imap(SubdivideWorker.SubdividePart, jobs, chunksize=1):
+                results.append(result)
+                profile.Progress(len(results), len(jobs), "ice masses")
+            pool.close()
+            pool.join()
+        del jobs
+        nBasins = sum(r[1] for r in results)
+        nMerged = sum(r[2] for r in results)
+        arcpy.AddMessage("The number of basins is " + str(nBasins) + ", and the number of merged small relief or small area basins is " + str(nMerged))
+        shapefiles = [r[0] for r in results if r[0] is not None]
+        if len(shapefiles) > 0:
+            arcpy.Merge_management(shapefiles, temp_workspace + "\\divided_polys")
+        else:
+            ##No ice mass with basins: an empty divided_polys with the fields of the serial mode
+            import Vectorize
+            Vectorize.WritePolygons(arcpy, temp_workspace + "\\divided_polys", arcpy.Describe(InputDEM).spatialReference, [],
+                                    labelValues={"ParentID": np.zeros(1, dtype=np.int64)})
+        shutil.rmtree(jobFolder, ignore_errors=True)
+    elif UseNumPyHydro:
+        #Hydro analysis with the NumPy engine: fill, flow direction (force out edge) and basins
+        import HydroCore, HydroTiles ##The NumPy engine (numba) is only imported if it is used
+        lowerLeft = arcpy.Point(extractDEM.extent.XMin, extractDEM.extent.YMin)
+        Tiled = TileSize > 0 and (nrow > TileSize or ncol > TileSize)
+        if Tiled:
+            ##Large DEM: read it band by band into a memory-mapped array and process it tile by tile
+            arcpy.AddMessage("Process the DEM in tiles of " + str(TileSize) + " x " + str(TileSize) + " cells")
+            tileFolder = arcpy.env.scratchFolder + "\\hydro_tiles"
+            if not os.path.exists(tileFolder):
+                os.makedirs(tileFolder)
+            bands = RowBands(extractDEM, nrow, TileSize)
+            demArr = np.lib.format.open_memmap(tileFolder + "\\dem.npy", mode="w+", dtype=np.float64, shape=(nrow, ncol))
+            for r0, r1, bandLowerLeft in bands:
+                demArr[r0:r1] = ReadRasterArray(extractDEM, bandLowerLeft, ncol, r1 - r0, store)
+            demArr, fdirArr, basinArr = HydroTiles.TiledFillFlowBasin(demArr, TileSize, tileFolder)
+        else:
+            bands = RowBands(extractDEM, nrow, nrow)
+            demArr = ReadRasterArray(extractDEM, lowerLeft, ncol, nrow, store)
+            demArr, fdirArr, basinArr = HydroCore.FillFlowBasin(demArr)
+        del fdirArr
+
+        #Extract the basins within the input outlines, and keep the outline (parent) of each cell
+        labelRaster = RasterizeOutlines(InputOutlines, extractDEM, "outline_labels")
+        if Tiled:
+            parentArr = np.lib.format.open_memmap(tileFolder + "\\parents.npy", mode="w+", dtype=np.int32, shape=(nrow, ncol))
+        else:
+            parentArr = np.zeros((nrow, ncol), dtype=np.int32)
+        for r0, r1, bandLowerLeft in bands:
+            parentArr[r0:r1] = arcpy.RasterToNumPyArray(labelRaster, bandLowerLeft, ncol, r1 - r0, 0)
+            basinArr[r0:r1][parentArr[r0:r1] == 0] = 0
+        basinNoData = 0
+    else:
+        #Hydro analysis
+        fillDEM =Fill(extractDEM)  ##Fill the sink first
+        fdir = FlowDirection(fillDEM, "FORCE") ##Flow direction force out edge
+        outBasin = Basin(fdir)
+
+        #Extract the outbasin within the input outlines
+        extBasin = ExtractByMask(outBasin, InputOutlines)
+
+        ##Read the basins within the outlines and the filled DEM on the same grid
+        lowerLeft = arcpy.Point(extBasin.extent.XMin, extBasin.extent.YMin)
+        basinArr = arcpy.RasterToNumPyArray(extBasin, lowerLeft, extBasin.width, extBasin.height, -1)
+        demArr = arcpy.RasterToNumPyArray(fillDEM, lowerLeft, extBasin.width, extBasin.height)
+        basinNoData = -1
+        ##The outline (parent) of each cell on the same grid
+        labelRaster = RasterizeOutlines(InputOutlines, extractDEM, "outline_labels")
+        parentArr = arcpy.RasterToNumPyArray(labelRaster, lowerLeft, extBasin.width, extBasin.height, 0)
+
+    if not UseParallel:
+        ##Merge the basins based on the elevation range of the basin
+        profile.Start("Step 3: Merge small_relief basins to nearby large basins...")
+        ##Merge the basins on the region adjacency graph of the basin raster, the small relief basins
+        ##first and then the small area basins, so that the polygons are only created once
+        import BasinMerge
+        min_relief = float(Min_Ele_Range)
+        cell_area = cellW * cellH
+        if OutputHierarchy != "":
+            ##Merge all basins by relief once and save the merge order, so that the outlines can be subdivided
+            ##again for another minimum relief without the hydrology
+            import MergeHierarchy
+            arrays = MergeHierarchy.BuildHierarchy(basinArr, demArr, basinNoData)
+            arrays["parents"] = parentArr
+            OutputHierarchy = MergeHierarchy.SaveHierarchy(OutputHierarchy, arrays, lowerLeft.X, lowerLeft.Y, cellW, cellH,
+                                                           arcpy.Describe(InputDEM).spatialReference.exportToString())
+            del arrays
+            hierarchy = MergeHierarchy.MergeHierarchy(OutputHierarchy)
+            mergedArr, nBasins, nMerged = hierarchy.Cut(min_relief, min_area)
+            hierarchy.close()
+        elif UseNumPyHydro and Tiled:
+            ##The merged basins are memory-mapped like the DEM and the basins
+            mergedArr = np.lib.format.open_memmap(tileFolder + "\\merged.npy", mode="w+", dtype=np.int32, shape=(nrow, ncol))
+            mergedArr, nBasins, nMerged = BasinMerge.MergeBasins(basinArr, demArr, basinNoData, cell_area, min_relief, min_area, mergedArr)
+        else:
+            mergedArr, nBasins, nMerged = BasinMerge.MergeBasins(basinArr, demArr, basinNoData, cell_area, min_relief, min_area)
+        arcpy.AddMessage("The number of basins is " + str(nBasins) + ", and the number of merged small relief or small area basins is " + str(nMerged))
+        del basinArr, demArr
+
+        ##Convert the merged basins to polygons
+        workArr = None
+        if UseNumPyHydro and Tiled:
+            workArr = np.lib.format.open_memmap(tileFolder + "\\regions.npy", mode="w+", dtype=np.int32, shape=(nrow, ncol))
+        WriteBasinPolygons(mergedArr, parentArr, lowerLeft.X, lowerLeft.Y, cellW, cellH, min_area, arcpy.Describe(InputDEM).spatialReference, workArr)
+        del mergedArr, parentArr, workArr
+        if UseNumPyHydro and Tiled:
+            shutil.rmtree(tileFolder, ignore_errors=True) ##After the memory-mapped rasters are closed
+
+    profile.Start("Step 4: Transfer the attributes to the divided outlines...")
+    TransferAttributes(InputOutlines, OutputIndividualOutlines)
+    profile.Finish(ProfileReport)
+
+    arcpy.AddMessage("Finished!!!")
+    ##Reset parallelProcessingFactor to the default
+    arcpy.env.parallelProcessingFactor = oldPPF
+    return OutputIndividualOutlines
+
+##main program
+if __name__ == "__main__":  ##The worker processes of the parallel mode import this script without running it
+    DivideforWatersheds(arcpy.GetParameterAsText(0),       ##Input DEM
+                        arcpy.GetParameterAsText(1),       ##Input outlines
+                        arcpy.GetParameter(2),             ##Minimum elevation range (relief) of a glacier
+                        arcpy.GetParameterAsText(3),       ##Output outlines
+                        bool(arcpy.GetParameter(4)),       ##Use the NumPy/numba hydrology engine instead of Spatial Analyst
+                        arcpy.GetParameter(5),             ##Tile size of large DEMs with the NumPy engine; 0 = no tiling
+                        bool(arcpy.GetParameter(6)),       ##Subdivide each ice mass as a separate job on a process pool
+                        arcpy.GetParameterAsText(7),       ##Optional profile report (JSON or CSV) of the time and memory of each step
+                        arcpy.GetParameterAsText(8),       ##Optional output merge hierarchy (.npz) of the basins
+                        arcpy.GetParameterAsText(9),       ##Optional input merge hierarchy (.npz) to subdivide again without the hydrology
+                        arcpy.GetParameterAsText(10))      ##Optional cache folder of the DEM store, to read the DEM of a previous run without decoding it
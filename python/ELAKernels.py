@@ -0,0 +1,345 @@
+﻿#-------------------------------------------------------------------------------
+# Name: ELAKernels.py
+# Purpose: This module provides the numba kernels used by AddDerivedGlacierAttributes.py to
+#          reconstruct the ELA of palaeoglaciers with the four methods described in
+#          (Pellitero et al. 2015): MGE, AAR, AA, and AABR. ELA_AAR_MGE and ELA_AA_AABR work
+#          on the elevations of one glacier. The batched variants take the elevations of all
+#          glaciers as one flat array grouped by glacier plus the CSR offsets of each glacier
+#          (see GlacierZones.LabelOffsets), compute the histograms by direct binning, and run
+#          in parallel over the glaciers. They return the same values as the per-glacier kernels.
+#          The AABR ELA is found from prefix sums over the hypsometry instead of stepping the
+#          reference altitude, and ELA_Sweep_Batch evaluates many AAR and AABR ratios at once
+#          from one histogram per glacier for sensitivity tables. ELA_MonteCarlo_Batch derives the
+#          uncertainty of the four ELAs from many realizations of the ratios and of the DEM error.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import numpy as np
+from NumbaCompat import jit, prange
+
+@jit(nopython=True)
+def HypsometryPrefix(H):
+    ##Prefix sums of the bin counts (c0) and of the bin counts times the bin index (c1),
+    ##so that c0[j] and c1[j] are the sums over the bins below bin j. Bin 0 is not counted, the
+    ##same as the AABR loop, which weights the differences of the cumulative area (bins 1 and up);
+    ##e.g. all cells of a flat glacier are in bin 0
+    n = len(H)
+    c0 = np.zeros(n + 1, dtype=np.int64)
+    c1 = np.zeros(n + 1, dtype=np.int64)
+    for b in range(1, n):
+        c0[b+1] = c0[b] + H[b]
+        c1[b+1] = c1[b] + H[b] * b
+    return c0, c1
+
+@jit(nopython=True)
+def AABR_Balance(c0, c1, j, AABRratio):
+    ##Area x altitude balance of the AABR method for the reference altitude at the lower
+    ##edge of bin j (minalt + j * interval). Bin b has the mid altitude minalt + (b + 0.5) * interval,
+    ##so its distance to the reference is (2b + 1 - 2j) * interval / 2; the common factor
+    ##interval^2 / 2 is dropped and the sums stay exact integers
+    n = len(c0) - 1
+    above = 2 * (c1[n] - c1[j]) + (1 - 2 * j) * (c0[n] - c0[j])
+    below = 2 * c1[j] + (1 - 2 * j) * c0[j]
+    return above + AABRratio * below
+
+@jit(nopython=True)
+def AABR_Step(c0, c1, AABRratio):
+    ##The balance decreases monotonically with the reference altitude, so the first bin
+    ##edge where it becomes <= 0 is found by bisection in O(log bins)
+    lo = 0
+    hi = len(c0) - 1  ##Everything is below the top edge, so the balance is negative there
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if AABR_Balance(c0, c1, mid, AABRratio) <= 0:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+##The per-glacier kernels have no loop over glaciers, so they are compiled without parallel=True
+##(the parallel fusion of resta * list_altitudes[1:-1] also shifted the AA weights in some numba versions)
+@jit(nopython=True)
+def ELA_AAR_MGE(EleArr, interval, ratio):
+    minimum = np.min(EleArr)
+    maximum = np.max(EleArr)
+    
+    maxalt = int(maximum + interval)
+    minalt = int(minimum - interval)
+
+    # Create array of bin edges
+    Elelist = np.arange(minalt, maxalt + interval, interval)
+    
+    # Calculate histogram
+    H, X1 = np.histogram(EleArr, bins=Elelist)
+    dx = X1[1] - X1[0]
+
+
+    Area3D_arr = np.cumsum(H) * dx
+    
+    superf_total = np.max(Area3D_arr)  # Get the total surface
+    Area3D_arr = superf_total - Area3D_arr
+
+    ELA = superf_total * ratio  # Get the surface above the ELA
+    kurowski = superf_total * 0.5
+
+    # Find indices where values meet conditions
+    ela_idx = -1
+    kur_idx = -1
+    min_ela_diff = np.inf
+    min_kur_diff = np.inf
+    
+    for i in range(len(Area3D_arr)):
+        val = Area3D_arr[i]
+        
+        # Check for ELA condition
+        if val <= ELA:
+            diff = ELA - val
+            if diff < min_ela_diff:
+                min_ela_diff = diff
+                ela_idx = i
+                
+        # Check for Kurowski condition
+        if val <= kurowski:
+            diff = kurowski - val
+            if diff < min_kur_diff:
+                min_kur_diff = diff
+                kur_idx = i
+
+    # Calculate results
+    ELA_AAR = Elelist[ela_idx] + (interval/2) + interval
+    ELA_MGE = Elelist[kur_idx] + (interval/2) + interval
+    
+    return ELA_AAR, ELA_MGE
+
+@jit(nopython=True)
+def ELA_AA_AABR(EleArr, interval, AABRratio):
+    # Calculate min/max with buffer
+    minimum = np.min(EleArr)
+    maximum = np.max(EleArr)
+    maxalt = int(maximum + interval)
+    minalt = int(minimum - interval)
+
+    # Optimized bin calculation
+    num_bins = int(np.ceil((maxalt - minalt) / interval))
+    maxValue = minalt + interval * num_bins - interval/2
+    list_altitudes = np.linspace(minalt + interval/2, maxValue, num_bins)
+    
+    # Create histogram bins
+    Elelist = np.linspace(minalt, minalt + interval * (num_bins-1), num_bins)
+    
+    # Calculate histogram and cumulative area
+    H, X1 = np.histogram(EleArr, bins=Elelist)
+    dx = X1[1] - X1[0]
+    Area3D_arr = np.cumsum(H) * dx * 100  # Convert to percentage
+
+    # AA Calculation
+    superf_total = np.max(Area3D_arr)
+    resta = np.diff(Area3D_arr)
+    finalmulti = np.sum(resta * list_altitudes[1:-1])
+    ELA_AA = int(finalmulti / superf_total) ##+ interval
+    
+    # AABR Calculation: closed-form zero crossing of the balance from prefix sums
+    c0, c1 = HypsometryPrefix(H)
+    refinf = minalt + AABR_Step(c0, c1, AABRratio) * interval
+    
+    ELA_AABR = refinf - (interval/2) ##+ interval
+    
+    return ELA_AA, ELA_AABR
+
+def BinCountsNumPy(EleArr, minalt, interval, nbins):
+    ##NumPy version of BinCounts, used without numba
+    idx = np.minimum((np.asarray(EleArr) - minalt) // interval, nbins - 1).astype(np.int64)
+    return np.bincount(idx, minlength=nbins)
+
+@jit(nopython=True, fallback=BinCountsNumPy)
+def BinCounts(EleArr, minalt, interval, nbins):
+    ##Histogram of the elevations over nbins bins of width interval starting at minalt.
+    ##Same as np.histogram with uniform integer edges: the last bin includes its right edge
+    H = np.zeros(nbins, dtype=np.int64)
+    for i in range(len(EleArr)):
+        idx = int((EleArr[i] - minalt) // interval)
+        if idx >= nbins:
+            idx = nbins - 1
+        H[idx] += 1
+    return H
+
+@jit(nopython=True, parallel=True)
+def ELA_AAR_MGE_Batch(EleFlat, offsets, interval, ratio):
+    nGlaciers = len(offsets) - 1
+    ELA_AAR = np.full(nGlaciers, np.nan)
+    ELA_MGE = np.full(nGlaciers, np.nan)
+
+    for g in prange(nGlaciers):
+        if offsets[g+1] <= offsets[g]:
+            continue ##No elevations for this glacier
+        EleArr = EleFlat[offsets[g]:offsets[g+1]]
+        minimum = np.min(EleArr)
+        maximum = np.max(EleArr)
+
+        maxalt = int(maximum + interval)
+        minalt = int(minimum - interval)
+
+        # Same bins as np.arange(minalt, maxalt + interval, interval)
+        nedges = int(np.ceil((maxalt + interval - minalt) / interval))
+        H = BinCounts(EleArr, minalt, interval, nedges - 1)
+
+        Area3D_arr = np.cumsum(H) * interval
+        superf_total = Area3D_arr[-1]  # Get the total surface
+        Area3D_arr = superf_total - Area3D_arr
+
+        ELA = superf_total * ratio  # Get the surface above the ELA
+        kurowski = superf_total * 0.5
+
+        # The area above each bin is non-increasing, so the closest value below
+        # the target is the first one that does not exceed it
+        ela_idx = -1
+        kur_idx = -1
+        for i in range(len(Area3D_arr)):
+            val = Area3D_arr[i]
+            if ela_idx < 0 and val <= ELA:
+                ela_idx = i
+            if kur_idx < 0 and val <= kurowski:
+                kur_idx = i
+
+        ELA_AAR[g] = minalt + ela_idx * interval + (interval/2) + interval
+        ELA_MGE[g] = minalt + kur_idx * interval + (interval/2) + interval
+
+    return ELA_AAR, ELA_MGE
+
+@jit(nopython=True, parallel=True)
+def ELA_AA_AABR_Batch(EleFlat, offsets, interval, AABRratio):
+    nGlaciers = len(offsets) - 1
+    ELA_AA = np.full(nGlaciers, np.nan)
+    ELA_AABR = np.full(nGlaciers, np.nan)
+
+    for g in prange(nGlaciers):
+        if offsets[g+1] <= offsets[g]:
+            continue ##No elevations for this glacier
+        EleArr = EleFlat[offsets[g]:offsets[g+1]]
+        minimum = np.min(EleArr)
+        maximum = np.max(EleArr)
+        maxalt = int(maximum + interval)
+        minalt = int(minimum - interval)
+
+        num_bins = int(np.ceil((maxalt - minalt) / interval))
+        maxValue = minalt + interval * num_bins - interval/2
+        list_altitudes = np.linspace(minalt + interval/2, maxValue, num_bins)
+
+        # Same bins as the num_bins edges of ELA_AA_AABR
+        H = BinCounts(EleArr, minalt, interval, num_bins - 1)
+        Area3D_arr = np.cumsum(H) * float(interval) * 100  # Convert to percentage
+
+        # AA Calculation
+        superf_total = Area3D_arr[-1]
+        resta = np.diff(Area3D_arr)
+        finalmulti = 0.0
+        for k in range(len(resta)):
+            finalmulti += resta[k] * list_altitudes[k+1]
+        ELA_AA[g] = int(finalmulti / superf_total)
+
+        # AABR Calculation
+        c0, c1 = HypsometryPrefix(H)
+        refinf = minalt + AABR_Step(c0, c1, AABRratio) * interval
+
+        ELA_AABR[g] = refinf - (interval/2)
+
+    return ELA_AA, ELA_AABR
+
+@jit(nopython=True, parallel=True)
+def ELA_Sweep_Batch(EleFlat, offsets, interval, AARratios, AABRratios):
+    ##Evaluate many AAR and AABR ratios from one histogram per glacier. Returns two arrays of
+    ##shape (glaciers, ratios) with the same values as ELA_AAR_MGE_Batch and ELA_AA_AABR_Batch
+    nGlaciers = len(offsets) - 1
+    ELA_AAR = np.full((nGlaciers, len(AARratios)), np.nan)
+    ELA_AABR = np.full((nGlaciers, len(AABRratios)), np.nan)
+
+    for g in prange(nGlaciers):
+        if offsets[g+1] <= offsets[g]:
+            continue ##No elevations for this glacier
+        EleArr = EleFlat[offsets[g]:offsets[g+1]]
+        minimum = np.min(EleArr)
+        maximum = np.max(EleArr)
+        maxalt = int(maximum + interval)
+        minalt = int(minimum - interval)
+
+        nedges = int(np.ceil((maxalt + interval - minalt) / interval))
+        H = BinCounts(EleArr, minalt, interval, nedges - 1)
+
+        # AAR: the negative area above each bin increases, so each ratio is one bisection
+        Area3D_arr = np.cumsum(H) * interval
+        superf_total = Area3D_arr[-1]
+        negAbove = Area3D_arr - superf_total
+        for r in range(len(AARratios)):
+            ela_idx = np.searchsorted(negAbove, -(superf_total * AARratios[r]))
+            ELA_AAR[g, r] = minalt + ela_idx * interval + (interval/2) + interval
+
+        # AABR uses num_bins - 1 bins; an elevation on the top edge falls in the last bin
+        num_bins = int(np.ceil((maxalt - minalt) / interval))
+        HB = H[:num_bins-1].copy()
+        for b in range(num_bins-1, len(H)):
+            HB[num_bins-2] += H[b]
+        c0, c1 = HypsometryPrefix(HB)
+        for r in range(len(AABRratios)):
+            ELA_AABR[g, r] = minalt + AABR_Step(c0, c1, AABRratios[r]) * interval - (interval/2)
+
+    return ELA_AAR, ELA_AABR
+
+@jit(nopython=True, parallel=True)
+def ELA_MonteCarlo_Batch(EleFlat, offsets, interval, AARsamples, AABRsamples, DEMError, seed):
+    ##Monte Carlo uncertainty of the MGE, AAR, AA and AABR ELAs. Each realization r uses the ratios
+    ##AARsamples[r] and AABRsamples[r] and shifts the elevations of the glacier by a normal DEM error
+    ##(standard deviation DEMError, drawn for each glacier from the seed + glacier index). A shift of dz
+    ##moves the bins with the elevations (minalt is truncated the same way), so the histogram is the same
+    ##and each ELA moves by floor(dz): the ELAs of all realizations come from one histogram per glacier.
+    ##Returns an array of shape (glaciers, 4 methods, 4 statistics: mean, std, 5th and 95th percentiles)
+    nGlaciers = len(offsets) - 1
+    nReal = len(AARsamples)
+    stats = np.full((nGlaciers, 4, 4), np.nan)
+
+    for g in prange(nGlaciers):
+        if offsets[g+1] <= offsets[g]:
+            continue ##No elevations for this glacier
+        EleArr = EleFlat[offsets[g]:offsets[g+1]]
+        minimum = np.min(EleArr)
+        maximum = np.max(EleArr)
+        maxalt = int(maximum + interval)
+        minalt = int(minimum - interval)
+
+        nedges = int(np.ceil((maxalt + interval - minalt) / interval))
+        H = BinCounts(EleArr, minalt, interval, nedges - 1)
+
+        ##MGE and AA do not depend on the ratios
+        Area3D_arr = np.cumsum(H) * interval
+        superf_total = Area3D_arr[-1]
+        negAbove = Area3D_arr - superf_total
+        ELA_MGE = minalt + np.searchsorted(negAbove, -(superf_total * 0.5)) * interval + (interval/2) + interval
+
+        num_bins = int(np.ceil((maxalt - minalt) / interval))
+        HB = H[:num_bins-1].copy()
+        for b in range(num_bins-1, len(H)):
+            HB[num_bins-2] += H[b]
+        finalmulti = 0.0
+        for k in range(1, len(HB)):
+            finalmulti += HB[k] * (minalt + interval/2 + k * interval)
+        ELA_AA = int(finalmulti / np.sum(HB))
+        c0, c1 = HypsometryPrefix(HB)
+
+        np.random.seed(seed + g)
+        values = np.empty((4, nReal))
+        for r in range(nReal):
+            shift = 0.0
+            if DEMError > 0:
+                shift = np.floor(np.random.normal(0.0, DEMError))
+            values[0, r] = ELA_MGE + shift
+            values[1, r] = minalt + np.searchsorted(negAbove, -(superf_total * AARsamples[r])) * interval + (interval/2) + interval + shift
+            values[2, r] = ELA_AA + shift
+            values[3, r] = minalt + AABR_Step(c0, c1, AABRsamples[r]) * interval - (interval/2) + shift
+        for m in range(4):
+            stats[g, m, 0] = np.mean(values[m])
+            stats[g, m, 1] = np.std(values[m])
+            stats[g, m, 2] = np.percentile(values[m], 5.0)
+            stats[g, m, 3] = np.percentile(values[m], 95.0)
+
+    return stats
@@ -0,0 +1,357 @@
+﻿#-------------------------------------------------------------------------------
+# Name: GlacierZones.py
+# Purpose: This module provides the array engine used by AddDerivedGlacierAttributes.py
+#          to derive per-glacier statistics in a single pass. All outlines are rasterized
+#          into one label grid aligned to the ice surface raster, the raster is read once,
+#          and the pixels are grouped by label with a stable sort, so that the elevations
+#          of each glacier form one contiguous slice described by CSR offsets. The ELA,
+#          HI and Hypsomax of every glacier are then derived from these slices instead
+#          of extracting the ice surface raster for each outline. The 3D surface area of
+#          each glacier is derived from the same grid with the per-cell triangulation of
+#          Jenness (2004), replacing the per-outline SurfaceVolume_3d table. The zonal
+#          statistics of the ice surface, slope, aspect and ice thickness are derived together
+#          by a fused kernel that visits the cells of each glacier once for all rasters.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import numpy as np
+from NumbaCompat import jit, prange
+
+def LabelOffsets(labelArr, valueArr, nLabels):
+    ##Group the valid pixels (label > 0 and value > 0) of the label grid by label.
+    ##The values are returned ordered by label together with the CSR offsets, so that
+    ##the values of label i are values[offsets[i]:offsets[i+1]] (empty if not rasterized)
+    labels = labelArr.ravel()
+    values = valueArr.ravel()
+    valid = (labels > 0) & (labels <= nLabels) & (values > 0)
+    labels = labels[valid].astype(np.int64)
+    values = values[valid]
+
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=nLabels + 1)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return values[order], offsets
+
+def GroupIndex(offsets):
+    ##Return the label of each element of a grouped array
+    counts = np.diff(offsets)
+    return np.repeat(np.arange(len(counts)), counts)
+
+def HypsometricStats(EleFlat, offsets):
+    ##Derive the hypsometric integral (HI) and the most frequent elevation (Hypsomax)
+    ##of every label from the grouped elevations. Labels without pixels get NaN
+    counts = np.diff(offsets)
+    nGroups = len(counts)
+    HI = np.full(nGroups, np.nan)
+    Hypsomax = np.full(nGroups, np.nan)
+    if len(EleFlat) == 0:
+        return HI, Hypsomax
+
+    ##Min, max and mean of the non-empty groups, which partition the grouped array
+    has = counts > 0
+    starts = offsets[:-1][has]
+    Z_min = np.minimum.reduceat(EleFlat, starts).astype(np.float64)
+    Z_max = np.maximum.reduceat(EleFlat, starts).astype(np.float64)
+    Z_mean = np.add.reduceat(EleFlat.astype(np.float64), starts) / counts[has]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        HI[has] = (Z_mean - Z_min) / (Z_max - Z_min)
+
+    ##Hypsomax: sort the elevations within each group, find the runs of equal values and
+    ##keep the longest run of each group (the lowest elevation if there are ties)
+    groups = GroupIndex(offsets)
+    order = np.lexsort((EleFlat, groups))
+    sortedEle = EleFlat[order]
+    change = (np.diff(sortedEle) != 0) | (np.diff(groups) != 0)
+    runStarts = np.flatnonzero(np.concatenate(([True], change)))
+    runLength = np.diff(np.append(runStarts, len(sortedEle)))
+    runGroup = groups[runStarts]
+    runOrder = np.lexsort((np.arange(len(runStarts)), -runLength, runGroup))
+    runGroup = runGroup[runOrder]
+    first = np.flatnonzero(np.concatenate(([True], np.diff(runGroup) != 0)))
+    Hypsomax[runGroup[first]] = sortedEle[runStarts[runOrder[first]]]
+
+    return HI, Hypsomax
+
+##The eight neighbours in circular order (row offset, column offset): E, NE, N, NW, W, SW, S, SE
+NEIGHBOR_DR = np.array([0, -1, -1, -1, 0, 1, 1, 1])
+NEIGHBOR_DC = np.array([1, 1, 0, -1, -1, -1, 0, 1])
+
+def CellSurfaceAreaNumPy(surfArr, labelArr, cellX, cellY):
+    ##NumPy version of CellSurfaceArea, used without numba
+    nrows, ncols = surfArr.shape
+    surfPad = np.pad(surfArr.astype(np.float64), 1, constant_values=np.nan)
+    labelPad = np.pad(labelArr, 1, constant_values=0)
+    zn = []
+    with np.errstate(invalid="ignore"):
+        for k in range(8):
+            zk = surfPad[1+NEIGHBOR_DR[k]:1+NEIGHBOR_DR[k]+nrows, 1+NEIGHBOR_DC[k]:1+NEIGHBOR_DC[k]+ncols]
+            lk = labelPad[1+NEIGHBOR_DR[k]:1+NEIGHBOR_DR[k]+nrows, 1+NEIGHBOR_DC[k]:1+NEIGHBOR_DC[k]+ncols]
+            zn.append(np.where((lk == labelArr) & (zk > 0), zk, surfArr))
+        area = np.zeros((nrows, ncols))
+        for k in range(8):
+            k2 = (k + 1) % 8
+            ax = 0.5 * NEIGHBOR_DC[k] * cellX
+            ay = -0.5 * NEIGHBOR_DR[k] * cellY
+            az = 0.5 * (zn[k] - surfArr)
+            bx = 0.5 * NEIGHBOR_DC[k2] * cellX
+            by = -0.5 * NEIGHBOR_DR[k2] * cellY
+            bz = 0.5 * (zn[k2] - surfArr)
+            cx = ay * bz - az * by
+            cy = az * bx - ax * bz
+            cz = ax * by - ay * bx
+            area += 0.5 * np.sqrt(cx * cx + cy * cy + cz * cz)
+        area[(labelArr <= 0) | (surfArr <= 0)] = 0.0
+    return area
+
+@jit(nopython=True, parallel=True, fallback=CellSurfaceAreaNumPy)
+def CellSurfaceArea(surfArr, labelArr, cellX, cellY):
+    ##3D surface area of each cell (Jenness 2004): the eight triangles between the cell center
+    ##and each pair of adjacent neighbours are clipped to the cell (half edge lengths) and summed.
+    ##Neighbours outside the glacier or without data take the elevation of the center cell, so
+    ##each glacier is measured on its own surface only. A flat cell gives cellX * cellY
+    nrows, ncols = surfArr.shape
+    area = np.zeros((nrows, ncols))
+    for i in prange(nrows):
+        zn = np.empty(8)
+        for j in range(ncols):
+            label = labelArr[i, j]
+            z0 = surfArr[i, j]
+            if label <= 0 or z0 <= 0:
+                continue
+            for k in range(8):
+                r = i + NEIGHBOR_DR[k]
+                c = j + NEIGHBOR_DC[k]
+                if r >= 0 and r < nrows and c >= 0 and c < ncols and labelArr[r, c] == label and surfArr[r, c] > 0:
+                    zn[k] = surfArr[r, c]
+                else:
+                    zn[k] = z0
+            total = 0.0
+            for k in range(8):
+                k2 = (k + 1) % 8
+                ##Vectors from the center to the midpoints of the two edges
+                ax = 0.5 * NEIGHBOR_DC[k] * cellX
+                ay = -0.5 * NEIGHBOR_DR[k] * cellY
+                az = 0.5 * (zn[k] - z0)
+                bx = 0.5 * NEIGHBOR_DC[k2] * cellX
+                by = -0.5 * NEIGHBOR_DR[k2] * cellY
+                bz = 0.5 * (zn[k2] - z0)
+                cx = ay * bz - az * by
+                cy = az * bx - ax * bz
+                cz = ax * by - ay * bx
+                total += 0.5 * np.sqrt(cx * cx + cy * cy + cz * cz)
+            area[i, j] = total
+    return area
+
+def SurfaceAreaRatio(labelArr, surfArr, nLabels, cellX, cellY):
+    ##A3D/A2D ratio of every label from the per-cell 3D surface area and the number of cells
+    ##(the same valid cells as LabelOffsets). Labels without pixels get NaN
+    area = CellSurfaceArea(surfArr, labelArr, float(cellX), float(cellY))
+    labels = labelArr.ravel()
+    valid = (labels > 0) & (labels <= nLabels) & (surfArr.ravel() > 0)
+    labels = labels[valid].astype(np.int64)
+    area3D = np.bincount(labels, weights=area.ravel()[valid], minlength=nLabels + 1)
+    area2D = np.bincount(labels, minlength=nLabels + 1) * float(cellX) * float(cellY)
+    Ratio3D2D = np.full(nLabels + 1, np.nan)
+    has = area2D > 0
+    Ratio3D2D[has] = area3D[has] / area2D[has]
+    return Ratio3D2D
+
+def SlopeAspectNumPy(surfPad, cellX, cellY):
+    ##NumPy version of SlopeAspect, used without numba
+    nrows = surfPad.shape[0] - 2
+    ncols = surfPad.shape[1] - 2
+    z0 = surfPad[1:-1, 1:-1]
+    w = {}
+    for r in range(3):
+        for c in range(3):
+            z = surfPad[r:r+nrows, c:c+ncols]
+            w[r, c] = np.where(np.isnan(z), z0, z)
+    dzdx = ((w[0, 2] + 2 * w[1, 2] + w[2, 2]) - (w[0, 0] + 2 * w[1, 0] + w[2, 0])) / 8.0
+    dzdy = ((w[2, 0] + 2 * w[2, 1] + w[2, 2]) - (w[0, 0] + 2 * w[0, 1] + w[0, 2])) / 8.0
+    slope = np.degrees(np.arctan(np.sqrt((dzdx / cellX) ** 2 + (dzdy / cellY) ** 2)))
+    a = np.degrees(np.arctan2(dzdy, -dzdx))
+    aspect = np.where(a < 0, 90.0 - a, np.where(a > 90.0, 360.0 - a + 90.0, 90.0 - a))
+    aspect[(dzdx == 0) & (dzdy == 0)] = -1.0
+    slope[np.isnan(z0)] = np.nan
+    aspect[np.isnan(z0)] = np.nan
+    return slope, aspect
+
+@jit(nopython=True, parallel=True, fallback=SlopeAspectNumPy)
+def SlopeAspect(surfPad, cellX, cellY):
+    ##Slope (degrees) and aspect (degrees clockwise from north, -1 = flat) with the 3 x 3 method of
+    ##Horn (1981), the same as the Slope and Aspect tools. surfPad has a one-cell pad around the
+    ##window (NaN = NoData); NoData neighbours take the elevation of the center cell
+    nrows = surfPad.shape[0] - 2
+    ncols = surfPad.shape[1] - 2
+    slope = np.full((nrows, ncols), np.nan)
+    aspect = np.full((nrows, ncols), np.nan)
+    for i in prange(nrows):
+        w = np.empty((3, 3))
+        for j in range(ncols):
+            z0 = surfPad[i+1, j+1]
+            if np.isnan(z0):
+                continue
+            for r in range(3):
+                for c in range(3):
+                    z = surfPad[i+r, j+c]
+                    w[r, c] = z0 if np.isnan(z) else z
+            dzdx = ((w[0, 2] + 2 * w[1, 2] + w[2, 2]) - (w[0, 0] + 2 * w[1, 0] + w[2, 0])) / 8.0
+            dzdy = ((w[2, 0] + 2 * w[2, 1] + w[2, 2]) - (w[0, 0] + 2 * w[0, 1] + w[0, 2])) / 8.0
+            slope[i, j] = np.degrees(np.arctan(np.sqrt((dzdx / cellX) ** 2 + (dzdy / cellY) ** 2)))
+            if dzdx == 0 and dzdy == 0:
+                aspect[i, j] = -1.0
+            else:
+                a = np.degrees(np.arctan2(dzdy, -dzdx))
+                if a < 0:
+                    aspect[i, j] = 90.0 - a
+                elif a > 90.0:
+                    aspect[i, j] = 360.0 - a + 90.0
+                else:
+                    aspect[i, j] = 90.0 - a
+    return slope, aspect
+
+def ZoneCells(labelArr, nLabels):
+    ##Indices of the cells of the label grid (label 1 to nLabels) ordered by label, with the CSR
+    ##offsets, so that the same grouping can be applied to every raster read on this grid
+    labels = labelArr.ravel()
+    cells = np.flatnonzero((labels > 0) & (labels <= nLabels))
+    cells = cells[np.argsort(labels[cells], kind="stable")]
+    counts = np.bincount(labels[cells].astype(np.int64), minlength=nLabels + 1)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return cells, offsets
+
+def HypsometryBins(EleFlat, offsets, interval):
+    ##Binned hypsometry of every label from the grouped elevations, as a ragged array: the bins of label i
+    ##start at the elevation start[i] (its lowest elevation, the lower edge of the first non-empty bin of the
+    ##ELA kernels) and their cell counts are counts[binOffsets[i]:binOffsets[i+1]] (empty if no elevations)
+    nLabels = len(offsets) - 1
+    sizes = np.diff(offsets)
+    start = np.zeros(nLabels, dtype=np.int64)
+    nBins = np.zeros(nLabels, dtype=np.int64)
+    filled = sizes > 0
+    if np.any(filled):
+        first = offsets[:-1][filled]
+        start[filled] = np.minimum.reduceat(EleFlat, first)
+        nBins[filled] = (np.maximum.reduceat(EleFlat, first) - start[filled]) // interval + 1
+    binOffsets = np.zeros(nLabels + 1, dtype=np.int64)
+    np.cumsum(nBins, out=binOffsets[1:])
+    labels = GroupIndex(offsets)
+    counts = np.bincount(binOffsets[labels] + (EleFlat - start[labels]) // interval, minlength=binOffsets[-1])
+    return start, binOffsets, counts
+
+def GroupedValues(valueArr, cells, offsets):
+    ##Same as LabelOffsets for a raster on the grid of ZoneCells: the valid values (> 0) of each label
+    ##ordered by label with their CSR offsets, from the cells already grouped by label
+    values = np.asarray(valueArr).ravel()[cells]
+    valid = values > 0
+    counts = np.bincount(GroupIndex(offsets)[valid], minlength=len(offsets) - 1)
+    validOffsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(counts, out=validOffsets[1:])
+    return values[valid], validOffsets
+
+def ZonalKernelNumPy(values, offsets, circular):
+    ##NumPy version of ZonalKernel with grouped reductions over the values sorted within each zone,
+    ##used without numba
+    nRasters = values.shape[0]
+    nZones = len(offsets) - 1
+    count = np.zeros((nRasters, nZones), dtype=np.int64)
+    total = np.full((nRasters, nZones), np.nan)
+    vmin = np.full((nRasters, nZones), np.nan)
+    vmax = np.full((nRasters, nZones), np.nan)
+    mean = np.full((nRasters, nZones), np.nan)
+    median = np.full((nRasters, nZones), np.nan)
+    std = np.full((nRasters, nZones), np.nan)
+    zones = np.repeat(np.arange(nZones), np.diff(offsets))
+    for r in range(nRasters):
+        valid = ~np.isnan(values[r])
+        if circular[r]:
+            valid[valid] = values[r][valid] >= 0
+        order = np.lexsort((values[r][valid], zones[valid]))
+        v = values[r][valid][order]
+        z = zones[valid][order]
+        n = np.bincount(z, minlength=nZones)
+        has = n > 0
+        starts = np.zeros(nZones, dtype=np.int64)
+        np.cumsum(n[:-1], out=starts[1:])
+        sums = np.bincount(z, weights=v, minlength=nZones)
+        m = sums / np.maximum(n, 1)
+        dev = v - m[z]
+        count[r] = n
+        total[r, has] = sums[has]
+        vmin[r, has] = v[starts[has]]
+        vmax[r, has] = v[starts[has] + n[has] - 1]
+        median[r, has] = (v[starts[has] + (n[has] - 1) // 2] + v[starts[has] + n[has] // 2]) / 2.0
+        std[r, has] = np.sqrt(np.bincount(z, weights=dev * dev, minlength=nZones)[has] / n[has])
+        if circular[r]:
+            sumSin = np.bincount(z, weights=np.sin(np.radians(v)), minlength=nZones)
+            sumCos = np.bincount(z, weights=np.cos(np.radians(v)), minlength=nZones)
+            mean[r, has] = np.degrees(np.arctan2(sumSin[has], sumCos[has])) % 360.0
+        else:
+            mean[r, has] = m[has]
+    return count, total, vmin, vmax, mean, median, std
+
+@jit(nopython=True, parallel=True, fallback=ZonalKernelNumPy)
+def ZonalKernel(values, offsets, circular):
+    ##Zonal statistics of several rasters in one visit of each zone. values holds the cells of each
+    ##raster (rows) grouped by zone with the CSR offsets; NaN = NoData. For the circular rasters
+    ##(angles in degrees, negative = undefined) the mean is the circular mean from the sums of the
+    ##sines and cosines. Zones without data get NaN (count 0)
+    nRasters = values.shape[0]
+    nZones = len(offsets) - 1
+    count = np.zeros((nRasters, nZones), dtype=np.int64)
+    total = np.full((nRasters, nZones), np.nan)
+    vmin = np.full((nRasters, nZones), np.nan)
+    vmax = np.full((nRasters, nZones), np.nan)
+    mean = np.full((nRasters, nZones), np.nan)
+    median = np.full((nRasters, nZones), np.nan)
+    std = np.full((nRasters, nZones), np.nan)
+    for g in prange(nZones):
+        s = offsets[g]
+        e = offsets[g+1]
+        buf = np.empty(e - s)
+        for r in range(nRasters):
+            n = 0
+            for k in range(s, e):
+                v = values[r, k]
+                if np.isnan(v) or (circular[r] and v < 0):
+                    continue
+                buf[n] = v
+                n += 1
+            if n == 0:
+                continue
+            sortedValues = np.sort(buf[:n])
+            sumValue = 0.0
+            sumSin = 0.0
+            sumCos = 0.0
+            for k in range(n):
+                sumValue += sortedValues[k]
+                if circular[r]:
+                    sumSin += np.sin(np.radians(sortedValues[k]))
+                    sumCos += np.cos(np.radians(sortedValues[k]))
+            m = sumValue / n
+            sumDev = 0.0
+            for k in range(n):
+                sumDev += (sortedValues[k] - m) ** 2
+            count[r, g] = n
+            total[r, g] = sumValue
+            vmin[r, g] = sortedValues[0]
+            vmax[r, g] = sortedValues[n-1]
+            median[r, g] = (sortedValues[(n-1) // 2] + sortedValues[n // 2]) / 2.0
+            std[r, g] = np.sqrt(sumDev / n)
+            if circular[r]:
+                mean[r, g] = np.degrees(np.arctan2(sumSin, sumCos)) % 360.0
+            else:
+                mean[r, g] = m
+    return count, total, vmin, vmax, mean, median, std
+
+def ZonalStats(rasters, circular, cells, offsets):
+    ##Fused zonal statistics of a list of arrays on the same grid, grouped once by ZoneCells.
+    ##Returns count, sum, min, max, mean, median and std, each as (raster, zone) arrays
+    values = np.empty((len(rasters), len(cells)))
+    for r in range(len(rasters)):
+        values[r] = np.asarray(rasters[r], dtype=np.float64).ravel()[cells]
+    return ZonalKernel(values, offsets, np.array(circular, dtype=np.bool_))
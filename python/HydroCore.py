@@ -0,0 +1,220 @@
+﻿#-------------------------------------------------------------------------------
+# Name: HydroCore.py
+# Purpose: This module provides an arcpy-independent hydrology engine for DivideforWatersheds.py
+#          working on NumPy arrays: depression filling (Fill), D8 flow direction forcing the
+#          edge cells to flow outward (FlowDirection with "FORCE"), and basin labelling (Basin).
+#          NoData cells are NaN. A cell is an edge cell if it is on the raster boundary or next
+#          to a NoData cell. The depressions are filled with the Priority-Flood+ algorithm
+#          (Barnes et al. 2014): the edge cells seed a priority queue and the cells raised to
+#          a spill elevation go through a plain FIFO queue. Cells on flats of the filled DEM
+#          flow toward the nearest cell of the flat with a defined direction, and the basins
+#          are labelled by tracing the flow directions upstream from the outlets (the edge
+#          cells), numbered in row-major order of the outlets.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import heapq
+import numpy as np
+from NumbaCompat import jit
+
+##D8 neighbours in the order of the ArcGIS flow direction codes: E, SE, S, SW, W, NW, N, NE
+D8_DR = np.array([0, 1, 1, 1, 0, -1, -1, -1])
+D8_DC = np.array([1, 1, 0, -1, -1, -1, 0, 1])
+D8_CODE = np.array([1, 2, 4, 8, 16, 32, 64, 128], dtype=np.uint8)
+D8_DIST = np.array([1.0, np.sqrt(2.0), 1.0, np.sqrt(2.0), 1.0, np.sqrt(2.0), 1.0, np.sqrt(2.0)])
+
+@jit(nopython=True)
+def EdgeCells(dem):
+    ##Valid cells on the raster boundary or next to a NoData cell
+    nrows, ncols = dem.shape
+    edge = np.zeros((nrows, ncols), dtype=np.bool_)
+    for i in range(nrows):
+        for j in range(ncols):
+            if np.isnan(dem[i, j]):
+                continue
+            for k in range(8):
+                r = i + D8_DR[k]
+                c = j + D8_DC[k]
+                if r < 0 or r >= nrows or c < 0 or c >= ncols or np.isnan(dem[r, c]):
+                    edge[i, j] = True
+                    break
+    return edge
+
+@jit(nopython=True)
+def FillDepressions(dem, edge):
+    ##Priority-Flood+ depression filling: raise every cell without a downhill path to an
+    ##edge cell to the elevation of its spill point
+    nrows, ncols = dem.shape
+    filled = dem.copy()
+    closed = np.zeros((nrows, ncols), dtype=np.bool_)
+    heap = [(0.0, np.int64(0))]
+    heap.pop()
+    pit = np.empty(nrows * ncols, dtype=np.int64)
+    pitHead = 0
+    pitTail = 0
+    for i in range(nrows):
+        for j in range(ncols):
+            if edge[i, j]:
+                closed[i, j] = True
+                heapq.heappush(heap, (filled[i, j], np.int64(i * ncols + j)))
+
+    while pitHead < pitTail or len(heap) > 0:
+        if pitHead < pitTail:
+            idx = pit[pitHead]
+            pitHead += 1
+        else:
+            idx = heapq.heappop(heap)[1]
+        i = idx // ncols
+        j = idx % ncols
+        z = filled[i, j]
+        for k in range(8):
+            r = i + D8_DR[k]
+            c = j + D8_DC[k]
+            if r < 0 or r >= nrows or c < 0 or c >= ncols:
+                continue
+            if closed[r, c] or np.isnan(filled[r, c]):
+                continue
+            closed[r, c] = True
+            if filled[r, c] <= z:
+                filled[r, c] = z
+                pit[pitTail] = r * ncols + c
+                pitTail += 1
+            else:
+                heapq.heappush(heap, (filled[r, c], np.int64(r * ncols + c)))
+    return filled
+
+@jit(nopython=True)
+def D8FlowDirection(filled, edge):
+    ##D8 flow direction (ArcGIS codes) of the filled DEM. Edge cells flow outward (FORCE),
+    ##other cells flow to the neighbour with the steepest drop (the first one in code order
+    ##if there are ties), and cells on flats flow toward the nearest cell of the same
+    ##elevation with a defined direction (the first such neighbour in code order). 0 = NoData
+    nrows, ncols = filled.shape
+    fdir = np.zeros((nrows, ncols), dtype=np.uint8)
+    dist = np.full((nrows, ncols), -1, dtype=np.int64)
+    queue = np.empty(nrows * ncols, dtype=np.int64)
+    qTail = 0
+    for i in range(nrows):
+        for j in range(ncols):
+            z = filled[i, j]
+            if np.isnan(z):
+                continue
+            if edge[i, j]:
+                for k in range(8):
+                    r = i + D8_DR[k]
+                    c = j + D8_DC[k]
+                    if r < 0 or r >= nrows or c < 0 or c >= ncols or np.isnan(filled[r, c]):
+                        fdir[i, j] = D8_CODE[k]
+                        break
+            else:
+                maxDrop = 0.0
+                for k in range(8):
+                    drop = (z - filled[i + D8_DR[k], j + D8_DC[k]]) / D8_DIST[k]
+                    if drop > maxDrop:
+                        maxDrop = drop
+                        fdir[i, j] = D8_CODE[k]
+            if fdir[i, j] > 0:
+                dist[i, j] = 0
+                queue[qTail] = i * ncols + j
+                qTail += 1
+
+    ##Breadth-first distance over the flats from the cells with a defined direction
+    qHead = 0
+    while qHead < qTail:
+        idx = queue[qHead]
+        qHead += 1
+        i = idx // ncols
+        j = idx % ncols
+        for k in range(8):
+            r = i + D8_DR[k]
+            c = j + D8_DC[k]
+            if r < 0 or r >= nrows or c < 0 or c >= ncols:
+                continue
+            if dist[r, c] < 0 and filled[r, c] == filled[i, j]:
+                dist[r, c] = dist[i, j] + 1
+                queue[qTail] = r * ncols + c
+                qTail += 1
+
+    for i in range(nrows):
+        for j in range(ncols):
+            if fdir[i, j] > 0 or dist[i, j] <= 0:
+                continue
+            for k in range(8):
+                r = i + D8_DR[k]
+                c = j + D8_DC[k]
+                if dist[r, c] == dist[i, j] - 1 and filled[r, c] == filled[i, j]:
+                    fdir[i, j] = D8_CODE[k]
+                    break
+    return fdir
+
+@jit(nopython=True)
+def Downstream(fdir):
+    ##Linear index of the downstream cell of each cell (-1 for outlets and NoData)
+    nrows, ncols = fdir.shape
+    down = np.full(nrows * ncols, -1, dtype=np.int64)
+    for i in range(nrows):
+        for j in range(ncols):
+            if fdir[i, j] == 0:
+                continue
+            for k in range(8):
+                if fdir[i, j] == D8_CODE[k]:
+                    r = i + D8_DR[k]
+                    c = j + D8_DC[k]
+                    if r >= 0 and r < nrows and c >= 0 and c < ncols and fdir[r, c] > 0:
+                        down[i * ncols + j] = r * ncols + c
+                    break
+    return down
+
+@jit(nopython=True)
+def BasinLabels(fdir):
+    ##Label the drainage basins by tracing the flow directions upstream from the outlets.
+    ##Basins are numbered from 1 in row-major order of their outlet cells. 0 = NoData
+    nrows, ncols = fdir.shape
+    n = nrows * ncols
+    down = Downstream(fdir)
+
+    ##Upstream cells of each cell in compressed sparse row form
+    start = np.zeros(n + 1, dtype=np.int64)
+    for idx in range(n):
+        if down[idx] >= 0:
+            start[down[idx] + 1] += 1
+    for idx in range(n):
+        start[idx + 1] += start[idx]
+    fill = start[:-1].copy()
+    upstream = np.empty(start[n], dtype=np.int64)
+    for idx in range(n):
+        if down[idx] >= 0:
+            upstream[fill[down[idx]]] = idx
+            fill[down[idx]] += 1
+
+    basins = np.zeros(n, dtype=np.int32)
+    stack = np.empty(n, dtype=np.int64)
+    nBasins = 0
+    for idx in range(n):
+        if fdir.flat[idx] == 0 or down[idx] >= 0:
+            continue
+        nBasins += 1
+        basins[idx] = nBasins
+        top = 0
+        stack[top] = idx
+        top += 1
+        while top > 0:
+            top -= 1
+            cell = stack[top]
+            for u in range(start[cell], start[cell + 1]):
+                basins[upstream[u]] = nBasins
+                stack[top] = upstream[u]
+                top += 1
+    return basins.reshape((nrows, ncols))
+
+def FillFlowBasin(dem):
+    ##Run Fill, FlowDirection("FORCE") and Basin on a DEM array (NoData = NaN).
+    ##Returns the filled DEM, the D8 flow directions and the basin labels
+    dem = np.asarray(dem, dtype=np.float64)
+    edge = EdgeCells(dem)
+    filled = FillDepressions(dem, edge)
+    fdir = D8FlowDirection(filled, edge)
+    basins = BasinLabels(fdir)
+    return filled, fdir, basins
@@ -0,0 +1,439 @@
+﻿#-------------------------------------------------------------------------------
+# Name: HydroTiles.py
+# Purpose: This module runs the HydroCore hydrology (fill, D8 flow direction forcing the edges
+#          outward, and basins) tile by tile on memory-mapped arrays, so that DEMs larger than
+#          the memory can be processed. Each tile is read with a one-cell halo and the results
+#          are stitched across the tile boundaries so that they match the untiled run:
+#            1. Fill: each tile is flooded from its perimeter with watershed labels (the cells
+#               draining to the true DEM edges get the "ocean" label). The spill elevations
+#               between labels, within and across tiles, form a small graph that is solved with
+#               a global priority flood, and each tile is raised to the spill elevation of its
+#               labels (Barnes 2016, Parallel priority-flood depression filling).
+#            2. Flow direction: the steepest-drop directions only need the halo. The distances
+#               over flats are exchanged through the halos until no tile changes.
+#            3. Basins: each tile traces its cells to an outlet or to a cell in another tile,
+#               the links between tiles are resolved, and the basins are numbered in row-major
+#               order of the outlets, the same as HydroCore.BasinLabels.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import heapq
+import numpy as np
+from NumbaCompat import jit
+from HydroCore import D8_DR, D8_DC, D8_CODE, D8_DIST, EdgeCells
+
+OCEAN = 0 ##Global label of the cells draining to the true edges of the DEM
+
+def TileWindows(nrows, ncols, tileSize):
+    ##Row and column ranges of the tiles in row-major order
+    windows = []
+    for r0 in range(0, nrows, tileSize):
+        for c0 in range(0, ncols, tileSize):
+            windows.append((r0, min(r0 + tileSize, nrows), c0, min(c0 + tileSize, ncols)))
+    return windows
+
+def ReadHalo(arr, r0, r1, c0, c1, fillValue):
+    ##Read a tile with a one-cell halo; the halo outside of the raster gets fillValue
+    nrows, ncols = arr.shape
+    out = np.full((r1 - r0 + 2, c1 - c0 + 2), fillValue, dtype=arr.dtype)
+    rr0 = max(r0 - 1, 0)
+    rr1 = min(r1 + 1, nrows)
+    cc0 = max(c0 - 1, 0)
+    cc1 = min(c1 + 1, ncols)
+    out[rr0 - r0 + 1:rr1 - r0 + 1, cc0 - c0 + 1:cc1 - c0 + 1] = arr[rr0:rr1, cc0:cc1]
+    return out
+
+@jit(nopython=True)
+def TileFill(dem, edge):
+    ##Priority flood of one tile from its perimeter and its true edge cells. The true edge
+    ##cells get the ocean label (0), every other perimeter cell its own label (from 1).
+    ##Returns the filled tile, the labels (-1 = NoData), the number of labels and the
+    ##spill edges (label a, label b, elevation) between different labels
+    nrows, ncols = dem.shape
+    filled = dem.copy()
+    labels = np.full((nrows, ncols), -1, dtype=np.int64)
+    heap = [(0.0, np.int64(0))]
+    heap.pop()
+    pit = np.empty(nrows * ncols, dtype=np.int64)
+    pitHead = 0
+    pitTail = 0
+    nLabels = 1
+    for i in range(nrows):
+        for j in range(ncols):
+            if np.isnan(dem[i, j]):
+                continue
+            if edge[i, j]:
+                labels[i, j] = 0
+            elif i == 0 or j == 0 or i == nrows - 1 or j == ncols - 1:
+                labels[i, j] = nLabels
+                nLabels += 1
+            else:
+                continue
+            heapq.heappush(heap, (filled[i, j], np.int64(i * ncols + j)))
+
+    edgeA = [np.int64(0)]
+    edgeB = [np.int64(0)]
+    edgeZ = [0.0]
+    edgeA.pop()
+    edgeB.pop()
+    edgeZ.pop()
+    while pitHead < pitTail or len(heap) > 0:
+        if pitHead < pitTail:
+            idx = pit[pitHead]
+            pitHead += 1
+        else:
+            idx = heapq.heappop(heap)[1]
+        i = idx // ncols
+        j = idx % ncols
+        z = filled[i, j]
+        for k in range(8):
+            r = i + D8_DR[k]
+            c = j + D8_DC[k]
+            if r < 0 or r >= nrows or c < 0 or c >= ncols or np.isnan(filled[r, c]):
+                continue
+            if labels[r, c] >= 0:
+                if labels[r, c] != labels[i, j]:
+                    edgeA.append(labels[i, j])
+                    edgeB.append(labels[r, c])
+                    edgeZ.append(max(z, filled[r, c]))
+                continue
+            labels[r, c] = labels[i, j]
+            if filled[r, c] <= z:
+                filled[r, c] = z
+                pit[pitTail] = r * ncols + c
+                pitTail += 1
+            else:
+                heapq.heappush(heap, (filled[r, c], np.int64(r * ncols + c)))
+    return filled, labels, nLabels, np.array(edgeA), np.array(edgeB), np.array(edgeZ)
+
+@jit(nopython=True)
+def SolveSpill(nNodes, edgeA, edgeB, edgeZ):
+    ##Spill elevation of every label: the lowest possible maximum elevation along a path of
+    ##spill edges to the ocean (priority flood on the label graph)
+    order = np.argsort(edgeA)
+    start = np.zeros(nNodes + 1, dtype=np.int64)
+    for e in range(len(edgeA)):
+        start[edgeA[e] + 1] += 1
+    for n in range(nNodes):
+        start[n + 1] += start[n]
+
+    spill = np.full(nNodes, np.inf)
+    done = np.zeros(nNodes, dtype=np.bool_)
+    spill[OCEAN] = -np.inf
+    heap = [(-np.inf, np.int64(OCEAN))]
+    while len(heap) > 0:
+        z, n = heapq.heappop(heap)
+        if done[n]:
+            continue
+        done[n] = True
+        for e in range(start[n], start[n + 1]):
+            m = edgeB[order[e]]
+            zm = max(z, edgeZ[order[e]])
+            if zm < spill[m]:
+                spill[m] = zm
+                heapq.heappush(heap, (zm, m))
+    return spill
+
+@jit(nopython=True)
+def CrossEdges(labelsA, labelsB, filledA, filledB):
+    ##Spill edges between two rows (or columns) of cells on either side of a tile boundary.
+    ##Each cell is linked to the three cells facing it (8-connectivity)
+    n = len(labelsA)
+    edgeA = [np.int64(0)]
+    edgeB = [np.int64(0)]
+    edgeZ = [0.0]
+    edgeA.pop()
+    edgeB.pop()
+    edgeZ.pop()
+    for i in range(n):
+        if labelsA[i] < 0:
+            continue
+        for d in range(-1, 2):
+            j = i + d
+            if j < 0 or j >= n or labelsB[j] < 0:
+                continue
+            edgeA.append(labelsA[i])
+            edgeB.append(labelsB[j])
+            edgeZ.append(max(filledA[i], filledB[j]))
+    return np.array(edgeA), np.array(edgeB), np.array(edgeZ)
+
+@jit(nopython=True)
+def TileDirections(filled, edge):
+    ##Steepest-drop D8 directions of the tile interior from a tile with a one-cell halo;
+    ##the flats are left at 0 and get the distance -2 (undefined), defined cells 0,
+    ##NoData -1
+    nrows, ncols = filled.shape
+    fdir = np.zeros((nrows - 2, ncols - 2), dtype=np.uint8)
+    dist = np.full((nrows - 2, ncols - 2), -1, dtype=np.int64)
+    for i in range(1, nrows - 1):
+        for j in range(1, ncols - 1):
+            z = filled[i, j]
+            if np.isnan(z):
+                continue
+            if edge[i, j]:
+                for k in range(8):
+                    if np.isnan(filled[i + D8_DR[k], j + D8_DC[k]]):
+                        fdir[i-1, j-1] = D8_CODE[k]
+                        break
+            else:
+                maxDrop = 0.0
+                for k in range(8):
+                    drop = (z - filled[i + D8_DR[k], j + D8_DC[k]]) / D8_DIST[k]
+                    if drop > maxDrop:
+                        maxDrop = drop
+                        fdir[i-1, j-1] = D8_CODE[k]
+            dist[i-1, j-1] = 0 if fdir[i-1, j-1] > 0 else -2
+    return fdir, dist
+
+@jit(nopython=True)
+def TileFlatDistance(filled, dist):
+    ##Shortest distance over the flats to a cell with a defined direction for the tile
+    ##interior, starting from the current distances of the tile and its halo (-2 = unknown).
+    ##Returns the new interior distances and whether any of them changed
+    nrows, ncols = filled.shape
+    big = np.int64(nrows * ncols * 1000000)
+    d = np.where(dist == -2, big, dist)
+    heap = [(np.int64(0), np.int64(0))]
+    heap.pop()
+    ##Seed the queue only with the cells that can shorten the distance of an interior neighbour
+    for i in range(nrows):
+        for j in range(ncols):
+            if d[i, j] < 0 or d[i, j] >= big:
+                continue
+            for k in range(8):
+                r = i + D8_DR[k]
+                c = j + D8_DC[k]
+                if r >= 1 and r < nrows - 1 and c >= 1 and c < ncols - 1 and d[r, c] > d[i, j] + 1 and filled[r, c] == filled[i, j]:
+                    heapq.heappush(heap, (d[i, j], np.int64(i * ncols + j)))
+                    break
+    while len(heap) > 0:
+        di, idx = heapq.heappop(heap)
+        i = idx // ncols
+        j = idx % ncols
+        if di > d[i, j]:
+            continue
+        for k in range(8):
+            r = i + D8_DR[k]
+            c = j + D8_DC[k]
+            if r < 1 or r >= nrows - 1 or c < 1 or c >= ncols - 1:
+                continue ##Only the interior is updated
+            if dist[r, c] == -1 or filled[r, c] != filled[i, j]:
+                continue
+            if d[r, c] > di + 1:
+                d[r, c] = di + 1
+                heapq.heappush(heap, (di + 1, np.int64(r * ncols + c)))
+    out = np.where(d == big, -2, d)[1:-1, 1:-1].copy()
+    changed = False
+    for i in range(nrows - 2):
+        for j in range(ncols - 2):
+            if out[i, j] != dist[i+1, j+1]:
+                changed = True
+    return out, changed
+
+@jit(nopython=True)
+def TileFlatDirections(filled, dist, fdir):
+    ##Directions of the flat cells of the tile interior toward the neighbour one step closer
+    ##to a defined cell (the first one in code order)
+    nrows, ncols = filled.shape
+    for i in range(1, nrows - 1):
+        for j in range(1, ncols - 1):
+            if fdir[i-1, j-1] > 0 or dist[i, j] <= 0:
+                continue
+            for k in range(8):
+                r = i + D8_DR[k]
+                c = j + D8_DC[k]
+                if dist[r, c] == dist[i, j] - 1 and filled[r, c] == filled[i, j]:
+                    fdir[i-1, j-1] = D8_CODE[k]
+                    break
+    return fdir
+
+@jit(nopython=True)
+def TileTerminals(fdir, r0, c0, ncolsGlobal):
+    ##Follow the flow of each cell of the tile interior (fdir with a one-cell halo) to an
+    ##outlet or to a cell in another tile. Outlets are coded by their global index (>= 0),
+    ##links to another tile by -(global index of the cell in the other tile) - 1
+    nrows, ncols = fdir.shape
+    term = np.full((nrows - 2, ncols - 2), np.iinfo(np.int64).min, dtype=np.int64)
+    down = np.full((nrows - 2, ncols - 2), -1, dtype=np.int64)
+    stack = np.empty((nrows - 2) * (ncols - 2), dtype=np.int64)
+    for i in range(1, nrows - 1):
+        for j in range(1, ncols - 1):
+            if fdir[i, j] == 0:
+                continue
+            for k in range(8):
+                if fdir[i, j] == D8_CODE[k]:
+                    r = i + D8_DR[k]
+                    c = j + D8_DC[k]
+                    if fdir[r, c] == 0:
+                        term[i-1, j-1] = (r0 + i - 1) * ncolsGlobal + (c0 + j - 1) ##Outlet
+                    elif r < 1 or r >= nrows - 1 or c < 1 or c >= ncols - 1:
+                        term[i-1, j-1] = -((r0 + r - 1) * ncolsGlobal + (c0 + c - 1)) - 1
+                    else:
+                        down[i-1, j-1] = (r - 1) * (ncols - 2) + (c - 1)
+                    break
+
+    unset = np.iinfo(np.int64).min
+    termFlat = term.ravel()
+    downFlat = down.ravel()
+    for idx in range(len(termFlat)):
+        if termFlat[idx] != unset or downFlat[idx] < 0:
+            continue
+        top = 0
+        cell = idx
+        while termFlat[cell] == unset:
+            stack[top] = cell
+            top += 1
+            cell = downFlat[cell]
+        value = termFlat[cell]
+        for s in range(top):
+            termFlat[stack[s]] = value
+    return termFlat.reshape((nrows - 2, ncols - 2))
+
+@jit(nopython=True)
+def ResolveLinks(termFlat, links):
+    ##Follow the links between tiles (global cell indices) to their outlets
+    outlets = np.empty(len(links), dtype=np.int64)
+    for n in range(len(links)):
+        cell = links[n]
+        while termFlat[cell] < 0:
+            cell = -termFlat[cell] - 1
+        outlets[n] = termFlat[cell]
+    return outlets
+
+def OpenArray(workFolder, name, shape, dtype):
+    return np.lib.format.open_memmap(os.path.join(workFolder, name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+
+def TiledFillFlowBasin(dem, tileSize, workFolder):
+    ##Tiled version of HydroCore.FillFlowBasin for a (memory-mapped) DEM array with NaN as
+    ##NoData. The outputs are memory-mapped .npy files in workFolder:
+    ##filled DEM, D8 flow direction and basin labels, identical to the untiled run
+    nrows, ncols = dem.shape
+    windows = TileWindows(nrows, ncols, tileSize)
+    filled = OpenArray(workFolder, "filled", (nrows, ncols), np.float64)
+    labels = OpenArray(workFolder, "fill_labels", (nrows, ncols), np.int64)
+
+    ##Step 1: fill each tile from its perimeter and collect the spill edges
+    edgesA = []
+    edgesB = []
+    edgesZ = []
+    nNodes = 1 ##The ocean
+    for r0, r1, c0, c1 in windows:
+        demHalo = ReadHalo(dem, r0, r1, c0, c1, np.nan).astype(np.float64)
+        edge = EdgeCells(demHalo)[1:-1, 1:-1]
+        tileFilled, tileLabels, nLabels, ea, eb, ez = TileFill(demHalo[1:-1, 1:-1], edge)
+        ##Tile labels 1.. become global labels nNodes..; the ocean stays 0
+        tileLabels = np.where(tileLabels > 0, tileLabels + nNodes - 1, tileLabels)
+        edgesA.append(np.where(ea > 0, ea + nNodes - 1, ea))
+        edgesB.append(np.where(eb > 0, eb + nNodes - 1, eb))
+        edgesZ.append(ez)
+        filled[r0:r1, c0:c1] = tileFilled
+        labels[r0:r1, c0:c1] = tileLabels
+        nNodes += nLabels - 1
+
+    ##Spill edges across the tile boundaries
+    for r in sorted(set(w[0] for w in windows if w[0] > 0)):
+        ea, eb, ez = CrossEdges(np.asarray(labels[r-1]), np.asarray(labels[r]), np.asarray(filled[r-1]), np.asarray(filled[r]))
+        edgesA.append(ea)
+        edgesB.append(eb)
+        edgesZ.append(ez)
+    for c in sorted(set(w[2] for w in windows if w[2] > 0)):
+        ea, eb, ez = CrossEdges(np.asarray(labels[:, c-1]), np.asarray(labels[:, c]), np.asarray(filled[:, c-1]), np.asarray(filled[:, c]))
+        edgesA.append(ea)
+        edgesB.append(eb)
+        edgesZ.append(ez)
+
+    edgeA = np.concatenate(edgesA)
+    edgeB = np.concatenate(edgesB)
+    edgeZ = np.concatenate(edgesZ)
+    spill = SolveSpill(nNodes, np.concatenate((edgeA, edgeB)), np.concatenate((edgeB, edgeA)), np.concatenate((edgeZ, edgeZ)))
+    spill[OCEAN] = -np.inf
+    del edgesA, edgesB, edgesZ, edgeA, edgeB, edgeZ
+
+    ##Raise each tile to the spill elevation of its labels
+    for r0, r1, c0, c1 in windows:
+        tileLabels = np.asarray(labels[r0:r1, c0:c1])
+        tileFilled = np.asarray(filled[r0:r1, c0:c1])
+        valid = tileLabels >= 0
+        tileFilled[valid] = np.maximum(tileFilled[valid], spill[tileLabels[valid]])
+        filled[r0:r1, c0:c1] = tileFilled
+    del labels
+
+    ##Step 2: flow directions, with the flat distances exchanged through the halos
+    fdir = OpenArray(workFolder, "fdir", (nrows, ncols), np.uint8)
+    dist = OpenArray(workFolder, "flat_dist", (nrows, ncols), np.int64)
+    hasFlat = []
+    for r0, r1, c0, c1 in windows:
+        filledHalo = ReadHalo(filled, r0, r1, c0, c1, np.nan)
+        edge = EdgeCells(filledHalo)
+        tileFdir, tileDist = TileDirections(filledHalo, edge)
+        fdir[r0:r1, c0:c1] = tileFdir
+        dist[r0:r1, c0:c1] = tileDist
+        hasFlat.append(bool((tileDist == -2).any()))
+
+    ##Update the tiles with flats until the distances do not change; a tile that changed
+    ##marks its neighbouring tiles for another pass
+    nTileCols = (ncols + tileSize - 1) // tileSize
+    dirty = [t for t in range(len(windows)) if hasFlat[t]]
+    while dirty:
+        nextDirty = set()
+        for t in dirty:
+            r0, r1, c0, c1 = windows[t]
+            filledHalo = ReadHalo(filled, r0, r1, c0, c1, np.nan)
+            distHalo = ReadHalo(dist, r0, r1, c0, c1, -1)
+            newDist, tileChanged = TileFlatDistance(filledHalo, distHalo)
+            if not tileChanged:
+                continue
+            dist[r0:r1, c0:c1] = newDist
+            tr, tc = divmod(t, nTileCols)
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    nb = (tr + dr) * nTileCols + tc + dc
+                    if (dr or dc) and 0 <= tc + dc < nTileCols and 0 <= nb < len(windows) and hasFlat[nb]:
+                        nextDirty.add(nb)
+        dirty = sorted(nextDirty)
+
+    for r0, r1, c0, c1 in windows:
+        tileFdir = np.asarray(fdir[r0:r1, c0:c1])
+        if not (tileFdir[np.asarray(dist[r0:r1, c0:c1]) > 0] == 0).any():
+            continue
+        filledHalo = ReadHalo(filled, r0, r1, c0, c1, np.nan)
+        distHalo = ReadHalo(dist, r0, r1, c0, c1, -1)
+        fdir[r0:r1, c0:c1] = TileFlatDirections(filledHalo, distHalo, tileFdir.copy())
+    del dist
+
+    ##Step 3: basins, traced to an outlet or to another tile and then resolved globally
+    term = OpenArray(workFolder, "basin_terminals", (nrows, ncols), np.int64)
+    for r0, r1, c0, c1 in windows:
+        fdirHalo = ReadHalo(fdir, r0, r1, c0, c1, 0)
+        term[r0:r1, c0:c1] = TileTerminals(fdirHalo, r0, c0, ncols)
+
+    termFlat = term.reshape(-1)
+    unset = np.iinfo(np.int64).min
+    outletList = []
+    linkList = []
+    for r0, r1, c0, c1 in windows:
+        tileTerm = np.asarray(term[r0:r1, c0:c1])
+        outletList.append(np.unique(tileTerm[(tileTerm >= 0)]))
+        linkList.append(np.unique(-tileTerm[(tileTerm < 0) & (tileTerm != unset)] - 1))
+    outletCells = np.unique(np.concatenate(outletList))
+    links = np.unique(np.concatenate(linkList))
+    linkOutlets = ResolveLinks(termFlat, links)
+
+    basins = OpenArray(workFolder, "basins", (nrows, ncols), np.int32)
+    for r0, r1, c0, c1 in windows:
+        tileTerm = np.asarray(term[r0:r1, c0:c1])
+        tileBasins = np.zeros(tileTerm.shape, dtype=np.int32)
+        isOutlet = tileTerm >= 0
+        tileBasins[isOutlet] = np.searchsorted(outletCells, tileTerm[isOutlet]) + 1
+        isLink = (tileTerm < 0) & (tileTerm != unset)
+        outlet = linkOutlets[np.searchsorted(links, -tileTerm[isLink] - 1)]
+        tileBasins[isLink] = np.searchsorted(outletCells, outlet) + 1
+        basins[r0:r1, c0:c1] = tileBasins
+    del term, termFlat
+    os.remove(os.path.join(workFolder, "fill_labels.npy"))
+    os.remove(os.path.join(workFolder, "flat_dist.npy"))
+    os.remove(os.path.join(workFolder, "basin_terminals.npy"))
+    return filled, fdir, basins
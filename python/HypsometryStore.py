@@ -0,0 +1,71 @@
+﻿#-------------------------------------------------------------------------------
+# Name: HypsometryStore.py
+# Purpose: This module writes and reads the binned hypsometry of the glaciers derived by
+#          AddDerivedGlacierAttributes.py as a compact ragged array in a NumPy .npz sidecar file:
+#          the PGI_ID, the lowest elevation (start of the first bin) and the bin offsets of each
+#          glacier, the cell counts of all bins, the elevation bin (interval) and the cell area.
+#          The file is read lazily (the arrays are only loaded when used), so that the hypsometric
+#          curves of an inventory can be plotted or used by other ELA methods without deriving
+#          the zonal histograms again.
+#
+#          Example:
+#              hyps = HypsometryStore.Hypsometry("outlines_hypsometry.npz")
+#              elevations, areas = hyps.Curve("PGI_LGM_105.123W39.456N")
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import numpy as np
+
+def WriteHypsometry(fileName, pgiIDs, starts, counts, interval, cellArea):
+    ##Write the hypsometry of the glaciers: pgiIDs, starts (lowest elevation) and counts (list of the bin
+    ##counts of each glacier) in the same order
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in counts], out=offsets[1:])
+    flat = np.concatenate([np.asarray(c, dtype=np.int64) for c in counts]) if len(counts) > 0 else np.zeros(0, dtype=np.int64)
+    ##The counts are stored with the smallest integer type that holds them
+    dtype = np.uint16 if len(flat) == 0 or flat.max() <= np.iinfo(np.uint16).max else np.uint32
+    np.savez_compressed(fileName, PGI_ID=np.asarray(pgiIDs, dtype=str), start=np.asarray(starts, dtype=np.int32),
+                        offsets=offsets, counts=flat.astype(dtype), interval=np.int32(interval), cell_area=np.float64(cellArea))
+
+class Hypsometry(object):
+    ##Lazy reader of a hypsometry file: each array is loaded by its first access and then kept
+    def __init__(self, fileName):
+        self.file = np.load(fileName)
+        self.arrays = {}
+        self.interval = int(self.Array("interval"))
+        self.cellArea = float(self.Array("cell_area"))
+        self._index = None
+
+    def Array(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = self.file[name]
+        return self.arrays[name]
+
+    def IDs(self):
+        return self.Array("PGI_ID")
+
+    def __len__(self):
+        return len(self.Array("start"))
+
+    def Index(self, pgiID):
+        ##Position of a PGI_ID in the file (the first one if the PGI_ID is not unique)
+        if self._index is None:
+            self._index = {}
+            for i, name in enumerate(self.IDs()):
+                self._index.setdefault(str(name), i)
+        return self._index[pgiID]
+
+    def Counts(self, i):
+        ##Lowest elevation and bin counts of the glacier at position i
+        offsets = self.Array("offsets")
+        return int(self.Array("start")[i]), self.Array("counts")[offsets[i]:offsets[i+1]].astype(np.int64)
+
+    def Curve(self, pgiID):
+        ##Hypsometric curve of a glacier: the lower elevation of each bin and the area of the bin
+        start, counts = self.Counts(self.Index(pgiID))
+        return start + np.arange(len(counts)) * self.interval, counts * self.cellArea
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,126 @@
+﻿#-------------------------------------------------------------------------------
+# Name: MergeHierarchy.py
+# Purpose: This module builds and stores the merge hierarchy (dendrogram) of the basins derived
+#          by DivideforWatersheds.py, so that the outlines can be subdivided again for another
+#          minimum relief (Min_Ele_Range) or minimum area without the hydrology. The regions of the
+#          basins are merged by relief until no neighbour is left, in the same order as the relief
+#          step of BasinMerge.MergeBasins (the lowest relief first, so the relief of the merged
+#          regions never decreases). The merges of any minimum relief are then the merges of the
+#          hierarchy with a relief less than the minimum relief, and only the small area merges are
+#          repeated on the reduced region adjacency graph. The hierarchy is stored in a NumPy .npz
+#          file with the region raster and its georeference.
+#
+#          Example:
+#              hierarchy = MergeHierarchy.MergeHierarchy("basins_hierarchy.npz")
+#              merged, nBasins, nMerged = hierarchy.Cut(200, 5 * 30 * 30)
+#              counts = hierarchy.Sweep([100, 200, 300, 400], [4500])
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import numpy as np
+import BasinMerge
+
+def BuildHierarchy(basinArr, demArr, nodata):
+    ##Merge all regions of the basins by relief and return the arrays of the hierarchy: the region
+    ##raster, the statistics and the edge lengths of the regions, and the region, target and relief
+    ##of each merge in the merge order
+    regions, nRegions = BasinMerge.LabelRegions(basinArr, nodata)
+    zmin, zmax, count = BasinMerge.RegionStats(regions, np.asarray(demArr, dtype=np.float64), nRegions)
+    keys, lengths = BasinMerge.EdgeLengths(regions, nRegions)
+    arrays = {"regions": regions, "zmin": zmin.copy(), "zmax": zmax.copy(), "count": count.copy(),
+              "edge_keys": keys, "edge_lengths": lengths}
+
+    merges = []
+    parent = list(range(nRegions + 1))
+    BasinMerge.MergeSmallRegions(parent, BasinMerge.AdjacencyGraph(keys, lengths, nRegions), zmin, zmax, count,
+                                 lambda r: True, lambda r: (zmax[r] - zmin[r], count[r], r), merges)
+    arrays["merge_region"] = np.array([m[0] for m in merges], dtype=np.int64)
+    arrays["merge_target"] = np.array([m[1] for m in merges], dtype=np.int64)
+    arrays["merge_relief"] = np.array([m[2][0] for m in merges], dtype=np.float64)
+    return arrays
+
+def SaveHierarchy(fileName, arrays, XMin, YMin, cellW, cellH, spatialRef):
+    ##Save the hierarchy with the lower left corner and the cell size of the region raster and the
+    ##spatial reference (as string). Returns the file name (with the .npz extension added by NumPy)
+    if not fileName.lower().endswith(".npz"):
+        fileName += ".npz"
+    np.savez_compressed(fileName, XMin=np.float64(XMin), YMin=np.float64(YMin), cellW=np.float64(cellW),
+                        cellH=np.float64(cellH), spatial_ref=np.array(spatialRef), **arrays)
+    return fileName
+
+class MergeHierarchy(object):
+    ##Reader of a hierarchy file: each array is loaded by its first access and then kept
+    def __init__(self, fileName):
+        self.file = np.load(fileName)
+        self.arrays = {}
+        self.XMin = float(self.Array("XMin"))
+        self.YMin = float(self.Array("YMin"))
+        self.cellW = float(self.Array("cellW"))
+        self.cellH = float(self.Array("cellH"))
+        self.spatialRef = str(self.Array("spatial_ref"))
+        self.nRegions = len(self.Array("count")) - 1
+
+    def Array(self, name):
+        if name not in self.arrays:
+            self.arrays[name] = self.file[name]
+        return self.arrays[name]
+
+    def ReliefState(self, minRelief):
+        ##Roots, statistics and edge lengths of the regions after the relief merges less than minRelief
+        n = self.nRegions
+        k = int(np.searchsorted(self.Array("merge_relief"), minRelief, side="left"))
+        roots = np.arange(n + 1, dtype=np.int64)
+        roots[self.Array("merge_region")[:k]] = self.Array("merge_target")[:k]
+        while True: ##Pointer jumping to the roots of the merge trees
+            grand = roots[roots]
+            if np.array_equal(grand, roots):
+                break
+            roots = grand
+
+        zmin = np.full(n + 1, np.inf)
+        zmax = np.full(n + 1, -np.inf)
+        np.minimum.at(zmin, roots, self.Array("zmin"))
+        np.maximum.at(zmax, roots, self.Array("zmax"))
+        count = np.bincount(roots, weights=self.Array("count"), minlength=n + 1).astype(np.int64)
+
+        a, b = np.divmod(self.Array("edge_keys"), n + 1)
+        a = roots[a]
+        b = roots[b]
+        keep = a != b
+        pairs = np.minimum(a[keep], b[keep]) * (n + 1) + np.maximum(a[keep], b[keep])
+        keys, inverse = np.unique(pairs, return_inverse=True)
+        lengths = np.bincount(inverse, weights=self.Array("edge_lengths")[keep], minlength=len(keys)).astype(np.int64)
+        return roots, zmin, zmax, count, keys, lengths, k
+
+    def Roots(self, minRelief, minArea):
+        ##Root of each region for the minimum relief and area (the same merges as BasinMerge.MergeBasins),
+        ##and the number of merges
+        cellArea = self.cellW * self.cellH
+        roots, zmin, zmax, count, keys, lengths, nMerged = self.ReliefState(minRelief)
+        parent = roots.tolist()
+        nMerged += BasinMerge.MergeSmallRegions(parent, BasinMerge.AdjacencyGraph(keys, lengths, self.nRegions), zmin, zmax, count,
+                                                lambda r: count[r] * cellArea < minArea,
+                                                lambda r: (count[r], zmax[r] - zmin[r], r))
+        roots = np.array([BasinMerge.Find(parent, r) for r in range(self.nRegions + 1)], dtype=np.int64)
+        return roots, nMerged
+
+    def Cut(self, minRelief, minArea):
+        ##Merged label raster (0 = no data, labels numbered from 1), the number of regions and the
+        ##number of merges, the same as BasinMerge.MergeBasins
+        roots, nMerged = self.Roots(minRelief, minArea)
+        uniqueRoots, newLabels = np.unique(roots, return_inverse=True)
+        return newLabels.astype(np.int32)[self.Array("regions")], self.nRegions, nMerged
+
+    def Count(self, minRelief, minArea):
+        ##Number of merged basins for the minimum relief and area
+        roots, nMerged = self.Roots(minRelief, minArea)
+        return self.nRegions - nMerged
+
+    def Sweep(self, minReliefs, minAreas):
+        ##Number of merged basins of each minimum relief (rows) and minimum area (columns)
+        return np.array([[self.Count(minRelief, minArea) for minArea in minAreas] for minRelief in minReliefs], dtype=np.int64)
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,35 @@
+﻿#-------------------------------------------------------------------------------
+# Name: NumbaCompat.py
+# Purpose: This module wraps numba for the kernels of PG-Tools. The kernels are compiled with the
+#          on-disk cache of numba (cache=True), so that they are only compiled by the first run and
+#          loaded from the cache by the next runs (and by the worker processes) instead of being
+#          compiled again for every tool run. If numba is not installed, the kernels run without
+#          compilation: the hot kernels of the attribute tools have vectorized NumPy versions (the
+#          fallback argument of jit), and the other kernels run as plain Python, which is correct
+#          but slow for large rasters.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+try:
+    import numba
+    from numba import prange
+    HasNumba = True
+except ImportError:
+    numba = None
+    prange = range
+    HasNumba = False
+
+def jit(**options):
+    ##Decorator used instead of numba.jit: compile with the on-disk cache, or without numba return the
+    ##NumPy fallback function if given (fallback=...), otherwise the Python function itself
+    fallback = options.pop("fallback", None)
+    options.setdefault("cache", True)
+    def Decorate(function):
+        if HasNumba:
+            return numba.jit(**options)(function)
+        if fallback is not None:
+            return fallback
+        return function
+    return Decorate
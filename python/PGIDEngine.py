@@ -0,0 +1,252 @@
+﻿#-------------------------------------------------------------------------------
+# Name: PGIDEngine.py
+# Purpose: This module derives the PGI_ID of the outlines for AddBasicGlacierAttributes.py and
+#          AddDerivedGlacierAttributes.py from the geometry arrays of the outlines, instead of
+#          FeatureToPoint (INSIDE), Project, AddXY and a SpatialJoin to match the points with the
+#          outlines. The label point of each outline is its centroid if the centroid is inside the
+#          outline, otherwise the middle of the widest inside interval of a horizontal line. All
+#          label points are projected to WGS 1984 at once as one multipoint geometry. The PGI_IDs
+#          are formatted with fixed width (longitude and latitude truncated to 0.001 degree), and
+#          the PGI_IDs used by more than one outline get a suffix (_2, _3, ...).
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import re
+import struct
+import numpy as np
+from NumbaCompat import jit
+
+def WKBDimensions(geomType):
+    ##Number of ordinates of the points of a WKB geometry type (ISO codes: Z +1000, M +2000, ZM +3000,
+    ##or the Z and M flags of extended WKB)
+    iso = (geomType & 0xFFFF) // 1000
+    dims = 2 + (iso in (1, 2)) + (iso == 3) * 2
+    return dims + ((geomType & 0x80000000) != 0) + ((geomType & 0x40000000) != 0)
+
+def WKBRings(wkb, coords, ringSigns):
+    ##Append the closed rings of a (multi)polygon WKB to the coords list and the role of each ring
+    ##(1 = outer ring, -1 = hole) to ringSigns
+    wkb = bytes(wkb)
+    def ReadPolygon(offset):
+        order = "<" if wkb[offset] == 1 else ">"
+        dims = WKBDimensions(struct.unpack_from(order + "I", wkb, offset + 1)[0])
+        nRings = struct.unpack_from(order + "I", wkb, offset + 5)[0]
+        offset += 9
+        for r in range(nRings):
+            nPoints = struct.unpack_from(order + "I", wkb, offset)[0]
+            ring = np.frombuffer(wkb, dtype=np.dtype(order + "f8"), count=nPoints * dims, offset=offset + 4).reshape(nPoints, dims)[:, :2]
+            coords.append(ring)
+            ringSigns.append(1 if r == 0 else -1)
+            offset += 4 + nPoints * dims * 8
+        return offset
+
+    order = "<" if wkb[0] == 1 else ">"
+    geomType = struct.unpack_from(order + "I", wkb, 1)[0] & 0xFFFF
+    if geomType % 1000 == 6: ##MultiPolygon
+        nPolygons = struct.unpack_from(order + "I", wkb, 5)[0]
+        offset = 9
+        for p in range(nPolygons):
+            offset = ReadPolygon(offset)
+    else:
+        ReadPolygon(0)
+
+def GeometryArrays(wkbs):
+    ##Flat coordinate array of the rings of all outlines, with the start of each ring, the role of
+    ##each ring and the first ring of each outline
+    coords = []
+    ringSigns = []
+    polyStarts = [0]
+    for wkb in wkbs:
+        if wkb is not None:
+            WKBRings(wkb, coords, ringSigns)
+        polyStarts.append(len(coords))
+    ringStarts = np.zeros(len(coords) + 1, dtype=np.int64)
+    np.cumsum([len(ring) for ring in coords], out=ringStarts[1:])
+    xy = np.concatenate(coords).astype(np.float64) if len(coords) > 0 else np.zeros((0, 2))
+    return xy, ringStarts, np.array(ringSigns, dtype=np.int64), np.array(polyStarts, dtype=np.int64)
+
+@jit(nopython=True)
+def LabelPoints(xy, ringStarts, ringSigns, polyStarts):
+    ##Label point of each outline inside the outline (NaN for an empty outline)
+    nPolygons = len(polyStarts) - 1
+    px = np.full(nPolygons, np.nan)
+    py = np.full(nPolygons, np.nan)
+    crossings = np.empty(len(xy))
+    for p in range(nPolygons):
+        r0 = polyStarts[p]
+        r1 = polyStarts[p+1]
+        if r1 == r0:
+            continue
+        ##Area-weighted centroid of the rings (holes subtracted), relative to the first vertex
+        ox = xy[ringStarts[r0], 0]
+        oy = xy[ringStarts[r0], 1]
+        area = 0.0
+        cx = 0.0
+        cy = 0.0
+        ymin = np.inf
+        ymax = -np.inf
+        for r in range(r0, r1):
+            a = 0.0
+            sx = 0.0
+            sy = 0.0
+            for k in range(ringStarts[r], ringStarts[r+1] - 1):
+                x0 = xy[k, 0] - ox
+                y0 = xy[k, 1] - oy
+                x1 = xy[k+1, 0] - ox
+                y1 = xy[k+1, 1] - oy
+                cross = x0 * y1 - x1 * y0
+                a += cross
+                sx += (x0 + x1) * cross
+                sy += (y0 + y1) * cross
+                ymin = min(ymin, xy[k, 1])
+                ymax = max(ymax, xy[k, 1])
+            if a != 0.0:
+                sign = ringSigns[r] * (1.0 if a > 0 else -1.0) ##Outer rings add and holes subtract their area
+                area += sign * a
+                cx += sign * sx
+                cy += sign * sy
+        if area != 0.0:
+            x = ox + cx / (3.0 * area)
+            y = oy + cy / (3.0 * area)
+        else:
+            x = xy[ringStarts[r0], 0]
+            y = xy[ringStarts[r0], 1]
+
+        ##Even-odd test of the centroid against all rings
+        inside = False
+        for r in range(r0, r1):
+            for k in range(ringStarts[r], ringStarts[r+1] - 1):
+                y0 = xy[k, 1]
+                y1 = xy[k+1, 1]
+                if (y0 > y) != (y1 > y):
+                    if x < xy[k, 0] + (y - y0) * (xy[k+1, 0] - xy[k, 0]) / (y1 - y0):
+                        inside = not inside
+        if inside:
+            px[p] = x
+            py[p] = y
+            continue
+
+        ##Centroid outside (e.g. a curved outline): the middle of the widest inside interval of the
+        ##horizontal line through the centroid (or through the middle of the extent)
+        for attempt in range(2):
+            if attempt == 1:
+                y = (ymin + ymax) / 2.0
+            n = 0
+            for r in range(r0, r1):
+                for k in range(ringStarts[r], ringStarts[r+1] - 1):
+                    y0 = xy[k, 1]
+                    y1 = xy[k+1, 1]
+                    if (y0 > y) != (y1 > y):
+                        crossings[n] = xy[k, 0] + (y - y0) * (xy[k+1, 0] - xy[k, 0]) / (y1 - y0)
+                        n += 1
+            if n >= 2:
+                xs = np.sort(crossings[:n])
+                best = 0
+                for i in range(0, n - 1, 2):
+                    if xs[i+1] - xs[i] > xs[best+1] - xs[best]:
+                        best = i
+                px[p] = (xs[best] + xs[best+1]) / 2.0
+                py[p] = y
+                break
+    return px, py
+
+def InsidePoints(wkbs):
+    ##Label point of each outline (WKB) in the coordinate system of the outlines
+    xy, ringStarts, ringSigns, polyStarts = GeometryArrays(wkbs)
+    return LabelPoints(xy, ringStarts, ringSigns, polyStarts)
+
+def MultipointWKB(x, y):
+    ##Little endian multipoint WKB of the points
+    point = np.dtype([("order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+    points = np.zeros(len(x), dtype=point)
+    points["order"] = 1
+    points["type"] = 1
+    points["x"] = x
+    points["y"] = y
+    return struct.pack("<BII", 1, 4, len(x)) + points.tobytes()
+
+def ProjectPoints(arcpy, x, y, spatialRef, outSpatialRef):
+    ##Project the points (no NaN) as one multipoint geometry. Returns the projected x and y
+    if len(x) == 0:
+        return x, y
+    multipoint = arcpy.FromWKB(bytearray(MultipointWKB(x, y)), spatialRef).projectAs(outSpatialRef)
+    wkb = bytes(multipoint.WKB)
+    order = "<" if wkb[0] == 1 else ">"
+    nPoints = struct.unpack_from(order + "I", wkb, 5)[0]
+    pointSize = (len(wkb) - 9) // nPoints
+    points = np.frombuffer(wkb, dtype=np.uint8, offset=9).reshape(nPoints, pointSize)
+    coords = points[:, 5:21].copy().view(np.dtype(order + "f8"))
+    return coords[:, 0].astype(np.float64), coords[:, 1].astype(np.float64)
+
+def GeographicLabelPoints(arcpy, wkbs, spatialRef):
+    ##Longitude and latitude of the label point of each outline (WKB in the spatial reference). The
+    ##points are projected to WGS 1984 unless the outlines are in a geographic coordinate system
+    x, y = InsidePoints(wkbs)
+    if spatialRef.type == "Geographic":
+        return x, y
+    valid = ~np.isnan(x)
+    lon = np.full(len(x), np.nan)
+    lat = np.full(len(x), np.nan)
+    lon[valid], lat[valid] = ProjectPoints(arcpy, x[valid], y[valid], spatialRef, arcpy.SpatialReference(4326))
+    return lon, lat
+
+def FormatCoordinates(values, positive, negative):
+    ##Fixed width text (bytes) of the coordinates: the absolute value truncated to 0.001 degree with at least
+    ##two integer digits (e.g. 05.123, 105.123) and the hemisphere letter. The characters are set as digits
+    ##of all values at once
+    thousandths = np.floor(np.round(np.abs(values) * 1000.0, 9)).astype(np.int64)
+    whole = thousandths // 1000
+    chars = np.empty((len(values), 8), dtype=np.uint8)
+    chars[:, 0] = whole // 100
+    chars[:, 1] = whole // 10 % 10
+    chars[:, 2] = whole % 10
+    chars[:, 4] = thousandths // 100 % 10
+    chars[:, 5] = thousandths // 10 % 10
+    chars[:, 6] = thousandths % 10
+    chars += ord("0")
+    chars[:, 3] = ord(".")
+    chars[:, 7] = np.where(values < 0, ord(negative), ord(positive))
+    short = whole < 100 ##Drop the hundreds digit (the text ends with a null byte, which is not part of it)
+    chars[short, :7] = chars[short, 1:]
+    chars[short, 7] = 0
+    return chars.view("S8")[:, 0]
+
+def FormatPGIIDs(lon, lat, prefix):
+    ##PGI_ID of each outline (prefix, longitude and latitude), None if there is no label point
+    ids = np.full(len(lon), None, dtype=object)
+    valid = ~(np.isnan(lon) | np.isnan(lat))
+    if valid.any():
+        text = np.char.add(FormatCoordinates(lon[valid], "E", "W"), FormatCoordinates(lat[valid], "N", "S")).astype(str)
+        ids[valid] = np.char.add(prefix, text).tolist()
+    return ids
+
+def BaseIDs(ids):
+    ##PGI_IDs without the suffix of the duplicates added by UniqueIDs (a PGI_ID ends with the hemisphere letter)
+    return np.array([None if pgiID is None else re.sub(r"_\d+$", "", pgiID) for pgiID in ids.tolist()], dtype=object)
+
+def UniqueIDs(ids):
+    ##Add a suffix (_2, _3, ...) to the PGI_IDs used more than once, in the given order (the first one
+    ##keeps the PGI_ID). Returns the PGI_IDs and the number of changed PGI_IDs
+    used = set(ids.tolist())
+    seen = {}
+    unique = ids.copy()
+    nChanged = 0
+    for i, pgiID in enumerate(ids.tolist()):
+        if pgiID is None:
+            continue
+        if pgiID not in seen:
+            seen[pgiID] = 1
+            continue
+        n = seen[pgiID]
+        while True:
+            n += 1
+            newID = pgiID + "_" + str(n)
+            if newID not in used:
+                break
+        seen[pgiID] = n
+        used.add(newID)
+        unique[i] = newID
+        nChanged += 1
+    return unique, nChanged
@@ -0,0 +1,280 @@
+﻿#-------------------------------------------------------------------------------
+# Name: PGToolsBatch.py
+# Purpose: This script runs the PG-Tools pipeline (divide for watersheds, add basic attributes and
+#          add derived attributes) headless for many regions, one region per job of a process pool.
+#          The regions are listed in a manifest (JSON list or CSV table) with the DEM, outlines,
+#          ice surface, ice thickness, glacial stage and output of each region. Within a region the
+#          outlines stay in the memory workspace between the tools and the attributes are added in
+#          place, so the outlines are only copied once, to the output of the last tool.
+#
+#          Usage (with the python of ArcGIS Pro):
+#              python PGToolsBatch.py manifest.json --processes 4 --numpy-hydro
+#
+#          Large inventories can be streamed in spatial tiles (--stream-tile-size, see TileStream.py):
+#          each finished tile is appended to the output and recorded in a checkpoint file, and a run
+#          stopped by an error is continued with the unfinished tiles by --resume.
+#
+#          Manifest keys: name, dem, outlines, surface, thickness, stage, output, and optionally
+#          min_relief, rec_method, age_file, dating_method, age_field, iced_site (the command line
+#          options are the defaults of the optional keys) and hierarchy (merge hierarchy file of the
+#          basins, see MergeHierarchy.py)
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+
+Stages = ["divide", "basic", "derived"]
+RequiredKeys = {"divide": ["dem", "outlines"], "basic": ["outlines", "stage"], "derived": ["outlines", "stage", "surface", "thickness"]}
+
+def ReadManifest(manifestFile):
+    ##Regions of the manifest as a list of dictionaries (a JSON list of objects or a CSV table with a header)
+    if manifestFile.lower().endswith(".csv"):
+        with open(manifestFile, newline="") as f:
+            regions = [dict((k.strip(), v.strip()) for k, v in row.items() if v is not None and v.strip() != "") for row in csv.DictReader(f)]
+    else:
+        with open(manifestFile) as f:
+            regions = json.load(f)
+    for i in range(len(regions)):
+        if "name" not in regions[i]:
+            regions[i]["name"] = "region" + str(i + 1)
+    return regions
+
+def RunStages(region, options, outlines, name, output):
+    ##Run the stages of the pipeline for the outlines of a region (or of a tile of a region). The last
+    ##stage writes the output, the other stages the outlines in memory. Returns the output
+    import DivideforWatersheds
+    import AddBasicGlacierAttributes
+    import AddDerivedGlacierAttributes
+
+    stages = options["stages"]
+    memoryOutlines = AddBasicGlacierAttributes.temp_workspace + "\\outlines_" + name
+
+    def StageOutput(stage):
+        ##The last stage writes the output of the region, the other stages the outlines in memory
+        if stage == stages[-1]:
+            return output
+        return memoryOutlines
+
+    def ProfileReport(stage):
+        if options["profile_folder"] == "":
+            return ""
+        return os.path.join(options["profile_folder"], name + "_" + stage + ".json")
+
+    if "divide" in stages:
+        outlines = DivideforWatersheds.DivideforWatersheds(region["dem"], outlines, float(region.get("min_relief", options["min_relief"])),
+                                                           StageOutput("divide"), options["numpy_hydro"], options["tile_size"], False,
+                                                           ProfileReport("divide"), region.get("hierarchy", ""), CacheFolder=options["cache_folder"])
+    if "basic" in stages:
+        outlines = AddBasicGlacierAttributes.AddBasicGlacierAttributes(outlines, region["stage"], region.get("age_file", ""),
+                                                                       region.get("dating_method", ""), region.get("age_field", ""),
+                                                                       region.get("iced_site", ""), StageOutput("basic"),
+                                                                       options["cache_folder"], ProfileReport("basic"))
+    if "derived" in stages:
+        outlines = AddDerivedGlacierAttributes.AddDerivedGlacierAttributes(outlines, region["stage"], region.get("rec_method", options["rec_method"]),
+                                                                           region["surface"], region["thickness"], options["interval"],
+                                                                           options["aar"], options["aabr"], StageOutput("derived"),
+                                                                           CacheFolder=options["cache_folder"], ProfileReport=ProfileReport("derived"),
+                                                                           Realizations=options["realizations"], DEMError=options["dem_error"],
+                                                                           AARratioStd=options["aar_std"], AABRratioStd=options["aabr_std"])
+    import arcpy
+    if arcpy.Exists(memoryOutlines):
+        arcpy.Delete_management(memoryOutlines)
+    return outlines
+
+def StreamRegion(region, options, name):
+    ##Streaming mode: partition the outlines into spatial tiles (TileStream.py), run the stages tile by tile
+    ##and append each finished tile to the output. The finished tiles are recorded in the checkpoint file of
+    ##the region, and a resumed run skips them. Returns the output
+    import arcpy
+    import numpy as np
+    import TileStream
+    import PGIDEngine
+    import AddBasicGlacierAttributes
+    stages = options["stages"]
+    outlines = region["outlines"]
+    output = region["output"]
+    TileField = "StreamTile" ##Tile of each output outline until all tiles are finished
+
+    oidField = arcpy.Describe(outlines).OIDFieldName
+    oids = []
+    boxes = []
+    with arcpy.da.SearchCursor(outlines, ["OID@", "SHAPE@"]) as cursor:
+        for row in cursor:
+            oids.append(row[0])
+            boxes.append((row[1].extent.XMin, row[1].extent.YMin, row[1].extent.XMax, row[1].extent.YMax))
+    del cursor
+    oids = np.array(oids, dtype=np.int64)
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    groups = None
+    if "divide" in stages:
+        ##The outlines within two buffer distances (10 cells) of DivideforWatersheds.py are in one dissolved
+        ##buffer part (ice mass), so they are kept in one tile. The outlines are grouped by their extents, so
+        ##only the extents of the inventory are kept in memory (the groups may join some close ice masses)
+        distance = 20 * float(arcpy.GetRasterProperties_management(region["dem"], "CELLSIZEX").getOutput(0))
+        groups = TileStream.GroupOutlines(boxes, distance)
+    tiles = TileStream.TileKeys(boxes, options["stream_tile_size"], groups)
+
+    if not os.path.exists(options["checkpoint_folder"]):
+        os.makedirs(options["checkpoint_folder"])
+    checkpoint = os.path.join(options["checkpoint_folder"], name + ".jsonl")
+    if options["resume"]:
+        finished = TileStream.ReadCheckpoint(checkpoint)
+        if arcpy.Exists(output) and TileField in [f.name for f in arcpy.ListFields(output)]:
+            ##Remove the outlines of a tile that was appended but not recorded as finished
+            with arcpy.da.UpdateCursor(output, [TileField]) as cursor:
+                for row in cursor:
+                    if row[0] not in finished:
+                        cursor.deleteRow()
+            del cursor
+    else:
+        finished = {}
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        if arcpy.Exists(output):
+            arcpy.Delete_management(output)
+
+    uniqueTiles = sorted(set(tiles.tolist()))
+    print(region["name"] + ": " + str(len(oids)) + " outlines in " + str(len(uniqueTiles)) + " tiles, " +
+          str(len([tile for tile in uniqueTiles if tile in finished])) + " finished")
+    for tile in uniqueTiles:
+        if tile in finished:
+            continue
+        start = time.time()
+        tileOIDs = oids[tiles == tile]
+        tileName = name + "_" + tile.replace("-", "m")
+        layer = "stream_" + tileName
+        where = arcpy.AddFieldDelimiters(outlines, oidField) + " IN (" + ",".join(str(oid) for oid in tileOIDs.tolist()) + ")"
+        arcpy.MakeFeatureLayer_management(outlines, layer, where)
+        tileRegion = dict(region)
+        if "hierarchy" in region: ##One merge hierarchy for each tile
+            tileRegion["hierarchy"] = os.path.splitext(region["hierarchy"])[0] + "_" + tile + ".npz"
+        tileOutput = RunStages(tileRegion, options, layer, tileName, AddBasicGlacierAttributes.temp_workspace + "\\tile_" + tileName)
+
+        arcpy.AddField_management(tileOutput, TileField, "TEXT")
+        arcpy.CalculateField_management(tileOutput, TileField, '"' + tile + '"', "PYTHON_9.3")
+        if arcpy.Exists(output):
+            arcpy.Append_management(tileOutput, output, "NO_TEST")
+        else:
+            arcpy.CopyFeatures_management(tileOutput, output)
+        arcpy.Delete_management(tileOutput)
+        arcpy.Delete_management(layer)
+        TileStream.WriteCheckpoint(checkpoint, tile, len(tileOIDs), time.time() - start)
+
+    if arcpy.Exists(output) and TileField in [f.name for f in arcpy.ListFields(output)]:
+        if "basic" in stages or "derived" in stages:
+            ##The PGI_IDs are unique within each tile: add the suffix of the duplicates of the whole output to the
+            ##PGI_IDs without the suffixes of the tiles, the same suffixes as an unstreamed run
+            with arcpy.da.SearchCursor(output, ["OID@", "PGI_ID"]) as cursor:
+                rows = [row for row in cursor]
+            del cursor
+            pgiIDs, nDuplicates = PGIDEngine.UniqueIDs(PGIDEngine.BaseIDs(np.array([row[1] for row in rows], dtype=object)))
+            changed = dict((row[0], pgiID) for row, pgiID in zip(rows, pgiIDs.tolist()) if pgiID != row[1])
+            if len(changed) > 0:
+                with arcpy.da.UpdateCursor(output, ["OID@", "PGI_ID"]) as cursor:
+                    for row in cursor:
+                        if row[0] in changed:
+                            cursor.updateRow((row[0], changed[row[0]]))
+                del cursor
+        arcpy.DeleteField_management(output, TileField)
+    return output
+
+def RunRegion(job):
+    ##Pool worker: run the stages of the pipeline for one region (tile by tile in the streaming mode). Returns
+    ##the region name, the output, the seconds and the error message (None if successful)
+    region, options = job
+    start = time.time()
+    try:
+        name = re.sub(r"\W", "_", region["name"])
+        if options["stream_tile_size"] > 0:
+            output = StreamRegion(region, options, name)
+        else:
+            output = RunStages(region, options, region["outlines"], name, region["output"])
+        return region["name"], output, time.time() - start, None
+    except Exception:
+        return region["name"], None, time.time() - start, traceback.format_exc()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the PG-Tools pipeline for the regions of a manifest")
+    parser.add_argument("manifest", help="JSON or CSV manifest of the regions")
+    parser.add_argument("--stages", default=",".join(Stages), help="Comma-separated stages to run, in pipeline order")
+    parser.add_argument("--processes", type=int, default=1, help="Number of regions processed at the same time")
+    parser.add_argument("--min-relief", type=float, default=300.0, help="Minimum elevation range (relief) of a glacier")
+    parser.add_argument("--numpy-hydro", action="store_true", help="Use the NumPy/numba hydrology engine")
+    parser.add_argument("--tile-size", type=int, default=0, help="Tile size of large DEMs with the NumPy engine (0 = no tiling)")
+    parser.add_argument("--rec-method", default="", help="Reconstruction method")
+    parser.add_argument("--interval", type=int, default=20, help="Elevation bin for the ELA calculation")
+    parser.add_argument("--aar", type=float, default=0.58, help="AAR ratio")
+    parser.add_argument("--aabr", type=float, default=1.56, help="AABR ratio")
+    parser.add_argument("--realizations", type=int, default=0, help="Monte Carlo realizations of the ELA uncertainty (0 = none)")
+    parser.add_argument("--dem-error", type=float, default=0.0, help="DEM error (m, standard deviation) of the ELA uncertainty")
+    parser.add_argument("--aar-std", type=float, default=0.0, help="Standard deviation of the AAR ratio of the ELA uncertainty")
+    parser.add_argument("--aabr-std", type=float, default=0.0, help="Standard deviation of the AABR ratio of the ELA uncertainty")
+    parser.add_argument("--cache-folder", default="", help="Cache folder of the attribute results and of the raster stores (the DEM, ice surface and ice thickness decoded once)")
+    parser.add_argument("--profile-folder", default="", help="Folder of the profile reports of each region and stage")
+    parser.add_argument("--summary", default="", help="JSON summary of the batch run")
+    parser.add_argument("--stream-tile-size", type=float, default=0.0, help="Process the outlines in spatial tiles of this size (map units) and append each tile to the output (0 = no tiles)")
+    parser.add_argument("--checkpoint-folder", default="", help="Folder of the checkpoint files of the finished tiles (default: checkpoints beside the manifest)")
+    parser.add_argument("--resume", action="store_true", help="Skip the tiles that are finished in the checkpoint files")
+    args = parser.parse_args()
+
+    stages = [s for s in Stages if s in [v.strip() for v in args.stages.split(",")]]
+    if len(stages) == 0:
+        parser.error("No valid stage in " + args.stages)
+    regions = ReadManifest(args.manifest)
+    for region in regions:
+        missing = [k for k in ["output"] + sum([RequiredKeys[s] for s in stages], []) if k not in region]
+        if len(missing) > 0:
+            parser.error("Region " + region["name"] + " misses " + ", ".join(sorted(set(missing))))
+    if args.profile_folder != "" and not os.path.exists(args.profile_folder):
+        os.makedirs(args.profile_folder)
+
+    options = {"stages": stages, "min_relief": args.min_relief, "numpy_hydro": args.numpy_hydro, "tile_size": args.tile_size,
+               "rec_method": args.rec_method, "interval": args.interval, "aar": args.aar, "aabr": args.aabr,
+               "realizations": args.realizations, "dem_error": args.dem_error, "aar_std": args.aar_std, "aabr_std": args.aabr_std,
+               "cache_folder": args.cache_folder, "profile_folder": args.profile_folder, "stream_tile_size": args.stream_tile_size,
+               "checkpoint_folder": args.checkpoint_folder, "resume": args.resume}
+    if options["checkpoint_folder"] == "":
+        options["checkpoint_folder"] = os.path.join(os.path.dirname(os.path.abspath(args.manifest)), "checkpoints")
+    jobs = [(region, options) for region in regions]
+    start = time.time()
+    results = []
+    if args.processes > 1:
+        pool = multiprocessing.Pool(min(args.processes, len(jobs)))
+        for result in pool.imap_unordered(RunRegion, jobs, chunksize=1):
+            results.append(result)
+            print(FormatResult(result, len(results), len(jobs)))
+        pool.close()
+        pool.join()
+    else:
+        for job in jobs:
+            results.append(RunRegion(job))
+            print(FormatResult(results[-1], len(results), len(jobs)))
+
+    failed = [r for r in results if r[3] is not None]
+    print("Processed " + str(len(results) - len(failed)) + " of " + str(len(results)) + " regions in " + str(round(time.time() - start, 1)) + " s")
+    if args.summary != "":
+        with open(args.summary, "w") as f:
+            json.dump([{"name": r[0], "output": r[1], "seconds": round(r[2], 3), "error": r[3]} for r in results], f, indent=2)
+    if len(failed) > 0:
+        sys.exit(1)
+
+def FormatResult(result, done, total):
+    ##Progress line of a finished region
+    name, output, seconds, error = result
+    line = "[" + str(done) + "/" + str(total) + "] " + name + ": "
+    if error is not None:
+        return line + "failed after " + str(round(seconds, 1)) + " s\n" + error
+    return line + output + " (" + str(round(seconds, 1)) + " s)"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+﻿#-------------------------------------------------------------------------------
+# Name: Profiler.py
+# Purpose: This module provides the timing and memory instrumentation of the tools of PG-Tools.
+#          Each step of a tool is timed with the resident memory (RSS) of the process at the end
+#          of the step and the peak RSS so far. The per-glacier events are aggregated in counters
+#          instead of one message per glacier, and the progress of the long loops is reported with
+#          a throttled line (glaciers per second and the estimated time left). The steps and
+#          counters can be written as a JSON or CSV profile report to find the hot spots of a run.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import sys
+import csv
+import json
+import time
+import contextlib
+
+def MemoryUsage():
+    ##Current and peak resident set size (RSS) of the process in bytes (None if unknown)
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        GetProcessMemoryInfo = ctypes.windll.psapi.GetProcessMemoryInfo
+        GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        if GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        return None, None
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak *= 1024 ##kilobytes on Linux
+    except ImportError:
+        peak = None
+    current = None
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return current, peak
+
+def FormatSeconds(seconds):
+    ##Seconds as h:mm:ss
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+class Profiler(object):
+    ##Timer of the steps of a tool. message is the function to report the steps and the progress
+    ##(arcpy.AddMessage in the tools); interval is the minimum number of seconds between two
+    ##progress lines
+    def __init__(self, toolName, message=print, interval=10.0):
+        self.toolName = toolName
+        self.message = message
+        self.interval = interval
+        self.started = time.time()
+        self.steps = []
+        self.counters = {}
+        self.current = None
+
+    def Start(self, name):
+        ##Start a step and end the current step; the name is reported as the step message
+        self.End()
+        self.message(name)
+        self.current = {"name": name, "start": time.time(), "items": 0, "lastProgress": time.time()}
+
+    def End(self):
+        ##End the current step and record its time and memory
+        if self.current is None:
+            return
+        step = self.current
+        self.current = None
+        seconds = time.time() - step["start"]
+        rss, peak = MemoryUsage()
+        record = {"name": step["name"], "seconds": round(seconds, 3), "items": step["items"],
+                  "items_per_second": round(step["items"] / seconds, 1) if seconds > 0 and step["items"] > 0 else None,
+                  "rss_mb": round(rss / 1048576.0, 1) if rss is not None else None,
+                  "peak_rss_mb": round(peak / 1048576.0, 1) if peak is not None else None}
+        self.steps.append(record)
+
+    @contextlib.contextmanager
+    def Step(self, name):
+        ##Context of a step: with profile.Step("Step 1: ..."):
+        self.Start(name)
+        try:
+            yield self
+        finally:
+            self.End()
+
+    def Count(self, name, n=1):
+        ##Add n to a counter (aggregated per-glacier events, such as the outlines without data)
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def Progress(self, done, total, unit="glaciers"):
+        ##Record the items done in the current step and report the rate and the time left,
+        ##at most once every interval seconds and once at the end
+        if self.current is None:
+            return
+        step = self.current
+        step["items"] = done
+        now = time.time()
+        if now - step["lastProgress"] < self.interval and done < total:
+            return
+        step["lastProgress"] = now
+        rate = done / max(now - step["start"], 1e-9)
+        line = "    " + str(done) + " of " + str(total) + " " + unit + ", " + str(round(rate, 1)) + " " + unit + "/s"
+        if done < total and rate > 0:
+            line += ", ETA " + FormatSeconds((total - done) / rate)
+        self.message(line)
+
+    def Finish(self, reportFile=""):
+        ##End the last step, report the total time and peak memory, and write the profile report
+        ##(JSON, or CSV if the file ends with .csv) if a report file is given
+        self.End()
+        total = time.time() - self.started
+        rss, peak = MemoryUsage()
+        line = "Total time: " + FormatSeconds(total)
+        if peak is not None:
+            line += ", peak memory: " + str(round(peak / 1048576.0, 1)) + " MB"
+        self.message(line)
+        if reportFile == "":
+            return
+        if reportFile.lower().endswith(".csv"):
+            with open(reportFile, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["type", "name", "seconds", "items", "items_per_second", "rss_mb", "peak_rss_mb"])
+                for step in self.steps:
+                    writer.writerow(["step", step["name"], step["seconds"], step["items"], step["items_per_second"],
+                                     step["rss_mb"], step["peak_rss_mb"]])
+                for name in sorted(self.counters):
+                    writer.writerow(["counter", name, "", self.counters[name], "", "", ""])
+                writer.writerow(["total", self.toolName, round(total, 3), "", "", "",
+                                 round(peak / 1048576.0, 1) if peak is not None else ""])
+        else:
+            report = {"tool": self.toolName, "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                      "total_seconds": round(total, 3), "peak_rss_mb": round(peak / 1048576.0, 1) if peak is not None else None,
+                      "steps": self.steps, "counters": self.counters}
+            with open(reportFile, "w") as f:
+                json.dump(report, f, indent=2)
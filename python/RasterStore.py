@@ -0,0 +1,233 @@
+﻿#-------------------------------------------------------------------------------
+# Name: RasterStore.py
+# Purpose: This module keeps a local chunked copy of the rasters of the tools (DEM, ice surface and
+#          ice thickness), so that a raster is decoded by arcpy only once and the next runs over the
+#          same raster read the cells directly. The raster is split into square chunks saved as NumPy
+#          .npy files with a compact dtype (int16 or int32 for integer rasters, with the lowest value
+#          of the dtype as NoData, and float32 with NaN for NoData otherwise), and an index file
+#          (index.json) keeps the grid of the raster and the min/max of each chunk. The chunks
+#          without data are not saved. The chunks are memory-mapped, and a window is read from the
+#          chunks that overlap it only (a view of the chunk if the window is within one chunk).
+#          Each raster is stored in a folder named by the fingerprint of the raster (path, extent,
+#          cell size and files on disk), so a changed raster is decoded again.
+#
+#          Example:
+#              store = RasterStore.OpenStore(arcpy, "dem.tif", "C:\\cache")
+#              arr = store.Window(XMin, YMin, ncols, nrows)
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import json
+import shutil
+import numpy as np
+import ResultCache
+
+ChunkSize = 1024 ##Rows and columns of the chunks
+SmallIntegers = ("U1", "U2", "U4", "S8", "U8", "S16") ##Pixel types stored as int16
+
+def RasterFingerprint(arcpy, raster):
+    ##Fingerprint of a raster: its extent, cell size and files on disk. A raster in a file geodatabase
+    ##uses its statistics instead, as the files of the geodatabase also change with the other datasets.
+    ##Returns None if the raster cannot be fingerprinted (e.g. in memory)
+    desc = arcpy.Describe(raster)
+    props = [desc.catalogPath, desc.extent.XMin, desc.extent.YMin, desc.extent.XMax, desc.extent.YMax, desc.meanCellWidth, desc.meanCellHeight]
+    files = ResultCache.FileFingerprint(desc.catalogPath)
+    if files is not None:
+        return props + files
+    if ".gdb" in desc.catalogPath.lower():
+        try:
+            return props + [arcpy.GetRasterProperties_management(raster, prop).getOutput(0) for prop in ("MINIMUM", "MAXIMUM", "MEAN", "STD")]
+        except:
+            return None
+    return None
+
+def StoreType(raster):
+    ##Dtype and NoData of the chunks of a raster (NoData = None for the float rasters, which use NaN)
+    if not raster.isInteger:
+        return np.float32, None
+    dtype = np.int16 if raster.pixelType in SmallIntegers else np.int32
+    return dtype, int(np.iinfo(dtype).min)
+
+def ChunkRange(chunk, noData):
+    ##Min and max of the cells of a chunk with data, or None if the chunk has no data
+    if noData is None:
+        valid = ~np.isnan(chunk)
+    else:
+        valid = chunk != noData
+    if not valid.any():
+        return None
+    return [float(chunk[valid].min()), float(chunk[valid].max())]
+
+def StoreChunk(arr, rasterNoData, dtype, noData):
+    ##Convert the cells of a chunk read from the raster to the dtype of the store: the NoData of the raster
+    ##(rasterNoData, None if the raster has none) becomes the NoData of the store, or NaN for the float stores
+    chunk = arr.astype(dtype)
+    if rasterNoData is not None and not np.isnan(rasterNoData):
+        chunk[arr == rasterNoData] = np.nan if noData is None else noData
+    return chunk
+
+def WriteStore(folder, grid, ReadChunk, chunkSize=ChunkSize):
+    ##Write the chunks returned by ReadChunk(r0, r1, c0, c1) (rows and columns of the raster, in the dtype of
+    ##the store) and the index with the grid (dictionary of the raster properties of the index) to the folder.
+    ##The chunks are written to a temporary folder that is renamed at the end, so an interrupted build (or a
+    ##build of the same raster by another process) never leaves an incomplete store
+    buildFolder = folder + "_" + str(os.getpid())
+    if os.path.exists(buildFolder):
+        shutil.rmtree(buildFolder, ignore_errors=True)
+    os.makedirs(buildFolder)
+    chunks = {}
+    for r0 in range(0, grid["nrows"], chunkSize):
+        r1 = min(r0 + chunkSize, grid["nrows"])
+        for c0 in range(0, grid["ncols"], chunkSize):
+            c1 = min(c0 + chunkSize, grid["ncols"])
+            chunk = ReadChunk(r0, r1, c0, c1)
+            key = str(r0 // chunkSize) + "_" + str(c0 // chunkSize)
+            valueRange = ChunkRange(chunk, grid["noData"])
+            if valueRange is not None:
+                np.save(os.path.join(buildFolder, key + ".npy"), chunk)
+                chunks[key] = valueRange
+    index = dict(grid)
+    index["chunkSize"] = chunkSize
+    index["chunks"] = chunks
+    with open(os.path.join(buildFolder, "index.json"), "w") as f:
+        json.dump(index, f)
+    try:
+        os.rename(buildFolder, folder)
+    except OSError: ##Built by another process in the meantime
+        shutil.rmtree(buildFolder, ignore_errors=True)
+    return index
+
+def BuildStore(arcpy, raster, folder, fingerprint, chunkSize=ChunkSize):
+    ##Decode the raster chunk by chunk into the folder. The float rasters are read with NaN for NoData
+    raster = arcpy.Raster(raster)
+    dtype, noData = StoreType(raster)
+    cellW, cellH = raster.meanCellWidth, raster.meanCellHeight
+    XMin, YMax = raster.extent.XMin, raster.extent.YMax
+    rasterNoData = raster.noDataValue
+    readNoData = rasterNoData if noData is not None else np.nan
+
+    def ReadChunk(r0, r1, c0, c1):
+        lowerLeft = arcpy.Point(XMin + c0 * cellW, YMax - r1 * cellH)
+        return StoreChunk(arcpy.RasterToNumPyArray(raster, lowerLeft, c1 - c0, r1 - r0, readNoData), rasterNoData, dtype, noData)
+
+    grid = {"fingerprint": fingerprint, "catalogPath": arcpy.Describe(raster).catalogPath, "XMin": XMin, "YMax": YMax,
+            "cellW": cellW, "cellH": cellH, "nrows": raster.height, "ncols": raster.width,
+            "dtype": np.dtype(dtype).name, "noData": noData}
+    return WriteStore(folder, grid, ReadChunk, chunkSize)
+
+def RemoveStaleStores(storeFolder, catalogPath, keep):
+    ##Delete the stores of the earlier versions of a raster (the same path with another fingerprint)
+    for name in os.listdir(storeFolder):
+        indexFile = os.path.join(storeFolder, name, "index.json")
+        if name == keep or not os.path.exists(indexFile):
+            continue
+        try:
+            with open(indexFile) as f:
+                stale = json.load(f)["catalogPath"] == catalogPath
+        except (ValueError, KeyError, OSError):
+            continue
+        if stale:
+            shutil.rmtree(os.path.join(storeFolder, name), ignore_errors=True)
+
+def OpenStore(arcpy, raster, cacheFolder, chunkSize=ChunkSize):
+    ##Store of a raster in the rasters folder of the cache folder, decoded by the first call. Returns None
+    ##if the raster cannot be fingerprinted (e.g. in memory), then the raster is read with arcpy
+    fingerprint = RasterFingerprint(arcpy, raster)
+    if fingerprint is None:
+        return None
+    storeFolder = os.path.join(cacheFolder, "rasters")
+    if not os.path.exists(storeFolder):
+        os.makedirs(storeFolder)
+    name = ResultCache.Fingerprint(fingerprint, chunkSize)
+    folder = os.path.join(storeFolder, name)
+    if not os.path.exists(os.path.join(folder, "index.json")):
+        index = BuildStore(arcpy, raster, folder, fingerprint, chunkSize)
+        RemoveStaleStores(storeFolder, index["catalogPath"], name)
+    return RasterStore(folder)
+
+class RasterStore(object):
+    ##Reader of a raster store: each chunk is memory-mapped by its first access and then kept
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, "index.json")) as f:
+            index = json.load(f)
+        self.XMin = index["XMin"]
+        self.YMax = index["YMax"]
+        self.cellW = index["cellW"]
+        self.cellH = index["cellH"]
+        self.nrows = index["nrows"]
+        self.ncols = index["ncols"]
+        self.chunkSize = index["chunkSize"]
+        self.dtype = np.dtype(index["dtype"])
+        self.noData = index["noData"]
+        self.ranges = index["chunks"]
+        self.chunks = {}
+
+    def Chunk(self, i, j):
+        ##Memory-mapped chunk of chunk row i and chunk column j, or None if the chunk has no data
+        key = str(i) + "_" + str(j)
+        if key not in self.ranges:
+            return None
+        if key not in self.chunks:
+            self.chunks[key] = np.load(os.path.join(self.folder, key + ".npy"), mmap_mode="r")
+        return self.chunks[key]
+
+    def GridOffset(self, XMin, YMin, nrows):
+        ##First row and column of a window (lower left corner and number of rows) on the grid of the store
+        col = (XMin - self.XMin) / self.cellW
+        row = (self.YMax - YMin) / self.cellH - nrows
+        if abs(col - round(col)) > 0.001 or abs(row - round(row)) > 0.001:
+            raise Exception("The window is not aligned with the cells of the stored raster")
+        return int(round(row)), int(round(col))
+
+    def Overlaps(self, r0, c0, nrows, ncols):
+        ##Chunks with data that overlap a window (first row and column, number of rows and columns)
+        a0, a1 = max(r0, 0), min(r0 + nrows, self.nrows)
+        b0, b1 = max(c0, 0), min(c0 + ncols, self.ncols)
+        if a1 <= a0 or b1 <= b0:
+            return []
+        cs = self.chunkSize
+        return [(i, j) for i in range(a0 // cs, (a1 - 1) // cs + 1) for j in range(b0 // cs, (b1 - 1) // cs + 1)
+                if str(i) + "_" + str(j) in self.ranges]
+
+    def Range(self, XMin, YMin, XMax, YMax):
+        ##Min and max of the cells within an extent from the index of the chunks (the chunks overlapping
+        ##the extent), or None if there is no data
+        c0 = int(np.floor((XMin - self.XMin) / self.cellW))
+        c1 = int(np.ceil((XMax - self.XMin) / self.cellW))
+        r0 = int(np.floor((self.YMax - YMax) / self.cellH))
+        r1 = int(np.ceil((self.YMax - YMin) / self.cellH))
+        ranges = [self.ranges[str(i) + "_" + str(j)] for i, j in self.Overlaps(r0, c0, r1 - r0, c1 - c0)]
+        if len(ranges) == 0:
+            return None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    def Window(self, XMin, YMin, ncols, nrows, need=None):
+        ##Cells of a window (lower left corner, number of columns and rows) in the dtype of the store, with
+        ##NoData (NaN for float) outside of the raster. Only the chunks overlapping the window are read, and
+        ##only those with needed cells if need (bool array of the window) is given. A window within one chunk
+        ##is a read-only view of the chunk
+        r0, c0 = self.GridOffset(XMin, YMin, nrows)
+        cs = self.chunkSize
+        i, j = r0 // cs, c0 // cs
+        if r0 >= 0 and c0 >= 0 and r0 + nrows <= min((i + 1) * cs, self.nrows) and c0 + ncols <= min((j + 1) * cs, self.ncols):
+            chunk = self.Chunk(i, j)
+            if chunk is not None:
+                return chunk[r0 - i * cs:r0 - i * cs + nrows, c0 - j * cs:c0 - j * cs + ncols]
+        arr = np.full((nrows, ncols), np.nan if self.noData is None else self.noData, dtype=self.dtype)
+        for i, j in self.Overlaps(r0, c0, nrows, ncols):
+            ##Overlap of the chunk and the window, in the rows and columns of the store
+            a0 = max(r0, i * cs)
+            a1 = min(r0 + nrows, (i + 1) * cs, self.nrows)
+            b0 = max(c0, j * cs)
+            b1 = min(c0 + ncols, (j + 1) * cs, self.ncols)
+            if need is not None and not need[a0 - r0:a1 - r0, b0 - c0:b1 - c0].any():
+                continue
+            arr[a0 - r0:a1 - r0, b0 - c0:b1 - c0] = self.Chunk(i, j)[a0 - i * cs:a1 - i * cs, b0 - j * cs:b1 - j * cs]
+        return arr
+
+    def close(self):
+        self.chunks = {}
@@ -0,0 +1,68 @@
+﻿#-------------------------------------------------------------------------------
+# Name: ResultCache.py
+# Purpose: This module keeps a persistent on-disk cache (SQLite) of the attributes derived for each
+#          outline by AddBasicGlacierAttributes.py and AddDerivedGlacierAttributes.py, so that a rerun
+#          after editing a few outlines only computes the new or changed outlines. Each outline is
+#          keyed by a hash of its geometry (WKB) and of a fingerprint of the inputs of the tool (the
+#          rasters and files by path, size and modification time, and the parameters). Any change of
+#          the geometry or of the inputs gives a new key, so stale results are never reused.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import json
+import sqlite3
+import hashlib
+
+def Fingerprint(*items):
+    ##Hash of a list of JSON-serializable items (parameters and file fingerprints)
+    return hashlib.sha1(json.dumps(items, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def FileFingerprint(path):
+    ##Size and modification time of a file, or of all files of a folder (ESRI grids are folders).
+    ##Returns None if the path is not on disk (e.g. datasets in a geodatabase or in memory)
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+    files = []
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            files.append([os.path.relpath(os.path.join(root, name), path), stat.st_size, stat.st_mtime])
+    files.sort()
+    return [os.path.abspath(path), Fingerprint(files)]
+
+def GeometryKey(wkb, fingerprint):
+    ##Cache key of an outline: hash of the input fingerprint and the geometry
+    sha = hashlib.sha1(fingerprint.encode("utf-8"))
+    sha.update(bytes(wkb))
+    return sha.hexdigest()
+
+def OpenCache(folder, name):
+    ##Open (or create) the cache database of a tool in the cache folder
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    conn = sqlite3.connect(os.path.join(folder, name + ".sqlite"))
+    conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+def LookupResults(conn, keys):
+    ##Cached results of the keys as a dictionary key: {field: value}; missing keys are left out
+    keys = list(set(keys))
+    results = {}
+    for s in range(0, len(keys), 500):
+        chunk = keys[s:s + 500]
+        query = "SELECT key, value FROM results WHERE key IN (" + ",".join("?" * len(chunk)) + ")"
+        for key, value in conn.execute(query, chunk):
+            results[key] = json.loads(value)
+    return results
+
+def StoreResults(conn, results):
+    ##Store the results (dictionary key: {field: value}) in the cache
+    conn.executemany("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)",
+                     [(key, json.dumps(value, default=float)) for key, value in results.items()])
+    conn.commit()
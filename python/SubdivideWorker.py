@@ -0,0 +1,57 @@
+﻿#-------------------------------------------------------------------------------
+# Name: SubdivideWorker.py
+# Purpose: This module holds the work done for one ice mass by DivideforWatersheds.py when the
+#          ice masses are processed in parallel. The dissolved buffer parts of the outlines are
+#          hydrologically independent, so each part is a job for a process pool: the DEM and
+#          outline arrays of the part are filled, divided into basins and merged with the NumPy
+#          engine, and the merged basins are vectorized (Vectorize.py) into a shapefile of the job. The worker
+#          function has to be in an importable module (not the tool script) for the pool.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import numpy as np
+import BasinMerge
+import HydroCore
+import HydroTiles
+import Vectorize
+
+def SubdivideBasins(demArr, outlineArr, cellArea, minRelief, minArea, tileSize, tileFolder):
+    ##Fill, flow direction (force out edge), basins within the outlines (outlineArr > 0) and
+    ##merging of the small relief and small area basins for one DEM array (NoData = NaN).
+    ##Returns the merged label array (0 = no data), the number of basins and of merges
+    nrows, ncols = demArr.shape
+    if tileSize > 0 and (nrows > tileSize or ncols > tileSize):
+        if not os.path.exists(tileFolder):
+            os.makedirs(tileFolder)
+        filled, fdir, basins = HydroTiles.TiledFillFlowBasin(demArr, tileSize, tileFolder)
+    else:
+        filled, fdir, basins = HydroCore.FillFlowBasin(demArr)
+    del fdir
+    basins[outlineArr == 0] = 0
+    return BasinMerge.MergeBasins(basins, filled, 0, cellArea, minRelief, minArea)
+
+def SubdividePart(job):
+    ##Pool worker: subdivide the outlines of one ice mass and vectorize the merged basins.
+    ##Returns the output shapefile, the number of basins and the number of merged basins
+    merged, nBasins, nMerged = SubdivideBasins(job["dem"], job["outlines"], job["cellW"] * job["cellH"], job["minRelief"],
+                                               job["minArea"], job["tileSize"], os.path.join(job["folder"], "hydro_tiles"))
+    if merged.max() == 0:
+        return None, nBasins, nMerged
+
+    parents = BasinMerge.MajorityValues(merged, job["outlines"]) ##Outline (OID) with most of the cells of each basin
+    minCells = int(np.ceil(job["minArea"] / (job["cellW"] * job["cellH"])))
+    polygons = Vectorize.VectorizeLabels(merged, job["XMin"], job["YMin"], job["cellW"], job["cellH"], minCells)
+    del merged
+
+    import arcpy ##Only needed in the worker processes to write the polygons
+    arcpy.env.overwriteOutput = True
+    spatialRef = arcpy.SpatialReference()
+    spatialRef.loadFromString(job["spatialRef"])
+    shapefile = os.path.join(job["folder"], "divided_polys.shp")
+    Vectorize.WritePolygons(arcpy, shapefile, spatialRef, polygons, labelValues={"ParentID": parents})
+    arcpy.DeleteField_management(shapefile, "Id") ##Keep only gridcode and ParentID, the same fields as the serial mode
+    return shapefile, nBasins, nMerged
+
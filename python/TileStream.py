@@ -0,0 +1,95 @@
+﻿#-------------------------------------------------------------------------------
+# Name: TileStream.py
+# Purpose: This module partitions the outlines of a large (e.g. continental) inventory into square
+#          spatial tiles for the streaming mode of PGToolsBatch.py, which runs the tools tile by tile
+#          and appends each finished tile to the output, so that the memory is bounded by the tile
+#          and not by the inventory. Each outline belongs to the tile of the center of its extent.
+#          Outlines close to each other (ice masses) can be kept in one tile, as the watersheds of
+#          DivideforWatersheds.py are derived for the whole ice mass. The finished tiles are written
+#          to an append-only JSON lines checkpoint file, so that a failed run can be resumed with
+#          the tiles that are not finished yet.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import json
+import time
+import numpy as np
+
+def GroupOutlines(boxes, distance, isNear=None):
+    ##Group the outlines (boxes: xmin, ymin, xmax, ymax of each outline) that are within the distance of
+    ##each other, directly or through other outlines. The candidate pairs are the extents within the
+    ##distance (sweep over the sorted xmin), confirmed by isNear(i, j) if given. Without isNear, the
+    ##groups are those of the extents, which include the groups of the outlines and need no geometry.
+    ##Returns the group of each outline
+    n = len(boxes)
+    parent = list(range(n))
+    def Find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    order = np.argsort(boxes[:, 0], kind="stable")
+    for a in range(n):
+        i = order[a]
+        for b in range(a + 1, n):
+            j = order[b]
+            if boxes[j, 0] > boxes[i, 2] + distance:
+                break
+            if boxes[j, 1] > boxes[i, 3] + distance or boxes[i, 1] > boxes[j, 3] + distance:
+                continue
+            ri = Find(i)
+            rj = Find(j)
+            if ri != rj and (isNear is None or isNear(i, j)):
+                parent[max(ri, rj)] = min(ri, rj)
+    return np.array([Find(i) for i in range(n)], dtype=np.int64)
+
+def TileKeys(boxes, tileSize, groups=None):
+    ##Tile key ("column_row" of the tile grid from the origin of the coordinate system) of each outline
+    ##by the center of its extent, or by the center of the extent of its group
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if groups is not None:
+        uniqueGroups, inverse = np.unique(groups, return_inverse=True)
+        groupBoxes = np.empty((len(uniqueGroups), 4))
+        groupBoxes[:, :2] = np.inf
+        groupBoxes[:, 2:] = -np.inf
+        np.minimum.at(groupBoxes[:, 0], inverse, boxes[:, 0])
+        np.minimum.at(groupBoxes[:, 1], inverse, boxes[:, 1])
+        np.maximum.at(groupBoxes[:, 2], inverse, boxes[:, 2])
+        np.maximum.at(groupBoxes[:, 3], inverse, boxes[:, 3])
+        boxes = groupBoxes[inverse]
+    columns = np.floor((boxes[:, 0] + boxes[:, 2]) / 2.0 / tileSize).astype(np.int64)
+    rows = np.floor((boxes[:, 1] + boxes[:, 3]) / 2.0 / tileSize).astype(np.int64)
+    return np.array([str(c) + "_" + str(r) for c, r in zip(columns.tolist(), rows.tolist())])
+
+def ReadCheckpoint(fileName):
+    ##Records of the finished tiles in the checkpoint file (keyed by the tile). An incomplete last line
+    ##(a run stopped while writing it) is ignored
+    finished = {}
+    if not os.path.exists(fileName):
+        return finished
+    with open(fileName) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            finished[record["tile"]] = record
+    return finished
+
+def WriteCheckpoint(fileName, tile, nOutlines, seconds):
+    ##Append the record of a finished tile to the checkpoint file and flush it to the disk (after an
+    ##incomplete last line, the record starts on a new line)
+    record = {"tile": tile, "outlines": int(nOutlines), "seconds": round(seconds, 3), "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+    with open(fileName, "ab+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write((json.dumps(record) + "\n").encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+    return record
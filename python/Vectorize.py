@@ -0,0 +1,342 @@
+﻿#-------------------------------------------------------------------------------
+# Name: Vectorize.py
+# Purpose: This module converts the merged basin label raster of DivideforWatersheds.py to
+#          polygons without RasterToPolygon. The cell edges between different labels are traced
+#          once into rings (the label on the right, so outer rings are clockwise and holes are
+#          counterclockwise), and the rings are split into arcs at the nodes (the vertices where
+#          three or more labels meet, or two labels meet diagonally). Each arc is simplified only
+#          once, in one canonical direction, so the two neighbouring polygons of an arc share the
+#          same simplified vertices and no slivers or gaps are created between them. The small
+#          regions are absorbed by their neighbours on the raster before tracing, instead of
+#          deleting the small polygons and filling the gaps afterwards. The cost of the tracing
+#          is proportional to the length of the boundaries.
+#
+# Created:     10/17/2026
+# Department of Geography, University of Tennessee
+# Knoxville, TN 37996
+#-------------------------------------------------------------------------------
+import os
+import struct
+import numpy as np
+import BasinMerge
+from NumbaCompat import jit
+
+##Side s of a cell: 0 top, 1 right, 2 bottom, 3 left. The edge of side s is travelled with the cell
+##on its right: from its start vertex (row, col offsets from the cell) in the travel direction
+SideStart = np.array([[0, 0], [0, 1], [1, 1], [1, 0]], dtype=np.int64)
+SideTravel = np.array([[0, 1], [1, 0], [0, -1], [-1, 0]], dtype=np.int64)
+SideOut = np.array([[-1, 0], [0, 1], [1, 0], [0, -1]], dtype=np.int64) ##Neighbour across the side
+
+def AbsorbSmallRegions(labels, minCells, regions=None):
+    ##Merge the 4-connected regions of less than minCells cells into the neighbour sharing the longest
+    ##boundary, and drop the small regions without neighbours. Returns the new labels (0 = no data).
+    ##regions is the int32 grid of the regions and the new labels (e.g. memory-mapped for a large raster),
+    ##filled with zeros; allocated if None. The raster is read by bands of rows
+    regions, nRegions = BasinMerge.LabelRegions(labels, 0, regions)
+    if nRegions == 0:
+        return labels
+    count = np.zeros(nRegions + 1, dtype=np.int64)
+    values = np.zeros(nRegions + 1, dtype=labels.dtype)
+    for r0 in range(0, labels.shape[0], BasinMerge.BandRows):
+        bandRegions = regions[r0:r0 + BasinMerge.BandRows].ravel()
+        count += np.bincount(bandRegions, minlength=nRegions + 1)
+        values[bandRegions] = labels[r0:r0 + BasinMerge.BandRows].ravel() ##All cells of a region have its label
+    isSmall = count < minCells
+    isSmall[0] = False
+    if not np.any(isSmall):
+        return labels
+    adjacency = BasinMerge.RegionAdjacency(regions, nRegions)
+    parent = list(range(nRegions + 1))
+    dummy = np.zeros(nRegions + 1)
+    BasinMerge.MergeSmallRegions(parent, adjacency, dummy, dummy, count, lambda r: count[r] < minCells, lambda r: (count[r], r))
+    roots = np.array([BasinMerge.Find(parent, r) for r in range(nRegions + 1)], dtype=np.int64)
+    newValues = values[roots]
+    newValues[count[roots] < minCells] = 0 ##Small regions without neighbours
+    newValues[0] = 0
+    return BasinMerge.Relabel(regions, newValues)
+
+@jit(nopython=True)
+def LabelAt(labels, r, c):
+    ##Label of a cell, 0 outside of the raster
+    if r < 0 or c < 0 or r >= labels.shape[0] or c >= labels.shape[1]:
+        return 0
+    return labels[r, c]
+
+@jit(nopython=True)
+def BoundaryEdges(labels):
+    ##Keys (cell index * 4 + side) of all cell sides between different labels, with a label on the
+    ##right (inside) of the edge; sorted, as the cells are visited in row-major order
+    nrows, ncols = labels.shape
+    n = 0
+    for i in range(nrows):
+        for j in range(ncols):
+            p = labels[i, j]
+            if p == 0:
+                continue
+            for s in range(4):
+                if LabelAt(labels, i + SideOut[s, 0], j + SideOut[s, 1]) != p:
+                    n += 1
+    keys = np.empty(n, dtype=np.int64)
+    n = 0
+    for i in range(nrows):
+        for j in range(ncols):
+            p = labels[i, j]
+            if p == 0:
+                continue
+            for s in range(4):
+                if LabelAt(labels, i + SideOut[s, 0], j + SideOut[s, 1]) != p:
+                    keys[n] = (i * ncols + j) * 4 + s
+                    n += 1
+    return keys
+
+@jit(nopython=True)
+def NextEdge(labels, i, j, s):
+    ##Key of the next boundary edge of the label of cell (i, j) after its side s. The right turn (around
+    ##the same cell) is tried first, so two cells of the label that only touch diagonally are not joined
+    ncols = labels.shape[1]
+    p = labels[i, j]
+    right = (s + 1) % 4
+    if LabelAt(labels, i + SideOut[right, 0], j + SideOut[right, 1]) != p:
+        return (i * ncols + j) * 4 + right
+    a = i + SideTravel[s, 0]
+    b = j + SideTravel[s, 1]
+    if LabelAt(labels, a + SideOut[s, 0], b + SideOut[s, 1]) != p:
+        return (a * ncols + b) * 4 + s ##Straight on along the next cell
+    c = a + SideOut[s, 0]
+    d = b + SideOut[s, 1]
+    return (c * ncols + d) * 4 + (s + 3) % 4 ##Left turn
+
+@jit(nopython=True)
+def IsNode(labels, r, c):
+    ##A vertex is a node if three or four labels meet, or two labels meet diagonally
+    a = LabelAt(labels, r - 1, c - 1)
+    b = LabelAt(labels, r - 1, c)
+    d = LabelAt(labels, r, c - 1)
+    e = LabelAt(labels, r, c)
+    distinct = 1
+    if b != a:
+        distinct += 1
+    if d != a and d != b:
+        distinct += 1
+    if e != a and e != b and e != d:
+        distinct += 1
+    if distinct >= 3:
+        return True
+    return distinct == 2 and a == e and b == d
+
+@jit(nopython=True)
+def TraceRings(labels, keys):
+    ##Follow the boundary edges into closed rings. Returns the vertex index (row * (ncols + 1) + col) of
+    ##each ring vertex, whether it is a node, the CSR offsets of the rings and the label of each ring
+    ncols = labels.shape[1]
+    n = len(keys)
+    visited = np.zeros(n, dtype=np.bool_)
+    vertices = np.empty(n, dtype=np.int64)
+    nodes = np.empty(n, dtype=np.bool_)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    ringLabels = np.empty(n, dtype=np.int64)
+    nRings = 0
+    m = 0
+    for e in range(n):
+        if visited[e]:
+            continue
+        cell = keys[e] // 4
+        ringLabels[nRings] = labels[cell // ncols, cell % ncols]
+        k = e
+        while not visited[k]:
+            visited[k] = True
+            cell = keys[k] // 4
+            s = keys[k] % 4
+            i = cell // ncols
+            j = cell % ncols
+            r = i + SideStart[s, 0]
+            c = j + SideStart[s, 1]
+            vertices[m] = r * (ncols + 1) + c
+            nodes[m] = IsNode(labels, r, c)
+            m += 1
+            k = np.searchsorted(keys, NextEdge(labels, i, j, s))
+        nRings += 1
+        offsets[nRings] = m
+    return vertices, nodes, offsets[:nRings + 1], ringLabels[:nRings]
+
+@jit(nopython=True)
+def DouglasPeucker(x, y, keep, tolerance):
+    ##Simplify a line: keep marks the vertices that must be kept (at least the two ends), and the
+    ##vertices farther than the tolerance from the simplified line between them are added
+    keep = keep.copy()
+    n = len(x)
+    stack = np.empty((n, 2), dtype=np.int64)
+    top = 0
+    last = 0
+    for k in range(1, n):
+        if keep[k]:
+            stack[top, 0] = last
+            stack[top, 1] = k
+            top += 1
+            last = k
+    while top > 0:
+        top -= 1
+        a = stack[top, 0]
+        b = stack[top, 1]
+        if b - a < 2:
+            continue
+        dx = x[b] - x[a]
+        dy = y[b] - y[a]
+        length2 = dx * dx + dy * dy
+        best = -1
+        bestDist = tolerance
+        for k in range(a + 1, b):
+            if length2 > 0:
+                t = ((x[k] - x[a]) * dx + (y[k] - y[a]) * dy) / length2
+                t = min(max(t, 0.0), 1.0)
+            else:
+                t = 0.0
+            px = x[a] + t * dx - x[k]
+            py = y[a] + t * dy - y[k]
+            dist = np.sqrt(px * px + py * py)
+            if dist > bestDist:
+                best = k
+                bestDist = dist
+        if best >= 0:
+            keep[best] = True
+            stack[top, 0] = a
+            stack[top, 1] = best
+            stack[top + 1, 0] = best
+            stack[top + 1, 1] = b
+            top += 2
+    return keep
+
+def SimplifyArc(arc, ncols1, XMin, YMax, cellW, cellH, tolerance, closed):
+    ##Simplified coordinates of an arc (vertex indices in canonical direction). The middle vertex
+    ##(the thirds of a closed arc) is always kept, so that no ring collapses
+    x = XMin + (arc % ncols1) * cellW
+    y = YMax - (arc // ncols1) * cellH
+    keep = np.zeros(len(arc), dtype=np.bool_)
+    keep[0] = keep[-1] = True
+    if closed:
+        keep[len(arc) // 3] = keep[2 * len(arc) // 3] = True
+    else:
+        keep[len(arc) // 2] = True
+    keep = DouglasPeucker(x, y, keep, tolerance)
+    return np.column_stack((x[keep], y[keep]))
+
+def Canonical(arc):
+    ##Canonical direction of an arc, so that the two polygons of the arc simplify the same vertices.
+    ##Returns the arc, whether it was reversed, and its key (the first two vertices, unique per arc)
+    reverse = arc[::-1]
+    if (arc[0], arc[1]) <= (reverse[0], reverse[1]):
+        return arc, False, (int(arc[0]), int(arc[1]))
+    return reverse, True, (int(reverse[0]), int(reverse[1]))
+
+def SignedArea(xy):
+    ##Shoelace area of a closed ring (negative if clockwise)
+    x = xy[:, 0]
+    y = xy[:, 1]
+    return 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+def PointInRing(x, y, ring):
+    ##Ray casting test of a point in a closed ring
+    x0 = ring[:-1, 0]
+    y0 = ring[:-1, 1]
+    x1 = ring[1:, 0]
+    y1 = ring[1:, 1]
+    cross = (y0 > y) != (y1 > y)
+    xi = x0[cross] + (y - y0[cross]) * (x1[cross] - x0[cross]) / (y1[cross] - y0[cross])
+    return np.sum(xi > x) % 2 == 1
+
+def PolygonWKB(rings):
+    ##Well-known binary of a polygon from its closed rings (the outer ring first)
+    parts = [struct.pack("<BII", 1, 3, len(rings))]
+    for ring in rings:
+        parts.append(struct.pack("<I", len(ring)))
+        parts.append(np.ascontiguousarray(ring, dtype="<f8").tobytes())
+    return b"".join(parts)
+
+def VectorizeLabels(labels, XMin, YMin, cellW, cellH, minCells=1, tolerance=None, regions=None):
+    ##Convert a label raster (0 = no data; the lower left corner at XMin, YMin) to polygons: one polygon
+    ##for each outer ring with its holes. The arcs are simplified with the Douglas-Peucker tolerance
+    ##(default: one cell, which removes the stair steps of the cell edges; 0 = only the collinear
+    ##vertices). regions is the zero int32 grid used to absorb the small regions (see AbsorbSmallRegions).
+    ##The labels are not copied if they are an integer array, so they may be memory-mapped. Returns a
+    ##list of (label, WKB) of the polygons
+    if labels.dtype.kind not in "iu":
+        labels = labels.astype(np.int64)
+    labels = np.ascontiguousarray(labels)
+    if minCells > 1:
+        labels = AbsorbSmallRegions(labels, minCells, regions)
+    if tolerance is None:
+        tolerance = max(cellW, cellH)
+    nrows, ncols = labels.shape
+    ncols1 = ncols + 1
+    YMax = YMin + nrows * cellH
+    keys = BoundaryEdges(labels)
+    if len(keys) == 0:
+        return []
+    vertices, nodes, offsets, ringLabels = TraceRings(labels, keys)
+
+    ##Split each ring at its nodes into arcs and simplify each arc once
+    arcCache = {}
+    rings = []
+    for k in range(len(ringLabels)):
+        verts = vertices[offsets[k]:offsets[k+1]]
+        nodeIdx = np.flatnonzero(nodes[offsets[k]:offsets[k+1]])
+        if len(nodeIdx) == 0:
+            ##Closed arc (e.g. an island in one other label): start it at its smallest vertex
+            start = int(np.argmin(verts))
+            arcs = [np.concatenate((verts[start:], verts[:start], verts[start:start+1]))]
+        else:
+            verts = np.concatenate((verts[nodeIdx[0]:], verts[:nodeIdx[0]]))
+            cuts = np.append(nodeIdx - nodeIdx[0], len(verts))
+            closedVerts = np.append(verts, verts[0])
+            arcs = [closedVerts[cuts[a]:cuts[a+1]+1] for a in range(len(cuts) - 1)]
+        pieces = []
+        for arc in arcs:
+            canon, reversed_, key = Canonical(arc)
+            if key not in arcCache:
+                arcCache[key] = SimplifyArc(canon, ncols1, XMin, YMax, cellW, cellH, tolerance, len(nodeIdx) == 0)
+            coords = arcCache[key]
+            pieces.append(coords[::-1] if reversed_ else coords)
+        ring = np.vstack([pieces[0]] + [piece[1:] for piece in pieces[1:]])
+        ##The orientation is taken from the unsimplified ring (the cell corners)
+        fullRing = np.column_stack((verts % ncols1, -(verts // ncols1))).astype(np.float64)
+        fullRing = np.vstack((fullRing, fullRing[:1]))
+        rings.append((int(ringLabels[k]), SignedArea(fullRing) < 0, ring))
+
+    ##Polygons: each outer ring with the holes of its label that it contains
+    polygons = []
+    byLabel = {}
+    for label, isOuter, ring in rings:
+        byLabel.setdefault(label, ([], []))[0 if isOuter else 1].append(ring)
+    for label in sorted(byLabel):
+        outers, holes = byLabel[label]
+        if len(outers) == 1:
+            polygons.append((label, PolygonWKB(outers + holes)))
+            continue
+        assigned = [[] for outer in outers]
+        for hole in holes:
+            for o in range(len(outers)):
+                if PointInRing(hole[0, 0], hole[0, 1], outers[o]):
+                    assigned[o].append(hole)
+                    break
+        for o in range(len(outers)):
+            polygons.append((label, PolygonWKB([outers[o]] + assigned[o])))
+    return polygons
+
+def WritePolygons(arcpy, featureClass, spatialRef, polygons, labelField="gridcode", labelValues=None):
+    ##Write the polygons (label, WKB) to a new polygon feature class with the label field and the
+    ##optional LONG fields of labelValues (field name: array of the values indexed by the label)
+    if labelValues is None:
+        labelValues = {}
+    path, name = os.path.split(featureClass)
+    if path == "": ##A name only: the dataset is in the current workspace
+        path = arcpy.env.workspace
+    arcpy.CreateFeatureclass_management(path, name, "POLYGON", spatial_reference=spatialRef)
+    arcpy.AddField_management(featureClass, labelField, "LONG")
+    valueFields = list(labelValues.keys())
+    for field in valueFields:
+        arcpy.AddField_management(featureClass, field, "LONG")
+    with arcpy.da.InsertCursor(featureClass, ["SHAPE@WKB", labelField] + valueFields) as cursor:
+        for label, wkb in polygons:
+            cursor.insertRow([bytearray(wkb), label] + [int(labelValues[field][label]) for field in valueFields])
+    del cursor
+    return featureClass